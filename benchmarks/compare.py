@@ -0,0 +1,55 @@
+"""
+Compare two benchmark result files written by benchmarks/run.py.
+
+Usage: python benchmarks/compare.py baseline.json new.json
+"""
+
+import argparse
+import json
+
+
+def key(result: dict) -> tuple:
+    params = {
+        k: v
+        for k, v in result.items()
+        if k
+        not in {
+            "rows",
+            "seconds",
+            "rows_per_sec",
+            "bytes",
+            "raw_bytes",
+            "mb_per_sec",
+        }
+    }
+    return tuple(sorted(params.items()))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("baseline")
+    parser.add_argument("new")
+    args = parser.parse_args()
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.new) as f:
+        new = json.load(f)
+
+    print(f"baseline: {baseline['commit']}  new: {new['commit']}")
+    old_results = {key(r): r for r in baseline["results"]}
+    for result in new["results"]:
+        old = old_results.get(key(result))
+        label = " ".join(f"{k}={v}" for k, v in key(result))
+        if old is None:
+            print(f"{label:50} {result['rows_per_sec']:12,.0f} rows/s  (new)")
+            continue
+        change = result["rows_per_sec"] / old["rows_per_sec"] - 1
+        print(
+            f"{label:50} {old['rows_per_sec']:12,.0f} -> "
+            f"{result['rows_per_sec']:12,.0f} rows/s  {change:+7.1%}"
+        )
+
+
+if __name__ == "__main__":
+    main()
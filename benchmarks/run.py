@@ -0,0 +1,335 @@
+"""
+Benchmark suite for the read/write/shuffle/pipeline hot paths.
+
+Generates a synthetic dataset and measures rows/s and MB/s of WriteDF.append,
+iterrows, FlatMap, BatchMap, Shuffle (at several nparts) and run_pipeline, on local
+disk and, with --s3, against a local moto S3 server (requires moto[server]).
+Results are written as JSON, to be compared across commits with
+benchmarks/compare.py.
+
+Usage:
+    python benchmarks/run.py [--rows N] [--width N] [--nparts 4,16,64]
+                             [--batch-size N] [--s3] [--output results.json]
+"""
+
+import argparse
+import json
+import logging
+import os
+import platform
+import shutil
+import subprocess
+import tempfile
+import time
+from contextlib import contextmanager
+from typing import Any, Iterator
+
+from lightningdb.df import LightningCtx
+from lightningdb.pipeline import run_pipeline
+from lightningdb.rw.read_df import iterbatches, iterchunks, iterrows
+from lightningdb.rw.s3cache import configure_cache
+from lightningdb.rw.stats import recording
+from lightningdb.rw.write_df import SPLIT_SIZE, WriteDF
+from lightningdb.stages.aggregate import Aggregate
+from lightningdb.stages.batchmap import BatchMap
+from lightningdb.stages.compact import compact_files
+from lightningdb.stages.const import Const
+from lightningdb.stages.flatmap import FlatMap
+from lightningdb.stages.shuffle import Shuffle
+
+
+def make_schema(width: int) -> dict:
+    """
+    A record schema with an `id` key followed by width columns cycling through
+    long, double and string.
+    """
+    types = ["long", "double", "string"]
+    fields = [{"name": "id", "type": "long"}]
+    fields += [{"name": f"c{i}", "type": types[i % 3]} for i in range(width)]
+    return {"type": "record", "name": "Bench", "fields": fields}
+
+
+def make_rows(n: int, width: int) -> Iterator[dict]:
+    for i in range(n):
+        row = {"id": i}
+        for c in range(width):
+            if c % 3 == 0:
+                row[f"c{c}"] = i * (c + 1)
+            elif c % 3 == 1:
+                row[f"c{c}"] = i / (c + 1)
+            else:
+                row[f"c{c}"] = f"value-{i % 1000}-{c}"
+        yield row
+
+
+class Bench:
+    def __init__(self, storage: str) -> None:
+        self.storage = storage
+        self.results = []
+
+    @contextmanager
+    def measure(self, name: str, rows: int, **params: Any) -> Iterator[list]:
+        """
+        Time the block and record the files written in it. MB/s is computed from
+        the uncompressed size of the files written, or of the files read if
+        `read_stats` is set in params.
+        """
+        read_stats = params.pop("read_stats", None)
+        with recording() as stats:
+            start = time.perf_counter()
+            yield stats
+            seconds = time.perf_counter() - start
+
+        measured = read_stats if read_stats is not None else stats
+        raw_bytes = sum(s.raw_bytes for s in measured)
+        result = {
+            "name": name,
+            "storage": self.storage,
+            **params,
+            "rows": rows,
+            "seconds": seconds,
+            "rows_per_sec": rows / seconds,
+            "bytes": sum(s.bytes for s in measured),
+            "raw_bytes": raw_bytes,
+            "mb_per_sec": raw_bytes / seconds / 1e6,
+        }
+        self.results.append(result)
+        print(
+            f"{self.storage:5} {name:24} {json.dumps(params):24}"
+            f" {result['rows_per_sec']:12,.0f} rows/s {result['mb_per_sec']:8.1f} MB/s"
+        )
+
+
+def run_suite(bench: Bench, repodir: str, args) -> None:
+    schema = make_schema(args.width)
+    rows = list(make_rows(args.rows, args.width))
+
+    # Write: the input dataset, in args.input_parts parts
+    input_pfiles = []
+    with bench.measure("WriteDF.append", args.rows) as written:
+        per_part = -(-args.rows // args.input_parts)
+        for part in range(args.input_parts):
+            dir = os.path.join(repodir, "input", str(part))
+            writer = WriteDF(dir, schema)
+            for row in rows[part * per_part : (part + 1) * per_part]:
+                writer.append(row)
+            writer.close()
+            input_pfiles.append([os.path.join(dir, file) for file in writer.files])
+    input_stats = list(written)
+    input_files = [file for files in input_pfiles for file in files]
+
+    with bench.measure("iterrows", args.rows, read_stats=input_stats):
+        for _ in iterrows(input_files):
+            pass
+
+    if bench.storage == "s3":
+        # Reads of a hot dataframe through the local S3 cache: one cold pass fills it
+        configure_cache(os.path.join(args.tmpdir, "s3cache"))
+        try:
+            for name in ["iterrows(cache miss)", "iterrows(cache hit)"]:
+                with bench.measure(name, args.rows, read_stats=input_stats):
+                    for _ in iterrows(input_files):
+                        pass
+        finally:
+            configure_cache(None)
+
+    # Columnar reads, of all columns and of the numeric key only
+    readers = {"iterchunks": iterchunks}
+    try:
+        import numpy  # noqa: F401
+
+        readers["iterbatches"] = iterbatches
+    except ImportError:
+        pass
+    for name, read in readers.items():
+        for columns in [None, ["id"]]:
+            params = {"columns": len(columns) if columns else args.width + 1}
+            with bench.measure(name, args.rows, read_stats=input_stats, **params):
+                for _ in read(input_files, args.batch_size, columns=columns):
+                    pass
+
+    # A dataframe of non-null longs only, which iterbatches decodes block by block
+    # straight into arrays instead of row by row
+    if "iterbatches" in readers:
+        long_schema = {
+            "type": "record",
+            "name": "Longs",
+            "fields": [{"name": f"c{c}", "type": "long"} for c in range(args.width)],
+        }
+        dir = os.path.join(repodir, "longs")
+        writer = WriteDF(dir, long_schema)
+        for i in range(args.rows):
+            writer.append({f"c{c}": i * (c + 1) for c in range(args.width)})
+        writer.close()
+        long_files = [os.path.join(dir, file) for file in writer.files]
+        long_stats = writer.stats
+        for name, read in readers.items():
+            params = {"columns": args.width}
+            with bench.measure(
+                f"{name}(longs)", args.rows, read_stats=long_stats, **params
+            ):
+                for _ in read(long_files, args.batch_size):
+                    pass
+
+    stages = {
+        "FlatMap": FlatMap(fn=lambda row: [row], avro_schema=schema),
+        "BatchMap(rows)": BatchMap(
+            fn=lambda rows: rows, avro_schema=schema, batch_size=args.batch_size
+        ),
+    }
+    try:
+        import numpy  # noqa: F401
+
+        stages["BatchMap(numpy)"] = BatchMap(
+            fn=lambda cols: cols,
+            avro_schema=schema,
+            batch_size=args.batch_size,
+            format="numpy",
+        )
+    except ImportError:
+        pass
+
+    for name, stage in stages.items():
+        with bench.measure(name, args.rows):
+            for part, files in enumerate(input_pfiles):
+                stage.run(files, os.path.join(repodir, name, str(part)))
+
+    for nparts in args.nparts:
+        stage = Shuffle(nparts=nparts, key="id", avro_schema=schema)
+        shuffle_dir = os.path.join(repodir, f"shuffle{nparts}")
+        with bench.measure("Shuffle", args.rows, nparts=nparts):
+            shuffle_pfiles = stage.runall(input_pfiles, shuffle_dir)
+
+    # Block-copy compaction of all the files of the last shuffle
+    shuffle_files = [
+        os.path.join(shuffle_dir, f) for files in shuffle_pfiles for f in files
+    ]
+    with bench.measure("Compact", args.rows, nparts=nparts):
+        compact_files(shuffle_files, os.path.join(repodir, "compact"), SPLIT_SIZE)
+
+    if args.width >= 3:
+        # GROUP BY a string column with 1000 distinct values, sum of a long column
+        agg_schema = {
+            "type": "record",
+            "name": "BenchAgg",
+            "fields": [
+                {"name": "c2", "type": "string"},
+                {"name": "n", "type": "long"},
+                {"name": "total", "type": ["null", "long"]},
+            ],
+        }
+        stage = Aggregate(
+            nparts=args.nparts[0],
+            keys=["c2"],
+            aggs={"n": ("count", None), "total": ("sum", "c0")},
+            avro_schema=agg_schema,
+        )
+        with bench.measure("Aggregate", args.rows, read_stats=input_stats):
+            stage.runall(input_pfiles, os.path.join(repodir, "aggregate"))
+
+    pipeline_rows = rows[: args.pipeline_rows]
+    pipeline = [
+        Const(items=pipeline_rows, avro_schema=schema),
+        FlatMap(fn=lambda row: [row], avro_schema=schema),
+        Shuffle(nparts=args.nparts[0], key="id", avro_schema=schema),
+        FlatMap(fn=lambda row: [row], avro_schema=schema),
+    ]
+    ctx = LightningCtx(os.path.join(args.tmpdir, f"{bench.storage}.db"), repodir)
+    with bench.measure("run_pipeline", len(pipeline_rows)) as stats:
+        run_pipeline(ctx, "bench", pipeline, incremental=False)
+        # Stages record their stats into the pipeline's own recordings
+        stats.extend(ctx.get_part_stats(f"bench@{len(pipeline) - 1}").values())
+
+
+@contextmanager
+def local_s3() -> Iterator[str]:
+    """
+    Start a moto S3 server and point boto3 at it. Yields the repodir URI.
+    """
+    import boto3
+    from moto.server import ThreadedMotoServer
+
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+    server = ThreadedMotoServer(port=0)
+    server.start()
+    host, port = server.get_host_and_port()
+    env = {
+        "AWS_ENDPOINT_URL": f"http://{host}:{port}",
+        "AWS_ACCESS_KEY_ID": "bench",
+        "AWS_SECRET_ACCESS_KEY": "bench",
+        "AWS_DEFAULT_REGION": "us-east-1",
+    }
+    saved = {k: os.environ.get(k) for k in env}
+    os.environ.update(env)
+    try:
+        boto3.client("s3").create_bucket(Bucket="bench")
+        yield "s3://bench/repo"
+    finally:
+        for k, v in saved.items():
+            if v is None:
+                os.environ.pop(k, None)
+            else:
+                os.environ[k] = v
+        server.stop()
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=200_000)
+    parser.add_argument("--width", type=int, default=10)
+    parser.add_argument("--input-parts", type=int, default=4)
+    parser.add_argument(
+        "--nparts", type=lambda s: [int(n) for n in s.split(",")], default=[4, 16, 64]
+    )
+    parser.add_argument("--batch-size", type=int, default=10_000)
+    parser.add_argument("--pipeline-rows", type=int, default=50_000)
+    parser.add_argument("--s3", action="store_true", help="also run against moto S3")
+    parser.add_argument("--output", default="bench_results.json")
+    args = parser.parse_args()
+
+    args.tmpdir = tempfile.mkdtemp()
+    benches = []
+    try:
+        bench = Bench("local")
+        run_suite(bench, os.path.join(args.tmpdir, "repo"), args)
+        benches.append(bench)
+
+        if args.s3:
+            with local_s3() as repodir:
+                bench = Bench("s3")
+                run_suite(bench, repodir, args)
+                benches.append(bench)
+    finally:
+        shutil.rmtree(args.tmpdir)
+
+    report = {
+        "commit": git_commit(),
+        "timestamp": time.time(),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+        "params": {
+            "rows": args.rows,
+            "width": args.width,
+            "input_parts": args.input_parts,
+            "batch_size": args.batch_size,
+            "pipeline_rows": args.pipeline_rows,
+        },
+        "results": [result for bench in benches for result in bench.results],
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
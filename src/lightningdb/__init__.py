@@ -1,25 +1,51 @@
+from lightningdb.dag import Node, run_dag
 from lightningdb.df import LightningCtx
+from lightningdb.executor import InlineExecutor, ProcessExecutor, RQExecutor
 from lightningdb.pipeline import run_pipeline
 from lightningdb.pipeline_stage import PipelineStage
-from lightningdb.rw.read_df import iterrows
+from lightningdb.rw.read_df import iterbatches, iterchunks, iterrows
+from lightningdb.rw.s3cache import configure_cache
+from lightningdb.rw.write_avro import WriteOptions
 from lightningdb.rw.write_df import WriteDF
+from lightningdb.stages.aggregate import Aggregate
+from lightningdb.stages.batchmap import BatchMap
+from lightningdb.stages.compact import Compact
 from lightningdb.stages.const import Const
 from lightningdb.stages.fetch import Fetch
 from lightningdb.stages.flatmap import FlatMap
+from lightningdb.stages.join import Join
 from lightningdb.stages.multifetch import MultiFetch
+from lightningdb.stages.repartition import Repartition
 from lightningdb.stages.shuffle import Shuffle
+from lightningdb.stages.sort import GlobalSort, Sort
 from lightningdb.stages.sql import Sql
 
 __all__ = [
     "LightningCtx",
     "FlatMap",
+    "BatchMap",
     "Sql",
     "Fetch",
     "MultiFetch",
     "Const",
     "Shuffle",
+    "Repartition",
+    "Compact",
+    "Join",
+    "Sort",
+    "GlobalSort",
+    "Aggregate",
     "PipelineStage",
     "iterrows",
+    "iterchunks",
+    "iterbatches",
+    "configure_cache",
     "WriteDF",
+    "WriteOptions",
     "run_pipeline",
+    "run_dag",
+    "Node",
+    "InlineExecutor",
+    "ProcessExecutor",
+    "RQExecutor",
 ]
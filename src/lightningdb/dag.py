@@ -0,0 +1,110 @@
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Any, Optional
+
+from pydantic import BaseModel
+from rich.progress import Progress
+
+from lightningdb.df import LightningCtx
+from lightningdb.executor import Executor, InlineExecutor
+from lightningdb.pipeline import ThroughputColumn, run_group
+
+
+class Node(BaseModel):
+    """
+    A stage of a DAG pipeline.
+
+    Attributes:
+        name: The name of the df produced by the stage.
+        stage: The stage to run.
+        inputs: The dfs read by the stage: other nodes of the DAG, or dfs already in
+            the ctx. Stages with several inputs must implement run_multi() (Join).
+    """
+
+    name: str
+    stage: Any
+    inputs: list[str] = []
+
+
+def check_dag(ctx: LightningCtx, nodes: list[Node]) -> None:
+    """
+    Check that node names are unique, that inputs exist and that there is no cycle.
+    """
+    names = [node.name for node in nodes]
+    if len(set(names)) != len(names):
+        raise ValueError(f"Duplicate node names in {names}")
+    for node in nodes:
+        for df in node.inputs:
+            if df not in names and ctx.get_nparts(df) == 0:
+                raise ValueError(f"Unknown input {df} of node {node.name}")
+
+    done = set()
+    pending = list(nodes)
+    while pending:
+        ready = [
+            n for n in pending if all(i in done or i not in names for i in n.inputs)
+        ]
+        if not ready:
+            raise ValueError(f"Cycle between nodes {[n.name for n in pending]}")
+        done.update(n.name for n in ready)
+        pending = [n for n in pending if n.name not in done]
+
+
+def run_dag(
+    ctx: LightningCtx,
+    nodes: list[Node],
+    executor: Optional[Executor] = None,
+    max_concurrency: int = 4,
+    incremental: bool = True,
+    profile: bool = False,
+):
+    """
+    Run a DAG of stages, storing the output of each node as the df named after it.
+
+    A node runs once all its input nodes are done. Independent branches run
+    concurrently, up to max_concurrency nodes at a time, each sharing the executor.
+    Nodes are not fused.
+
+    Args:
+        ctx (LightningCtx): The context holding the df metadata.
+        nodes (list[Node]): The nodes, in any order.
+        executor (Executor): Runs the parts of per-part stages. Defaults to
+            InlineExecutor.
+        max_concurrency (int): The maximum number of nodes running at once.
+        incremental, profile: See run_pipeline.
+    """
+    check_dag(ctx, nodes)
+    if executor is None:
+        executor = InlineExecutor()
+
+    names = {node.name for node in nodes}
+    done = set()
+    pending = list(nodes)
+    running: dict[Future, Node] = {}
+
+    with Progress(*Progress.get_default_columns(), ThroughputColumn()) as progress:
+        with ThreadPoolExecutor(max_concurrency) as pool:
+            while pending or running:
+                for node in list(pending):
+                    if all(i in done or i not in names for i in node.inputs):
+                        pending.remove(node)
+                        future = pool.submit(
+                            run_group,
+                            ctx,
+                            progress,
+                            node.stage,
+                            node.stage.__class__.__name__,
+                            [node.name],
+                            node.inputs,
+                            executor,
+                            False,
+                            incremental,
+                            profile,
+                        )
+                        running[future] = node
+
+                # A failure is raised once the nodes already running have finished
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    node = running.pop(future)
+                    future.result()
+                    done.add(node.name)
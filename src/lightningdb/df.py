@@ -1,7 +1,17 @@
+import functools
+import heapq
 import json
 import os
 import sqlite3
-from typing import Optional
+import threading
+from itertools import islice
+from typing import Any, Optional
+
+from lightningdb.executor import run_tasks
+from lightningdb.rw.metrics import Metrics
+from lightningdb.rw.read_df import iterrows
+from lightningdb.rw.sample import count_records, head_uris, sample_blocks, sample_part
+from lightningdb.rw.stats import ColumnStats, FileStats, merge_stats
 
 schema = """
 create table if not exists df(
@@ -10,8 +20,84 @@ create table if not exists df(
     files json not null,
     primary key(name, part)
 );
+
+create table if not exists fingerprint(
+    name text not null,
+    part integer not null,
+    fingerprint text not null,
+    primary key(name, part)
+);
+
+create table if not exists file_stats(
+    name text not null,
+    part integer not null,
+    file text not null,
+    rows integer not null,
+    bytes integer not null,
+    raw_bytes integer not null,
+    blocks json not null default '[]',
+    primary key(name, part, file)
+);
+
+create table if not exists column_stats(
+    name text not null,
+    part integer not null,
+    file text not null,
+    column text not null,
+    min text,
+    max text,
+    nulls integer not null,
+    primary key(name, part, file, column)
+);
+
+create table if not exists metrics(
+    name text not null,
+    part integer not null,
+    stage text not null,
+    seconds real not null,
+    rows_in integer not null,
+    rows_out integer not null,
+    bytes_in integer not null,
+    bytes_out integer not null,
+    read_seconds real not null,
+    write_seconds real not null,
+    decode_seconds real not null,
+    encode_seconds real not null,
+    fn_seconds real not null,
+    cache_hits integer not null default 0,
+    cache_misses integer not null default 0,
+    profile text,
+    primary key(name, part)
+);
 """
 
+# Tables holding per-part metadata, cleared together with the part
+PART_TABLES = ["df", "fingerprint", "file_stats", "column_stats", "metrics"]
+
+# Columns added after the first release of their table, created on open if missing
+ADDED_COLUMNS = [
+    ("metrics", "cache_hits", "integer not null default 0"),
+    ("metrics", "cache_misses", "integer not null default 0"),
+    ("file_stats", "blocks", "json not null default '[]'"),
+]
+
+# Part number under which the metrics of stages run on all parts at once are saved
+ALL_PARTS = -1
+
+
+def synchronized(method):
+    """
+    Serialize the calls to a LightningCtx method, so that one ctx (and its SQLite
+    connection) can be shared by the threads running the branches of a DAG.
+    """
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self.lock:
+            return method(self, *args, **kwargs)
+
+    return wrapper
+
 
 class LightningCtx:
     """
@@ -28,35 +114,207 @@ class LightningCtx:
 
     db: sqlite3.Connection
     repodir: str
+    lock: threading.RLock
 
     def __init__(self, dbname: str, repodir: str):
-        self.db = sqlite3.connect(dbname)
+        self.db = sqlite3.connect(dbname, check_same_thread=False)
+        self.lock = threading.RLock()
         self.db.executescript(schema)
+        self._add_columns()
         self.repodir = repodir
         if not self.repodir.startswith("s3://"):
             os.makedirs(self.repodir, exist_ok=True)
 
-    def new_df(self, name: str, part: int, files: list[str]) -> None:
+    @synchronized
+    def new_df(
+        self,
+        name: str,
+        part: int,
+        files: list[str],
+        fingerprint: Optional[str] = None,
+        stats: Optional[list[FileStats]] = None,
+    ) -> None:
         """
         Create a new dataframe with the given name and part.
+
+        The fingerprint identifies the stage configuration and inputs the part was
+        computed from; run_pipeline uses it to skip parts that are already up to date.
+        The stats of the part's files, if given, replace the stored ones.
         """
         self.db.execute(
             "insert into df(name, part, files) values(?, ?, ?) on conflict(name, part)"
             " do update set files = excluded.files",
             (name, part, json.dumps(files)),
         )
+        if fingerprint is None:
+            self.db.execute(
+                "delete from fingerprint where name = ? and part = ?", (name, part)
+            )
+        else:
+            self.db.execute(
+                "insert into fingerprint(name, part, fingerprint) values(?, ?, ?)"
+                " on conflict(name, part) do update set fingerprint = excluded.fingerprint",
+                (name, part, fingerprint),
+            )
+
+        for table in ["file_stats", "column_stats"]:
+            self.db.execute(
+                f"delete from {table} where name = ? and part = ?", (name, part)
+            )
+        for s in stats or []:
+            if s.file not in files:
+                continue
+            self.db.execute(
+                "insert into file_stats(name, part, file, rows, bytes, raw_bytes, blocks)"
+                " values(?, ?, ?, ?, ?, ?, ?)",
+                (
+                    name,
+                    part,
+                    s.file,
+                    s.rows,
+                    s.bytes,
+                    s.raw_bytes,
+                    json.dumps(s.blocks),
+                ),
+            )
+            self.db.executemany(
+                "insert into column_stats(name, part, file, column, min, max, nulls)"
+                " values(?, ?, ?, ?, ?, ?, ?)",
+                [
+                    (
+                        name,
+                        part,
+                        s.file,
+                        column,
+                        json.dumps(c.min),
+                        json.dumps(c.max),
+                        c.nulls,
+                    )
+                    for column, c in s.columns.items()
+                ],
+            )
         self.db.commit()
 
+    def _add_columns(self) -> None:
+        for table, column, type_ in ADDED_COLUMNS:
+            existing = {
+                row[1] for row in self.db.execute(f"pragma table_info({table})")
+            }
+            if column not in existing:
+                self.db.execute(f"alter table {table} add column {column} {type_}")
+        self.db.commit()
+
+    @synchronized
+    def save_metrics(self, name: str, part: int, stage: str, metrics: Metrics) -> None:
+        """
+        Save the runtime metrics of the run that produced a part of a dataframe.
+
+        Stages run on all parts at once (runall) save theirs under part ALL_PARTS.
+        """
+        fields = list(Metrics.model_fields)
+        self.db.execute(
+            f"insert or replace into metrics(name, part, stage, {', '.join(fields)})"
+            f" values(?, ?, ?{', ?' * len(fields)})",
+            (name, part, stage, *(getattr(metrics, f) for f in fields)),
+        )
+        self.db.commit()
+
+    @synchronized
+    def get_metrics(self, name: str) -> dict[int, Metrics]:
+        """
+        Get the runtime metrics of the parts of a dataframe, keyed by part.
+        """
+        fields = list(Metrics.model_fields)
+        cur = self.db.execute(
+            f"select part, {', '.join(fields)} from metrics where name = ?", (name,)
+        )
+        return {
+            part: Metrics(**dict(zip(fields, values)))
+            for part, *values in cur.fetchall()
+        }
+
+    @synchronized
     def drop_df(self, name: str, part: Optional[int] = None) -> None:
         """
         Delete a dataframe with the given name and part.
         """
-        if part is None:
-            self.db.execute("delete from df where name = ?", (name,))
+        for table in PART_TABLES:
+            if part is None:
+                self.db.execute(f"delete from {table} where name = ?", (name,))
+            else:
+                self.db.execute(
+                    f"delete from {table} where name = ? and part = ?", (name, part)
+                )
+        self.db.commit()
+
+    @synchronized
+    def truncate_df(self, name: str, nparts: int) -> None:
+        """
+        Delete the parts of a dataframe numbered nparts and above.
+        """
+        for table in PART_TABLES:
+            self.db.execute(
+                f"delete from {table} where name = ? and part >= ?", (name, nparts)
+            )
+        self.db.commit()
+
+    @synchronized
+    def coalesce(self, name: str, nparts: int) -> int:
+        """
+        Merge adjacent parts of a dataframe into at most nparts parts, in place.
+
+        Only the metadata changes: each new part lists the files of a run of adjacent
+        old parts, which keep their statistics. The runs are balanced by the stored
+        file sizes when every part has statistics, and by number of parts otherwise.
+        Fingerprints and metrics are dropped, since the parts were not computed as
+        such; a pipeline producing the df recomputes it on its next run.
+
+        Returns:
+            int: The new number of parts.
+        """
+        old_nparts = self.get_nparts(name)
+        if nparts < 1:
+            raise ValueError(f"Invalid number of parts: {nparts}")
+        if old_nparts <= nparts:
+            return old_nparts
+
+        part_stats = self.get_part_stats(name)
+        if len(part_stats) == old_nparts:
+            weights = [part_stats[part].bytes for part in range(old_nparts)]
         else:
-            self.db.execute("delete from df where name = ? and part = ?", (name, part))
+            weights = [1] * old_nparts
+        total = sum(weights) or 1
+
+        # Part p goes to the group where the weight of the parts before it falls
+        groups = []
+        before = 0
+        for part, weight in enumerate(weights):
+            group = min(nparts - 1, before * nparts // total)
+            if not groups or groups[-1][0] != group:
+                groups.append((group, []))
+            groups[-1][1].append(part)
+            before += weight
+
+        files = [self.get_files(name, part) for part in range(old_nparts)]
+        self.db.execute("delete from df where name = ?", (name,))
+        for table in ["fingerprint", "metrics"]:
+            self.db.execute(f"delete from {table} where name = ?", (name,))
+        for new_part, (_, parts) in enumerate(groups):
+            merged = [file for part in parts for file in files[part]]
+            self.db.execute(
+                "insert into df(name, part, files) values(?, ?, ?)",
+                (name, new_part, json.dumps(merged)),
+            )
+            for table in ["file_stats", "column_stats"]:
+                self.db.execute(
+                    f"update {table} set part = ? where name = ? and part >= ?"
+                    " and part <= ?",
+                    (new_part, name, parts[0], parts[-1]),
+                )
         self.db.commit()
+        return len(groups)
 
+    @synchronized
     def get_files(self, name: str, part: int) -> list[str]:
         """
         Get the files for a dataframe with the given name and part.
@@ -69,3 +327,171 @@ class LightningCtx:
             return []
         (f,) = ret
         return json.loads(f)
+
+    @synchronized
+    def has_part(self, name: str, part: int) -> bool:
+        """
+        Check whether a dataframe has the given part.
+        """
+        cur = self.db.execute(
+            "select 1 from df where name = ? and part = ?", (name, part)
+        )
+        return cur.fetchone() is not None
+
+    @synchronized
+    def get_nparts(self, name: str) -> int:
+        """
+        Get the number of parts of a dataframe.
+        """
+        cur = self.db.execute("select count(*) from df where name = ?", (name,))
+        (n,) = cur.fetchone()
+        return n
+
+    @synchronized
+    def get_fingerprints(self, name: str) -> dict[int, str]:
+        """
+        Get the fingerprints of the parts of a dataframe, keyed by part.
+        """
+        cur = self.db.execute(
+            "select part, fingerprint from fingerprint where name = ?", (name,)
+        )
+        return dict(cur.fetchall())
+
+    @synchronized
+    def get_stats(self, name: str, part: int) -> dict[str, FileStats]:
+        """
+        Get the statistics of the files of a part, keyed by file name.
+
+        Files written without statistics (e.g. by Sql) are missing from the result.
+        """
+        cur = self.db.execute(
+            "select file, rows, bytes, raw_bytes, blocks from file_stats"
+            " where name = ? and part = ?",
+            (name, part),
+        )
+        stats = {
+            file: FileStats(
+                file=file,
+                rows=rows,
+                bytes=size,
+                raw_bytes=raw_bytes,
+                blocks=json.loads(blocks),
+            )
+            for file, rows, size, raw_bytes, blocks in cur.fetchall()
+        }
+        cur = self.db.execute(
+            "select file, column, min, max, nulls from column_stats"
+            " where name = ? and part = ?",
+            (name, part),
+        )
+        for file, column, lo, hi, nulls in cur.fetchall():
+            stats[file].columns[column] = ColumnStats(
+                min=json.loads(lo), max=json.loads(hi), nulls=nulls
+            )
+        return stats
+
+    @synchronized
+    def get_part_stats(self, name: str) -> dict[int, FileStats]:
+        """
+        Get the statistics of every part of a dataframe, merged over the part's files.
+
+        Useful for sizing and skew detection without reading the data. Parts with
+        files lacking statistics are left out, since their totals would be wrong.
+        """
+        ret = {}
+        for part in range(self.get_nparts(name)):
+            files = self.get_files(name, part)
+            stats = self.get_stats(name, part)
+            if all(file in stats for file in files):
+                ret[part] = merge_stats(list(stats.values()))
+        return ret
+
+    def _paths(self, name: str, files: list[str]) -> list[str]:
+        return [os.path.join(self.repodir, name, file) for file in files]
+
+    def count(self, name: str) -> int:
+        """
+        Count the rows of a dataframe without decoding them.
+
+        The stored file statistics are used when available; other files are counted
+        from their Avro block headers.
+        """
+        total = 0
+        for part in range(self.get_nparts(name)):
+            stats = self.get_stats(name, part)
+            for file in self.get_files(name, part):
+                if file in stats:
+                    total += stats[file].rows
+                else:
+                    total += count_records(os.path.join(self.repodir, name, file))
+        return total
+
+    def head(
+        self, name: str, n: int = 10, columns: Optional[list[str]] = None
+    ) -> list[Any]:
+        """
+        Return the first n rows of a dataframe, in part and file order.
+
+        Only the leading blocks holding n rows are read, using the block index of the
+        files.
+        """
+        rows = []
+        for part in range(self.get_nparts(name)):
+            if len(rows) >= n:
+                break
+            files = self.get_files(name, part)
+            uris = head_uris(files, self.get_stats(name, part), n - len(rows))
+            # No prefetch, so that files past the first n rows are not opened
+            reader = iterrows(self._paths(name, uris), prefetch=0, columns=columns)
+            rows.extend(islice(reader, n - len(rows)))
+        return rows
+
+    def sample(
+        self,
+        name: str,
+        n: Optional[int] = None,
+        fraction: Optional[float] = None,
+        seed: int = 0,
+        columns: Optional[list[str]] = None,
+        by_block: bool = False,
+        max_workers: Optional[int] = None,
+    ) -> list[Any]:
+        """
+        Return a random sample of the rows of a dataframe, sampling the parts in
+        parallel on a pool of up to max_workers processes (default: one per core).
+
+        Args:
+            name (str): The dataframe.
+            n (int): Sample exactly n rows (all of them if there are fewer), uniformly
+                without replacement.
+            fraction (float): Keep each row with probability fraction. Exactly one of
+                n and fraction must be set.
+            seed (int): The seed of the random choices; the same seed gives the
+                same sample.
+            columns (list[str]): If set, only these fields are decoded and returned.
+            by_block (bool): With fraction, keep whole Avro blocks with probability
+                fraction instead of single rows, reading only the kept blocks. Much
+                faster, but rows of the same block are kept or dropped together.
+
+        Returns:
+            list[Any]: The sampled rows. With n, they are in random order.
+        """
+        if (n is None) == (fraction is None):
+            raise ValueError("Exactly one of n and fraction must be set")
+
+        tasks = []
+        for part in range(self.get_nparts(name)):
+            files = self.get_files(name, part)
+            if by_block and fraction is not None:
+                stats = self.get_stats(name, part)
+                files = sample_blocks(files, stats, fraction, seed * 1_000_003 + part)
+                tasks.append((self._paths(name, files), None, 1.0, 0, columns))
+            else:
+                paths = self._paths(name, files)
+                tasks.append((paths, n, fraction, seed * 1_000_003 + part, columns))
+
+        samples = run_tasks(sample_part, [t for t in tasks if t[0]], max_workers)
+        rows = [keyed for sample in samples for keyed in sample]
+        if n is not None:
+            rows = heapq.nsmallest(n, rows, key=lambda keyed: keyed[0])
+        return [row for _, row in rows]
@@ -0,0 +1,265 @@
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Any, Callable, Iterator, Optional, Protocol
+
+import cloudpickle
+from pydantic import BaseModel
+from redis import Redis
+from rq.job import Job, JobStatus
+
+from lightningdb.pipeline_stage import PipelineStage
+from lightningdb.rw.metrics import Metrics, measuring
+from lightningdb.rw.stats import FileStats, recording
+from lightningdb.stages.multifetch import FAILED_STATUSES, RQContext
+
+
+def new_process_pool(max_workers: Optional[int] = None) -> ProcessPoolExecutor:
+    """
+    Create a process pool whose workers are started with the "spawn" method, so that
+    they do not inherit threads or open connections from the driver.
+    """
+    return ProcessPoolExecutor(
+        max_workers, mp_context=multiprocessing.get_context("spawn")
+    )
+
+
+class PartResult(BaseModel):
+    """
+    The result of running one part of a per-part stage.
+
+    Attributes:
+        part: The part number.
+        output: The return value of stage.run().
+        stats: The statistics of the files written by WriteDF while running the part.
+        metrics: The runtime counters and timings of the part.
+    """
+
+    part: int
+    output: Any
+    stats: list[FileStats] = []
+    metrics: Metrics = Metrics()
+
+
+def run_stage_part(
+    stage: PipelineStage,
+    part: int,
+    input_files: list[str],
+    output_dir: str,
+    profile: bool = False,
+) -> PartResult:
+    """
+    Run a single part of a stage, collecting the statistics of the files it writes
+    and its runtime metrics (with a cProfile report if profile is set).
+    """
+    # Multi-input stages (Join) get one file list per input df
+    run = stage.run_multi if hasattr(stage, "run_multi") else stage.run
+    with recording() as stats, measuring(profile) as metrics:
+        output = run(input_files, output_dir)
+    return PartResult(part=part, output=output, stats=stats, metrics=metrics)
+
+
+def run_part(
+    payload: bytes,
+    part: int,
+    input_files: list[str],
+    output_dir: str,
+    profile: bool = False,
+) -> PartResult:
+    """
+    Run a single part of a pickled stage.
+
+    Args:
+        payload (bytes): The stage, serialized with cloudpickle.
+        part (int): The part number.
+        input_files (list[str]): List of input file paths or URIs for the part.
+        output_dir (str): Directory where the output files should be written.
+        profile (bool): Whether to profile the part with cProfile.
+
+    Returns:
+        PartResult: The output of stage.run(), the statistics of the written files
+            and the metrics of the run.
+    """
+    stage = cloudpickle.loads(payload)
+    return run_stage_part(stage, part, input_files, output_dir, profile)
+
+
+def run_tasks(fn: Callable, tasks: list[tuple], max_workers: Optional[int]) -> list:
+    """
+    Call fn with every tuple of arguments, on a pool of up to max_workers processes
+    (default: one per core), or inline when there is a single task or worker.
+
+    Returns:
+        list: The results, in task order.
+    """
+    max_workers = min(max_workers or os.cpu_count() or 1, len(tasks))
+    if max_workers <= 1:
+        return [fn(*args) for args in tasks]
+    with new_process_pool(max_workers) as pool:
+        futures = [pool.submit(fn, *args) for args in tasks]
+        return [future.result() for future in futures]
+
+
+class Executor(Protocol):
+    def map_parts(
+        self,
+        stage: PipelineStage,
+        parts: list[tuple[int, list[str]]],
+        output_dir: str,
+        profile: bool = False,
+    ) -> Iterator[PartResult]:
+        """
+        Run stage.run() on every part.
+
+        Args:
+            stage (PipelineStage): The per-part stage to run.
+            parts (list[tuple[int, list[str]]]): (part, input_files) pairs.
+            output_dir (str): Directory where the output files should be written.
+            profile (bool): Whether to profile each part with cProfile.
+
+        Yields:
+            PartResult: The result of each part, in completion order.
+        """
+
+
+class InlineExecutor:
+    """
+    Runs parts one after another in the current process.
+    """
+
+    def map_parts(
+        self,
+        stage: PipelineStage,
+        parts: list[tuple[int, list[str]]],
+        output_dir: str,
+        profile: bool = False,
+    ) -> Iterator[PartResult]:
+        for part, input_files in parts:
+            yield run_stage_part(stage, part, input_files, output_dir, profile)
+
+
+class ProcessExecutor:
+    """
+    Runs parts concurrently on a pool of worker processes.
+
+    Stages are serialized with cloudpickle, so stages holding lambdas or closures
+    (e.g. FlatMap.fn) can be shipped to the workers.
+    """
+
+    def __init__(self, max_workers: Optional[int] = None):
+        self.max_workers = max_workers
+
+    def map_parts(
+        self,
+        stage: PipelineStage,
+        parts: list[tuple[int, list[str]]],
+        output_dir: str,
+        profile: bool = False,
+    ) -> Iterator[PartResult]:
+        if not parts:
+            return
+        payload = cloudpickle.dumps(stage)
+        with new_process_pool(self.max_workers) as pool:
+            futures = [
+                pool.submit(run_part, payload, part, input_files, output_dir, profile)
+                for part, input_files in parts
+            ]
+            try:
+                for future in as_completed(futures):
+                    yield future.result()
+            except BaseException:
+                for future in futures:
+                    future.cancel()
+                raise
+
+
+class RQExecutorError(Exception):
+    pass
+
+
+class RQExecutor:
+    """
+    Runs parts as jobs on RQ workers, possibly on other machines.
+
+    Each part is one job running run_part() on the cloudpickled stage, so any per-part
+    stage can be distributed, including Sql (whose parts are then spread over the
+    workers instead of run by its own iterall()). Workers need lightningdb installed
+    and must see the same repodir as the driver, i.e. an S3 repodir or a shared
+    filesystem. Start them with `rq worker <queue>`.
+
+    At most max_in_flight jobs are queued or running at a time; the others are
+    enqueued as earlier ones finish. A failed part is retried up to max_retries
+    times before RQExecutorError is raised.
+    """
+
+    def __init__(
+        self,
+        queue: str = "lightningdb",
+        max_in_flight: Optional[int] = None,
+        max_retries: int = 0,
+        poll_interval: float = 1.0,
+        job_timeout: str = "1d",
+        redis: Optional[Redis] = None,
+    ):
+        self.queue = queue
+        self.max_in_flight = max_in_flight
+        self.max_retries = max_retries
+        self.poll_interval = poll_interval
+        self.job_timeout = job_timeout
+        self.redis = redis
+
+    def map_parts(
+        self,
+        stage: PipelineStage,
+        parts: list[tuple[int, list[str]]],
+        output_dir: str,
+        profile: bool = False,
+    ) -> Iterator[PartResult]:
+        ctx = RQContext(self.redis, self.queue)
+        payload = cloudpickle.dumps(stage)
+        todo = list(reversed(parts))
+        retries = {}
+        active: dict[str, tuple[int, list[str]]] = {}
+
+        def enqueue(part: int, input_files: list[str]) -> None:
+            job = Job.create(
+                run_part,
+                args=[payload, part, input_files, output_dir, profile],
+                result_ttl="1d",
+                timeout=self.job_timeout,
+                connection=ctx.redis,
+            )
+            ctx.queue.enqueue_job(job)
+            active[job.id] = (part, input_files)
+
+        try:
+            while todo or active:
+                while todo and (
+                    self.max_in_flight is None or len(active) < self.max_in_flight
+                ):
+                    enqueue(*todo.pop())
+
+                for job in Job.fetch_many(list(active), ctx.redis):
+                    if job is None:
+                        continue
+                    status = job.get_status(refresh=False)
+                    if status == JobStatus.FINISHED:
+                        del active[job.id]
+                        yield job.return_value()
+                    elif status in FAILED_STATUSES:
+                        part, input_files = active.pop(job.id)
+                        retries[part] = retries.get(part, 0) + 1
+                        if retries[part] > self.max_retries:
+                            result = job.latest_result()
+                            error = result.exc_string if result else str(status)
+                            raise RQExecutorError(f"Part {part} failed:\n{error}")
+                        enqueue(part, input_files)
+
+                if active:
+                    time.sleep(self.poll_interval)
+        finally:
+            # Do not leave jobs behind when the caller stops early or a part fails
+            for job in Job.fetch_many(list(active), ctx.redis):
+                if job is not None:
+                    ctx.cancel(job)
@@ -0,0 +1,177 @@
+import datetime
+import decimal
+import functools
+import hashlib
+import json
+import types
+import uuid
+from typing import Any
+
+from pydantic import BaseModel
+
+try:
+    import numpy as np
+except ImportError:  # Arrays are only fingerprinted when numpy is installed
+    np = None
+
+# Types without attributes whose repr() shows their whole value
+REPR_TYPES = (
+    complex,
+    range,
+    datetime.date,
+    datetime.time,
+    datetime.timedelta,
+    datetime.tzinfo,
+    decimal.Decimal,
+    uuid.UUID,
+)
+
+
+def _global_names(code: types.CodeType) -> set[str]:
+    """
+    Return the names a code object and the code objects nested in it (lambdas,
+    comprehensions, inner functions) may look up as globals.
+    """
+    names = set(code.co_names)
+    for const in code.co_consts:
+        if isinstance(const, types.CodeType):
+            names |= _global_names(const)
+    return names
+
+
+def _encode(value: Any, seen: set[int]) -> Any:
+    """
+    Convert a stage attribute to a JSON-serializable structure that changes whenever
+    the behaviour of the attribute changes.
+
+    Functions are encoded by their code, constants, defaults, closure and the values
+    of the globals they (or the functions nested in them) name, recursively, so
+    editing a FlatMap.fn, a helper it calls or a module-level constant it reads
+    changes the fingerprint. NumPy arrays are encoded by a hash of their data, dtype
+    and shape, and other objects by their attributes. Objects that have none and
+    whose repr() is not known to show their value raise a TypeError, rather than
+    being fingerprinted by a repr() that may hide a change, e.g. the elided
+    elements of a large array.
+
+    The fingerprint does not see:
+      - the contents of modules, e.g. a change to a library function called as
+        np.sum, or to a module attribute read as config.FACTOR;
+      - the code of classes (only their name), e.g. an edited method of a class the
+        function instantiates;
+      - external state: files, environment variables, the time or random state.
+    """
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    if isinstance(value, bytes):
+        return value.hex()
+    if isinstance(value, BaseModel):
+        return {
+            "model": f"{type(value).__module__}.{type(value).__qualname__}",
+            "fields": {
+                name: _encode(getattr(value, name), seen)
+                for name in type(value).model_fields
+            },
+        }
+    if isinstance(value, dict):
+        return {str(k): _encode(v, seen) for k, v in sorted(value.items(), key=str)}
+    if isinstance(value, (list, tuple)):
+        return [_encode(v, seen) for v in value]
+    if isinstance(value, (set, frozenset)):
+        return sorted((_encode(v, seen) for v in value), key=json.dumps)
+    if isinstance(value, types.CodeType):
+        return {
+            "code": value.co_code.hex(),
+            "consts": [_encode(c, seen) for c in value.co_consts],
+            "names": list(value.co_names),
+        }
+    if isinstance(value, types.FunctionType):
+        name = f"{value.__module__}.{value.__qualname__}"
+        if id(value) in seen:
+            return {"function": name}
+        seen.add(id(value))
+        globals_ = {
+            n: value.__globals__[n]
+            for n in sorted(_global_names(value.__code__))
+            if n in value.__globals__
+        }
+        return {
+            "function": name,
+            "code": _encode(value.__code__, seen),
+            "defaults": _encode(value.__defaults__, seen),
+            "closure": [
+                _encode(cell.cell_contents, seen) for cell in value.__closure__ or ()
+            ],
+            "globals": _encode(globals_, seen),
+        }
+    if isinstance(value, types.MethodType):
+        return {
+            "method": _encode(value.__func__, seen),
+            "self": _encode(value.__self__, seen),
+        }
+    if isinstance(value, functools.partial):
+        return {
+            "partial": _encode(value.func, seen),
+            "args": _encode(value.args, seen),
+            "keywords": _encode(value.keywords, seen),
+        }
+    if isinstance(value, types.BuiltinFunctionType):
+        return {"builtin": f"{value.__module__}.{value.__qualname__}"}
+    if isinstance(value, type):
+        return {"type": f"{value.__module__}.{value.__qualname__}"}
+    if isinstance(value, types.ModuleType):
+        return {"module": value.__name__}
+    name = f"{type(value).__module__}.{type(value).__qualname__}"
+    if np is not None and isinstance(value, (np.ndarray, np.generic)):
+        if value.dtype.hasobject:
+            return {"ndarray": _encode(value.tolist(), seen), "shape": value.shape}
+        return {
+            "ndarray": hashlib.sha256(
+                np.ascontiguousarray(value).tobytes()
+            ).hexdigest(),
+            "dtype": value.dtype.str,
+            "shape": value.shape,
+            "masked": (
+                _encode(np.ma.getmask(value), seen)
+                if np.ma.isMaskedArray(value)
+                else None
+            ),
+        }
+    if isinstance(value, REPR_TYPES):
+        return {"object": name, "repr": repr(value)}
+    if hasattr(value, "__dict__"):
+        if id(value) in seen:
+            return {"object": name}
+        seen.add(id(value))
+        return {"object": name, "attrs": _encode(vars(value), seen)}
+    raise TypeError(
+        f"Cannot fingerprint a {name} object: run the pipeline with incremental=False"
+    )
+
+
+def fingerprint_stage(stage: Any) -> str:
+    """
+    Compute a fingerprint of the configuration of a stage.
+
+    Args:
+        stage: The stage (usually a pydantic model).
+
+    Returns:
+        str: A hex digest that changes whenever the stage's class or attributes change.
+    """
+    data = json.dumps(_encode(stage, set()), sort_keys=True)
+    return hashlib.sha256(data.encode()).hexdigest()
+
+
+def fingerprint_inputs(stage_fingerprint: str, inputs: Any) -> str:
+    """
+    Combine a stage fingerprint with the input file lists it runs on.
+
+    Args:
+        stage_fingerprint (str): The result of fingerprint_stage().
+        inputs: The input file names (a list for one part, a list of lists for all parts).
+
+    Returns:
+        str: A hex digest identifying the result of running the stage on the inputs.
+    """
+    data = json.dumps([stage_fingerprint, inputs])
+    return hashlib.sha256(data.encode()).hexdigest()
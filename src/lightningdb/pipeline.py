@@ -1,62 +1,326 @@
 import os
+from typing import Optional
 
-from rich.progress import Progress
+from rich.progress import Progress, ProgressColumn, Task, TaskID
+from rich.text import Text
 
-from lightningdb.df import LightningCtx
+from lightningdb.df import ALL_PARTS, LightningCtx
+from lightningdb.executor import Executor, InlineExecutor, PartResult
+from lightningdb.fingerprint import fingerprint_inputs, fingerprint_stage
 from lightningdb.pipeline_stage import PipelineStage
+from lightningdb.rw.metrics import Metrics, measuring
+from lightningdb.rw.read_df import prune_files
+from lightningdb.rw.stats import recording
+from lightningdb.stages.const import Const
 from lightningdb.stages.fetch import Fetch
+from lightningdb.stages.fused import Fused
 from lightningdb.stages.multifetch import MultiFetch
 
 
-def has_part(ctx: LightningCtx, dfname: str, part: int) -> bool:
-    return ctx.get_files(ctx, dfname, part) is not None
+class ThroughputColumn(ProgressColumn):
+    """
+    Shows the rows written per second and the bytes read and written per second
+    by the finished parts of a task.
+    """
 
+    def render(self, task: Task) -> Text:
+        elapsed = task.finished_time if task.finished else task.elapsed
+        if not elapsed:
+            return Text("")
+        rows = task.fields.get("rows", 0) / elapsed
+        mb = task.fields.get("bytes", 0) / elapsed / 1e6
+        return Text(f"{rows:,.0f} rows/s {mb:,.1f} MB/s", style="progress.data.speed")
+
+
+def advance(progress: Progress, task_id: TaskID, metrics: Metrics) -> None:
+    """
+    Advance a task by one finished part, adding the part's metrics to its throughput.
+    """
+    (task,) = [task for task in progress.tasks if task.id == task_id]
+    fields = task.fields
+    progress.update(
+        task_id,
+        advance=1,
+        rows=fields.get("rows", 0) + metrics.rows_out,
+        bytes=fields.get("bytes", 0) + metrics.bytes_in + metrics.bytes_out,
+    )
+
+
+def is_fusible(stage: PipelineStage) -> bool:
+    return hasattr(stage, "transform") and not hasattr(stage, "runall")
+
+
+def plan_pipeline(pipeline: list[PipelineStage], fuse: bool) -> list[list[int]]:
+    """
+    Group the stages of a pipeline into the units that are run together.
+
+    Adjacent fusible stages (per-part stages implementing transform()) are grouped
+    when fuse is set. Const ignores its input, so it always starts a new group.
+
+    Args:
+        pipeline (list[PipelineStage]): The stages of the pipeline.
+        fuse (bool): Whether to group fusible stages.
+
+    Returns:
+        list[list[int]]: The indexes of the stages in each group, in order.
+    """
+    groups = []
+    for i, stage in enumerate(pipeline):
+        if (
+            fuse
+            and groups
+            and is_fusible(stage)
+            and is_fusible(pipeline[groups[-1][-1]])
+            and not isinstance(stage, Const)
+        ):
+            groups[-1].append(i)
+        else:
+            groups.append([i])
+    return groups
+
+
+def run_pipeline(
+    ctx: LightningCtx,
+    name: str,
+    pipeline: list[PipelineStage],
+    executor: Optional[Executor] = None,
+    fuse: bool = True,
+    keep_intermediate: bool = False,
+    incremental: bool = True,
+    profile: bool = False,
+):
+    """
+    Run a linear pipeline of stages, storing the output of stage i as df `name@i`.
+
+    Args:
+        ctx (LightningCtx): The context holding the df metadata.
+        name (str): Prefix for the names of the dfs produced by the pipeline.
+        pipeline (list[PipelineStage]): The stages to run, in order.
+        executor (Executor): Runs the parts of per-part stages. Defaults to
+            InlineExecutor, which runs the parts one after another. Use
+            ProcessExecutor(max_workers=...) to run them concurrently, or
+            RQExecutor(...) to run them on RQ workers.
+        fuse (bool): Run adjacent FlatMap/BatchMap/Const stages as one streaming
+            chain per part. Only the output of the last stage of such a group is
+            written and recorded.
+        keep_intermediate (bool): Also write and record the outputs of the
+            intermediate stages of fused groups, for debugging.
+        incremental (bool): Skip the parts whose fingerprint (stage configuration
+            and input file lists) matches the one recorded when they were last
+            computed. Stages that consume all parts at once (runall) are skipped
+            only when all their parts match. After editing stage k of a pipeline,
+            only stages k and later are recomputed. Functions are fingerprinted
+            with the globals they read, but not with the contents of modules or
+            classes, nor external state such as files (see fingerprint._encode):
+            pass incremental=False to recompute everything after such a change.
+            Stages holding objects that cannot be fingerprinted raise a TypeError
+            unless incremental is False.
+        profile (bool): Run each part under cProfile. The reports are saved with
+            the other runtime metrics of the parts, see LightningCtx.get_metrics.
+    """
+    if executor is None:
+        executor = InlineExecutor()
 
-def run_pipeline(ctx: LightningCtx, name: str, pipeline: list[PipelineStage]):
-    nparts = 1
     prev_df = None
-    cur_df = None
-
-    with Progress() as progress:
-        for i, stage in enumerate(pipeline):
-            # MultiFetch and Fetch stages are IO-intensive and can be skipped
-            memorize = isinstance(stage, MultiFetch) or isinstance(stage, Fetch)
-
-            cur_df = f"{name}@{i}"
-            output_dir = os.path.join(ctx.repodir, cur_df)
-            if hasattr(stage, "runall"):
-                task_id = progress.add_task(
-                    f"{cur_df} {stage.__class__.__name__}", total=1
-                )
-                input_pfiles = [
-                    [
-                        os.path.join(ctx.repodir, prev_df, file)
-                        for file in ctx.get_files(prev_df, part)
-                    ]
-                    for part in range(nparts)
+    with Progress(*Progress.get_default_columns(), ThroughputColumn()) as progress:
+        for group in plan_pipeline(pipeline, fuse):
+            i = group[-1]
+            stage = pipeline[i]
+            dfs = [f"{name}@{j}" for j in group]
+            label = "+".join(pipeline[j].__class__.__name__ for j in group)
+
+            if len(group) > 1:
+                intermediate_dirs = [
+                    os.path.join(ctx.repodir, df) if keep_intermediate else None
+                    for df in dfs[:-1]
                 ]
-                output_pfiles = stage.runall(input_pfiles, output_dir)
-                for part, files in enumerate(output_pfiles):
-                    ctx.new_df(cur_df, part, files)
-                nparts = len(output_pfiles)
-                progress.update(task_id, advance=1)
-            else:
-                task_id = progress.add_task(
-                    f"{cur_df} {stage.__class__.__name__}", total=nparts
+                stage = Fused(
+                    stages=[pipeline[j] for j in group],
+                    intermediate_dirs=intermediate_dirs,
                 )
 
-                for part in range(nparts):
-                    if memorize and has_part(ctx, cur_df, part):
-                        progress.update(task_id, advance=1)
-                        continue
+            run_group(
+                ctx,
+                progress,
+                stage,
+                label,
+                dfs,
+                [prev_df] if prev_df is not None else [],
+                executor,
+                keep_intermediate,
+                incremental,
+                profile,
+            )
+            prev_df = dfs[-1]
+
+
+def run_group(
+    ctx: LightningCtx,
+    progress: Progress,
+    stage: PipelineStage,
+    label: str,
+    dfs: list[str],
+    input_dfs: list[str],
+    executor: Executor,
+    keep_intermediate: bool,
+    incremental: bool,
+    profile: bool,
+) -> None:
+    """
+    Run one stage (or Fused group) of a pipeline and record its output as dfs[-1].
+
+    Args:
+        ctx (LightningCtx): The context holding the df metadata.
+        progress (Progress): The progress display to add the stage's task to.
+        stage (PipelineStage): The stage to run.
+        label (str): The name of the stage in the progress display and metrics.
+        dfs (list[str]): The dfs produced by the stage, one per stage of a Fused
+            group, the last one being the output.
+        input_dfs (list[str]): The dfs read by the stage. Stages with several
+            inputs must implement run_multi(); the inputs other than the stage's
+            broadcast_inputs must have the same number of parts.
+        executor, keep_intermediate, incremental, profile: See run_pipeline.
+    """
+    cur_df = dfs[-1]
+    output_dir = os.path.join(ctx.repodir, cur_df)
+
+    # MultiFetch and Fetch stages are IO-intensive. Without incremental
+    # mode, their parts are still skipped when they already exist
+    memorize = isinstance(stage, MultiFetch) or isinstance(stage, Fetch)
+    try:
+        stage_fingerprint = fingerprint_stage(stage)
+    except TypeError:
+        if incremental:
+            raise
+        # Recorded with the parts, which incremental runs then recompute
+        stage_fingerprint = None
+
+    multi = hasattr(stage, "run_multi")
+    if len(input_dfs) > 1 and not multi:
+        raise ValueError(f"{label} reads a single df, got {input_dfs}")
+    broadcast = set(getattr(stage, "broadcast_inputs", ()))
+    nparts_of = {
+        ctx.get_nparts(df) for i, df in enumerate(input_dfs) if i not in broadcast
+    }
+    if len(nparts_of) > 1:
+        raise ValueError(
+            f"{cur_df}: the inputs {input_dfs} are not co-partitioned,"
+            f" they have {sorted(nparts_of)} parts"
+        )
+    nparts = nparts_of.pop() if nparts_of else 1
+
+    if multi:
+        # One file list per input for each part; broadcast inputs get all their files
+        all_files = {
+            i: [
+                f for part in range(ctx.get_nparts(df)) for f in ctx.get_files(df, part)
+            ]
+            for i, df in enumerate(input_dfs)
+            if i in broadcast
+        }
+        input_names = [
+            [
+                all_files[i] if i in broadcast else ctx.get_files(df, part)
+                for i, df in enumerate(input_dfs)
+            ]
+            for part in range(nparts)
+        ]
+        input_pfiles = [
+            [
+                [os.path.join(ctx.repodir, df, file) for file in files]
+                for df, files in zip(input_dfs, names)
+            ]
+            for names in input_names
+        ]
+        inputs_key = input_dfs
+    else:
+        prev_df = input_dfs[0] if input_dfs else None
+
+        # Input files that the stage's predicate rules out are not passed to it
+        where = getattr(stage, "where", None)
+
+        input_names = [
+            ctx.get_files(prev_df, part) if prev_df is not None else []
+            for part in range(nparts)
+        ]
+        input_pfiles = [
+            [
+                os.path.join(ctx.repodir, prev_df, file)
+                for file in prune_files(
+                    files, where, ctx.get_stats(prev_df, part) if where else {}
+                )
+            ]
+            for part, files in enumerate(input_names)
+        ]
+        inputs_key = prev_df
+
+    # Stages with iterall() (MultiFetch, Sql) map each input part to one output
+    # part and report parts as they finish, so they are run per part.
+    per_part = not hasattr(stage, "runall") or hasattr(stage, "iterall")
+    if not per_part:
+        task_id = progress.add_task(f"{cur_df} {label}", total=1)
+        fingerprint = fingerprint_inputs(stage_fingerprint, [inputs_key, input_names])
+        fingerprints = ctx.get_fingerprints(cur_df)
+        if (
+            incremental
+            and fingerprints
+            and len(fingerprints) == ctx.get_nparts(cur_df)
+            and set(fingerprints.values()) == {fingerprint}
+        ):
+            progress.update(task_id, advance=1)
+        else:
+            with recording() as stats, measuring(profile) as metrics:
+                output_pfiles = stage.runall(input_pfiles, output_dir)
+            ctx.drop_df(cur_df)
+            for part, files in enumerate(output_pfiles):
+                ctx.new_df(cur_df, part, files, fingerprint, stats)
+            ctx.save_metrics(cur_df, ALL_PARTS, label, metrics)
+            advance(progress, task_id, metrics)
+        return
 
-                    input_files = [
-                        os.path.join(ctx.repodir, prev_df, file)
-                        for file in ctx.get_files(prev_df, part)
-                    ]
+    task_id = progress.add_task(f"{cur_df} {label}", total=nparts)
+    for df in dfs:
+        ctx.truncate_df(df, nparts)
+    fingerprints = ctx.get_fingerprints(cur_df)
 
-                    output_files = stage.run(input_files, output_dir)
-                    ctx.new_df(cur_df, part, output_files)
-                    progress.update(task_id, advance=1)
+    parts = []
+    part_fingerprints = {}
+    for part in range(nparts):
+        fingerprint = fingerprint_inputs(
+            stage_fingerprint, [inputs_key, input_names[part]]
+        )
+        if incremental:
+            skip = fingerprints.get(part) == fingerprint
+        else:
+            skip = memorize and ctx.has_part(cur_df, part)
+        if skip:
+            progress.update(task_id, advance=1)
+            continue
+        parts.append((part, input_pfiles[part]))
+        part_fingerprints[part] = fingerprint
 
-            prev_df = cur_df
+    # Parts are committed as soon as they finish, in completion order.
+    # Stages that also have run() (Sql) use iterall() only when the parts are run
+    # inline; other executors spread their parts over processes or workers.
+    if hasattr(stage, "iterall") and (
+        not hasattr(stage, "run") or isinstance(executor, InlineExecutor)
+    ):
+        results = (
+            PartResult(part=parts[i][0], output=files, metrics=metrics)
+            for i, files, metrics in stage.iterall(
+                [files for _, files in parts], output_dir
+            )
+        )
+    else:
+        results = executor.map_parts(stage, parts, output_dir, profile)
+    for result in results:
+        part = result.part
+        fingerprint = part_fingerprints[part]
+        if isinstance(stage, Fused):
+            for df, files in zip(dfs, result.output):
+                if df == cur_df or keep_intermediate:
+                    ctx.new_df(df, part, files, fingerprint, result.stats)
+        else:
+            ctx.new_df(cur_df, part, result.output, fingerprint, result.stats)
+        ctx.save_metrics(cur_df, part, label, result.metrics)
+        advance(progress, task_id, result.metrics)
@@ -1,4 +1,6 @@
-from typing import Protocol
+from typing import Iterator, Protocol
+
+from lightningdb.rw.metrics import Metrics
 
 
 class PipelineStage(Protocol):
@@ -25,3 +27,37 @@ class PipelineStage(Protocol):
         Returns:
             list[list[str]]: List of lists of output file paths or URIs for all processed parts.
         """
+
+    def iterall(
+        self, input_pfiles: list[list[str]], output_dir: str
+    ) -> Iterator[tuple[int, list[str], Metrics]]:
+        """
+        Process all parts of the input data, one output part per input part, reporting
+        each part as soon as it is done. Optional; preferred over runall() by
+        run_pipeline, and over run() when the parts are run inline.
+
+        Args:
+            input_pfiles (list[list[str]]): List of lists of input file paths or URIs.
+            output_dir (str): Directory where the output files should be written.
+
+        Yields:
+            tuple[int, list[str], Metrics]: The index of a part in input_pfiles, its
+            output file paths or URIs and its runtime metrics, in completion order.
+        """
+
+    def run_multi(self, input_files: list[list[str]], output_dir: str) -> list[str]:
+        """
+        Process a single part of several input dataframes. Optional; used instead of
+        run() by stages reading more than one df in run_dag (e.g. Join).
+
+        The inputs listed in the stage's broadcast_inputs attribute, if any, are
+        passed whole to every part; the other inputs must be co-partitioned.
+
+        Args:
+            input_files (list[list[str]]): The input files of the part, one list per
+                input df, in the order of the node's inputs.
+            output_dir (str): Directory where the output files should be written.
+
+        Returns:
+            list[str]: List of output file paths or URIs for the processed part.
+        """
@@ -0,0 +1,200 @@
+import json
+import zlib
+from typing import Any, Iterator, Optional
+
+import zstandard
+from pydantic import BaseModel
+
+from lightningdb.rw.compress import encode_long
+
+# The header of an Avro object container file starts with MAGIC, and every block is
+# followed by the file's SYNC_SIZE-byte sync marker
+MAGIC = b"Obj\x01"
+SYNC_SIZE = 16
+
+
+class AvroHeader(BaseModel):
+    """
+    The header of an Avro object container file.
+
+    Attributes:
+        meta: The file metadata, e.g. "avro.schema" and "avro.codec".
+        sync: The sync marker written after every block.
+        raw: The encoded header, up to and including the sync marker.
+    """
+
+    meta: dict[str, bytes]
+    sync: bytes
+    raw: bytes
+
+    @property
+    def codec(self) -> str:
+        return self.meta.get("avro.codec", b"null").decode()
+
+    @property
+    def schema(self) -> Any:
+        return json.loads(self.meta["avro.schema"])
+
+    def compatible(self, other: "AvroHeader") -> bool:
+        """
+        Whether the blocks of a file with the other header can be copied into a file
+        with this header: both have the same schema and codec.
+        """
+        return (
+            self.meta["avro.schema"] == other.meta["avro.schema"]
+            and self.codec == other.codec
+        )
+
+
+class TruncatedAvroError(ValueError):
+    pass
+
+
+def read_exact(fp, size: int) -> bytes:
+    data = fp.read(size)
+    if len(data) != size:
+        raise TruncatedAvroError("Truncated Avro file")
+    return data
+
+
+def read_long(fp) -> Optional[int]:
+    """
+    Read an Avro long (zigzag varint) from a stream, or return None at the end of it.
+    """
+    b = fp.read(1)
+    if not b:
+        return None
+    n = shift = 0
+    while True:
+        byte = b[0]
+        n |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            return (n >> 1) ^ -(n & 1)
+        shift += 7
+        b = read_exact(fp, 1)
+
+
+def read_header(fp) -> AvroHeader:
+    """
+    Read the header of an Avro object container file, leaving the stream at the
+    first block.
+    """
+    raw = bytearray(read_exact(fp, len(MAGIC)))
+    if raw != MAGIC:
+        raise ValueError("Not an Avro object container file")
+
+    def long() -> int:
+        n = read_long(fp)
+        if n is None:
+            raise TruncatedAvroError("Truncated Avro file")
+        raw.extend(encode_long(n))
+        return n
+
+    def string() -> bytes:
+        data = read_exact(fp, long())
+        raw.extend(data)
+        return data
+
+    # The metadata is a map: blocks of (key, value) entries ended by an empty one.
+    # A negative count is followed by the size of the block in bytes.
+    meta = {}
+    while count := long():
+        if count < 0:
+            count = -count
+            long()
+        for _ in range(count):
+            key = string().decode()
+            meta[key] = string()
+    sync = read_exact(fp, SYNC_SIZE)
+    raw.extend(sync)
+    return AvroHeader(meta=meta, sync=sync, raw=bytes(raw))
+
+
+def iter_blocks(fp, header: AvroHeader) -> Iterator[tuple[int, int, bytes]]:
+    """
+    Iterate over the blocks of an Avro file, without decompressing them.
+
+    Args:
+        fp: The stream, positioned after the header (see read_header).
+        header (AvroHeader): The header of the file.
+
+    Yields:
+        tuple[int, int, bytes]: The offset of the block in the file, its number of
+        records, and its (compressed) data.
+    """
+    offset = len(header.raw)
+    while (count := read_long(fp)) is not None:
+        size = read_long(fp)
+        if size is None:
+            raise TruncatedAvroError("Truncated Avro file")
+        data = read_exact(fp, size)
+        if read_exact(fp, SYNC_SIZE) != header.sync:
+            raise ValueError("Invalid Avro sync marker")
+        yield offset, count, data
+        offset += len(encode_long(count)) + len(encode_long(size)) + size + SYNC_SIZE
+
+
+def raw_block_size(codec: str, data: bytes) -> int:
+    """
+    Return the uncompressed size of a block without decompressing it, or 0 if it is
+    not known from the compressed data.
+
+    zstandard frames record their content size in their header.
+    """
+    if codec == "null":
+        return len(data)
+    if codec == "zstandard":
+        size = zstandard.frame_content_size(data)
+        return max(size, 0)
+    return 0
+
+
+# Codecs whose blocks decompress_block can decompress
+DECOMPRESS_CODECS = {"null", "deflate", "zstandard"}
+
+
+def decompress_block(codec: str, data: bytes) -> Optional[bytes]:
+    """
+    Decompress the data of a block, or return None if the codec is not one of
+    DECOMPRESS_CODECS.
+    """
+    if codec == "null":
+        return data
+    # Streaming decompressors, as fastavro uses, also accept unterminated deflate
+    # streams and zstandard frames without a content size
+    if codec == "deflate":
+        return zlib.decompressobj(-15).decompress(data)
+    if codec == "zstandard":
+        return zstandard.ZstdDecompressor().decompressobj().decompress(data)
+    return None
+
+
+class BlockWriter:
+    """
+    Writes an Avro file from compressed blocks copied from other files with the same
+    schema and codec, using the header and sync marker of the first one.
+
+    Attributes:
+        rows: The number of records written.
+        raw_size: The uncompressed size of the blocks, where it is known.
+        blocks: The offset and number of records of each block written.
+    """
+
+    def __init__(self, fp, header: AvroHeader) -> None:
+        self._fp = fp
+        self.header = header
+        self.rows = 0
+        self.raw_size = 0
+        self.blocks: list[tuple[int, int]] = []
+        self._offset = len(header.raw)
+        fp.write(header.raw)
+
+    def write_block(self, count: int, data: bytes) -> None:
+        prefix = encode_long(count) + encode_long(len(data))
+        self._fp.write(prefix)
+        self._fp.write(data)
+        self._fp.write(self.header.sync)
+        self.blocks.append((self._offset, count))
+        self._offset += len(prefix) + len(data) + SYNC_SIZE
+        self.rows += count
+        self.raw_size += raw_block_size(self.header.codec, data)
@@ -0,0 +1,406 @@
+from typing import Any, Optional
+
+try:
+    import numpy as np
+except ImportError:  # numpy is only needed for columnar batches
+    np = None
+
+
+def _require_numpy() -> None:
+    if np is None:
+        raise ImportError("numpy is required for columnar batches: pip install numpy")
+
+
+# NumPy dtypes of the Avro primitive types with a fixed-width representation
+# Other types (strings, bytes, records, arrays, logical types...) are object columns
+DTYPES = {
+    "boolean": "bool",
+    "int": "int32",
+    "long": "int64",
+    "float": "float32",
+    "double": "float64",
+}
+
+
+def column_types(avro_schema: Any) -> dict[str, tuple[Optional[str], bool]]:
+    """
+    Map the fields of a record schema to their column types.
+
+    Returns:
+        dict[str, tuple[Optional[str], bool]]: For each field, its NumPy dtype (None
+        for object columns) and whether it is nullable, i.e. a union of null and a
+        single other type.
+    """
+    types = {}
+    for field in avro_schema["fields"]:
+        type_ = field["type"]
+        nullable = False
+        if isinstance(type_, list):
+            others = [t for t in type_ if t != "null"]
+            nullable = len(others) == 1 and len(others) < len(type_)
+            type_ = others[0] if len(others) == 1 else None
+        # Logical and named types are dicts, kept as objects
+        dtype = DTYPES.get(type_) if isinstance(type_, str) else None
+        types[field["name"]] = (dtype, nullable)
+    return types
+
+
+# Types of the fields decoded from the encoded Avro blocks straight into arrays
+# int and long are zigzag varints, and boolean a 0/1 byte, which is also a varint;
+# float, double and boolean have a fixed width
+VARINT_TYPES = {"boolean", "int", "long"}
+FIXED_TYPES = {"boolean": "u1", "float": "<f4", "double": "<f8"}
+
+
+def block_layout(avro_schema: Any) -> Optional[str]:
+    """
+    Tell whether the records of a schema can be decoded as columns with decode_block.
+
+    Returns:
+        Optional[str]: "varint" if every field is a non-null int, long or boolean,
+        "fixed" if every field is a non-null float, double or boolean, or None.
+    """
+    if np is None or not isinstance(avro_schema, dict):
+        return None
+    fields = avro_schema.get("fields")
+    if not fields:
+        return None
+    types = [field["type"] for field in fields]
+    if not all(isinstance(t, str) for t in types):
+        return None
+    types = set(types)
+    if types <= VARINT_TYPES:
+        return "varint"
+    if types <= set(FIXED_TYPES):
+        return "fixed"
+    return None
+
+
+def _decode_varints(buf: Any) -> Any:
+    """
+    Decode a buffer holding only Avro varints into their raw (not zigzag decoded)
+    unsigned values.
+    """
+    ends = np.flatnonzero(buf < 0x80)  # The last byte of each varint
+    if len(ends) and ends[-1] != len(buf) - 1:
+        raise ValueError("Invalid Avro block: truncated varint")
+    starts = np.empty_like(ends)
+    starts[:1] = 0
+    starts[1:] = ends[:-1] + 1
+    lengths = ends - starts + 1
+    values = (buf[starts] & 0x7F).astype(np.uint64)
+    # Varints are short: add their k-th bytes for every k at once
+    for k in range(1, int(lengths.max(initial=1))):
+        longer = lengths > k
+        values[longer] |= (buf[starts[longer] + k] & 0x7F).astype(np.uint64) << (
+            np.uint64(7 * k)
+        )
+    return values
+
+
+def decode_block(
+    data: bytes, count: int, avro_schema: Any, layout: str, columns: list[str]
+) -> dict[str, Any]:
+    """
+    Decode the given columns of the (decompressed) records of an Avro block into
+    NumPy arrays, without building a dict per record.
+
+    Args:
+        data (bytes): The encoded records.
+        count (int): The number of records.
+        avro_schema: The record schema, whose layout is given by block_layout.
+        layout (str): "varint" or "fixed".
+        columns (list[str]): The fields to decode.
+
+    Returns:
+        dict[str, np.ndarray]: The arrays, typed as in column_types.
+    """
+    fields = avro_schema["fields"]
+    buf = np.frombuffer(data, dtype=np.uint8)
+    if layout == "fixed":
+        dtype = np.dtype([(f["name"], FIXED_TYPES[f["type"]]) for f in fields])
+        if len(buf) != count * dtype.itemsize:
+            raise ValueError("Invalid Avro block: unexpected size")
+        records = buf.view(dtype)
+        return {
+            f["name"]: records[f["name"]].astype(DTYPES[f["type"]])
+            for f in fields
+            if f["name"] in columns
+        }
+
+    values = _decode_varints(buf)
+    if len(values) != count * len(fields):
+        raise ValueError("Invalid Avro block: unexpected number of values")
+    values = values.reshape(count, len(fields))
+    out = {}
+    for i, f in enumerate(fields):
+        if f["name"] not in columns:
+            continue
+        raw = values[:, i]
+        if f["type"] == "boolean":
+            out[f["name"]] = raw.astype(bool)
+        else:
+            # Zigzag decoding
+            signed = (raw >> np.uint64(1)).astype(np.int64)
+            signed ^= -(raw & np.uint64(1)).astype(np.int64)
+            out[f["name"]] = signed.astype(DTYPES[f["type"]])
+    return out
+
+
+# Types of the fields encoded from column arrays by encode_columns, with the NumPy
+# dtype kinds accepted for them; other columns are written row by row
+ENCODED_KINDS = {
+    "boolean": "b",
+    "int": "iu",
+    "long": "iu",
+    "float": "iuf",
+    "double": "iuf",
+    "string": None,
+    "bytes": None,
+}
+
+INT_RANGES = {"int": (-(2**31), 2**31 - 1), "long": (-(2**63), 2**63 - 1)}
+
+
+def column_encoding(avro_schema: Any) -> Optional[list[tuple[str, str, Optional[int]]]]:
+    """
+    Tell whether the records of a schema can be encoded from columns with
+    encode_columns.
+
+    Returns:
+        Optional[list[tuple[str, str, Optional[int]]]]: For each field, its name, its
+        type and, for a union of null and that type, the index of the null branch.
+        None if a field has another type.
+    """
+    if np is None or not isinstance(avro_schema, dict):
+        return None
+    fields = avro_schema.get("fields")
+    if not fields:
+        return None
+    encoding = []
+    for field in fields:
+        type_, null_index = field["type"], None
+        if isinstance(type_, list):
+            if len(type_) != 2 or "null" not in type_:
+                return None
+            null_index = type_.index("null")
+            type_ = type_[1 - null_index]
+        if not isinstance(type_, str) or type_ not in ENCODED_KINDS:
+            return None
+        encoding.append((field["name"], type_, null_index))
+    return encoding
+
+
+def _encode_varints(values: Any) -> tuple[Any, Any]:
+    """
+    Encode unsigned integers as varints.
+
+    Returns:
+        tuple: The concatenated bytes and the length of each varint.
+    """
+    lengths = np.ones(len(values), dtype=np.int64)
+    for k in range(1, 10):
+        lengths += values >= np.uint64(1 << (7 * k))
+    width = np.arange(int(lengths.max(initial=1)))
+    groups = values[:, None] >> (width * 7).astype(np.uint64)
+    groups = (groups & np.uint64(0x7F)).astype(np.uint8)
+    groups[width < (lengths - 1)[:, None]] |= 0x80
+    return groups[width < lengths[:, None]], lengths
+
+
+def _zigzag(values: Any) -> Any:
+    return ((values << 1) ^ (values >> 63)).view(np.uint64)
+
+
+def _encode_values(values: Any, type_: str) -> Optional[tuple[Any, Any]]:
+    """
+    Encode non-null values of an Avro type.
+
+    Returns:
+        Optional[tuple]: The concatenated bytes and the length of each value, or None
+        if the values are not of a type accepted for it.
+    """
+    n = len(values)
+    if ENCODED_KINDS[type_] is None:
+        if type_ == "string":
+            try:
+                values = [v.encode() for v in values]
+            except AttributeError:
+                return None
+        elif not all(isinstance(v, bytes) for v in values):
+            return None
+        sizes = np.fromiter(map(len, values), dtype=np.int64, count=n)
+        data = np.frombuffer(b"".join(values), dtype=np.uint8)
+        return _interleave([_encode_varints(_zigzag(sizes)), (data, sizes)])
+
+    values = np.asarray(values)
+    if n and values.dtype.kind not in ENCODED_KINDS[type_]:
+        return None
+    if type_ == "boolean":
+        return values.astype(np.uint8), np.ones(n, dtype=np.int64)
+    if type_ in FIXED_TYPES:
+        dtype = np.dtype(FIXED_TYPES[type_])
+        return values.astype(dtype).view(np.uint8), np.full(n, dtype.itemsize)
+    lo, hi = INT_RANGES[type_]
+    if n and (values.min() < lo or values.max() > hi):
+        return None  # Out of range, for fastavro to report
+    return _encode_varints(_zigzag(values.astype(np.int64)))
+
+
+def _interleave(segments: list[tuple[Any, Any]]) -> tuple[Any, Any]:
+    """
+    Interleave byte segments row by row: the output holds, for each row, its bytes
+    of the first segment, then of the second...
+
+    Args:
+        segments (list[tuple]): The concatenated bytes of each segment, and the
+            length of each row's bytes in it.
+
+    Returns:
+        tuple: The bytes, and the length of each row.
+    """
+    lengths = np.stack([seg_lengths for _, seg_lengths in segments], axis=1)
+    flat = lengths.ravel()
+    starts = (np.cumsum(flat) - flat).reshape(lengths.shape)
+    out = np.empty(int(flat.sum()), dtype=np.uint8)
+    for j, (data, seg_lengths) in enumerate(segments):
+        offsets = np.cumsum(seg_lengths) - seg_lengths
+        dest = np.repeat(starts[:, j] - offsets, seg_lengths)
+        out[dest + np.arange(len(data))] = data
+    return out, lengths.sum(axis=1)
+
+
+def encode_columns(
+    columns: dict[str, Any], encoding: list[tuple[str, str, Optional[int]]]
+) -> Optional[tuple[bytes, Any]]:
+    """
+    Encode a batch of rows given as columns into Avro records, without building a
+    dict per row: the inverse of decode_block.
+
+    Args:
+        columns (dict[str, Any]): Columns of equal length, NumPy arrays or lists. The
+            nulls of nullable fields are masked values, or None in other columns.
+        encoding (list): The fields of the record schema, as returned by
+            column_encoding.
+
+    Returns:
+        Optional[tuple[bytes, np.ndarray]]: The encoded records and the offset at
+        which each one ends. None if the columns do not have the fields of the
+        schema or values of their types; they are then to be written as rows, for
+        fastavro to convert the values or report the error.
+    """
+    sizes = {len(column) for column in columns.values()}
+    if len(sizes) != 1 or any(name not in columns for name, _, _ in encoding):
+        return None
+    (n,) = sizes
+
+    segments = []
+    for name, type_, null_index in encoding:
+        column = columns[name]
+        if isinstance(column, np.ma.MaskedArray):
+            nulls = np.ma.getmaskarray(column)
+            column = column.data
+        elif isinstance(column, np.ndarray) and column.dtype != object:
+            nulls = np.zeros(n, dtype=bool)
+        else:
+            nulls = np.fromiter((v is None for v in column), dtype=bool, count=n)
+        if not nulls.any():
+            encoded = _encode_values(column, type_)
+        elif null_index is None:
+            return None  # A null in a non-nullable field
+        else:
+            valid = np.asarray(column, dtype=object)[~nulls].tolist()
+            encoded = _encode_values(valid, type_)
+        if encoded is None:
+            return None
+
+        if null_index is None:
+            segments.append(encoded)
+            continue
+        # The index of the union's branch, then the value if it is not null
+        index = np.where(nulls, 2 * null_index, 2 - 2 * null_index).astype(np.uint8)
+        data, valid_lengths = encoded
+        lengths = np.zeros(n, dtype=np.int64)
+        lengths[~nulls] = valid_lengths
+        segments += [(index, np.ones(n, dtype=np.int64)), (data, lengths)]
+
+    data, row_lengths = _interleave(segments)
+    return data.tobytes(), np.cumsum(row_lengths)
+
+
+def concat_columns(chunks: list[dict[str, Any]]) -> dict[str, Any]:
+    """
+    Concatenate batches of columns with the same fields, keeping masks.
+    """
+    if len(chunks) == 1:
+        return chunks[0]
+    out = {}
+    for name in chunks[0]:
+        arrays = [chunk[name] for chunk in chunks]
+        if any(isinstance(a, np.ma.MaskedArray) for a in arrays):
+            out[name] = np.ma.concatenate(arrays)
+        else:
+            out[name] = np.concatenate(arrays)
+    return out
+
+
+def _column(values: list, dtype: Optional[str], nullable: bool) -> Any:
+    if dtype is None:
+        # Fill an empty array so that nested lists stay objects instead of
+        # becoming extra dimensions
+        column = np.empty(len(values), dtype=object)
+        column[:] = values
+        return column
+    if not nullable:
+        return np.array(values, dtype=dtype)
+    mask = [v is None for v in values]
+    data = np.array([0 if v is None else v for v in values], dtype=dtype)
+    return np.ma.MaskedArray(data, mask=mask)
+
+
+def rows_to_columns(
+    rows: list[dict], types: Optional[dict[str, tuple[Optional[str], bool]]] = None
+) -> dict[str, Any]:
+    """
+    Convert a list of rows to a dict of NumPy column arrays.
+
+    Args:
+        rows (list[dict]): The rows. All rows must have the fields of the first one.
+        types (dict): The column types, as returned by column_types. Without them,
+            dtypes are inferred by NumPy.
+
+    Returns:
+        dict[str, np.ndarray]: One array per field. Without types, columns holding
+        None or non-scalar values have dtype object. With types, nullable numeric
+        columns are masked arrays, with nulls masked.
+    """
+    _require_numpy()
+    if not rows:
+        return {}
+    if types is None:
+        return {name: np.array([row[name] for row in rows]) for name in rows[0]}
+    return {
+        name: _column([row[name] for row in rows], *types.get(name, (None, False)))
+        for name in rows[0]
+    }
+
+
+def columns_to_rows(columns: dict[str, Any]) -> list[dict]:
+    """
+    Convert a dict of column arrays (or lists) to a list of rows.
+
+    NumPy scalars are converted to the equivalent Python values so that the rows
+    can be written with fastavro.
+
+    Args:
+        columns (dict[str, Any]): Columns of equal length.
+
+    Returns:
+        list[dict]: The rows.
+    """
+    names = list(columns)
+    values = [
+        col.tolist() if hasattr(col, "tolist") else list(col)
+        for col in columns.values()
+    ]
+    return [dict(zip(names, row)) for row in zip(*values)]
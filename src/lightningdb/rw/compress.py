@@ -0,0 +1,204 @@
+import os
+import threading
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional
+
+import zstandard
+
+# Number of threads compressing Avro blocks, shared by all open files of the process
+# zlib and zstd release the GIL while compressing, so the blocks of a file are
+# compressed in parallel with the encoding of the next rows
+COMPRESS_THREADS = os.cpu_count() or 1
+
+# Maximum number of blocks of a single file being compressed at once
+# Writes block when the limit is reached, bounding memory to about
+# block_size * (MAX_PENDING_BLOCKS + 1) per open file
+MAX_PENDING_BLOCKS = 4
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+# zstd compression contexts are not thread safe, each thread keeps its own per level
+_local = threading.local()
+
+
+def get_compress_pool() -> ThreadPoolExecutor:
+    """
+    Get the process-wide thread pool used to compress Avro blocks.
+    """
+    global _pool, _pool_pid
+    with _pool_lock:
+        if _pool is None or _pool_pid != os.getpid():
+            _pool = ThreadPoolExecutor(COMPRESS_THREADS)
+            _pool_pid = os.getpid()
+        return _pool
+
+
+def deflate_compress(data: bytes, level: Optional[int]) -> bytes:
+    # Avro's deflate codec is raw deflate, without the zlib header and checksum
+    compressor = zlib.compressobj(
+        zlib.Z_DEFAULT_COMPRESSION if level is None else level, zlib.DEFLATED, -15
+    )
+    return compressor.compress(data) + compressor.flush()
+
+
+def zstandard_compress(data: bytes, level: Optional[int]) -> bytes:
+    compressors = getattr(_local, "zstd", None)
+    if compressors is None:
+        compressors = _local.zstd = {}
+    compressor = compressors.get(level)
+    if compressor is None:
+        compressor = compressors[level] = zstandard.ZstdCompressor(
+            level=3 if level is None else level
+        )
+    return compressor.compress(data)
+
+
+# Codecs whose blocks can be compressed off the encoding thread
+# Other codecs supported by fastavro are compressed inline by fastavro itself
+COMPRESSORS: dict[str, Callable[[bytes, Optional[int]], bytes]] = {
+    "deflate": deflate_compress,
+    "zstandard": zstandard_compress,
+}
+
+
+def encode_long(n: int) -> bytes:
+    """
+    Encode an integer as an Avro long (zigzag varint).
+    """
+    n = (n << 1) ^ (n >> 63)
+    out = bytearray()
+    while n & ~0x7F:
+        out.append((n & 0x7F) | 0x80)
+        n >>= 7
+    out.append(n)
+    return bytes(out)
+
+
+class OrderedSink:
+    """
+    A write-only stream that lets blocks be compressed out of line but written in order.
+
+    Bytes written with write() and blocks submitted with submit() are written to the
+    underlying stream in the order they were given. A block is written, prefixed with
+    its compressed size as Avro does, once it and everything before it is ready;
+    bytes written while blocks are pending are queued behind them.
+    """
+
+    def __init__(self, fp, max_pending: int) -> None:
+        self._fp = fp
+        self._max_pending = max_pending
+        self._queue: deque = deque()
+        self._nblocks = 0  # Number of blocks in the queue
+
+        self.written = 0  # Number of bytes written to the underlying stream
+        self.raw_bytes = 0  # Uncompressed size of the blocks written so far
+        self.compressed_bytes = 0  # Their size once compressed
+        self.pending_raw_bytes = 0  # Uncompressed size of the blocks in the queue
+        self.pending_bytes = 0  # Size of the other bytes in the queue
+        # Offset and number of records of each block written, for the block index
+        self.blocks: list[tuple[int, int]] = []
+
+    def write(self, buffer) -> int:
+        if self._queue:
+            data = bytes(buffer)
+            self._queue.append(data)
+            self.pending_bytes += len(data)
+        else:
+            self._fp.write(buffer)
+            self.written += len(buffer)
+        return len(buffer)
+
+    def submit(
+        self,
+        compress: Callable[[bytes, Optional[int]], bytes],
+        data: bytes,
+        level: Optional[int],
+        count: int,
+    ) -> None:
+        """
+        Compress a block of count records on the compression pool and queue it for
+        writing. Its record count must have been written just before.
+        """
+        future = get_compress_pool().submit(compress, data, level)
+        self._queue.append((future, len(data), count))
+        self._nblocks += 1
+        self.pending_raw_bytes += len(data)
+        self._drain(self._max_pending)
+
+    def write_inline(
+        self, block_writer: Callable, data: bytes, level: Optional[int], count: int
+    ) -> None:
+        """
+        Compress and write a block of count records on the calling thread with a
+        fastavro block writer. Its record count must have been written just before.
+        """
+        self._drain(0)
+        before = self.written
+        self.blocks.append((before - len(encode_long(count)), count))
+        block_writer(self, data, level)
+        self.raw_bytes += len(data)
+        self.compressed_bytes += self.written - before
+
+    def _drain(self, max_pending: int) -> None:
+        # Write the ready items at the head of the queue, waiting for blocks while
+        # more than max_pending of them are queued
+        while self._queue:
+            item = self._queue[0]
+            if isinstance(item, tuple):
+                future, size, count = item
+                if not future.done() and self._nblocks <= max_pending:
+                    return
+                data = future.result()
+                self.blocks.append((self.written - len(encode_long(count)), count))
+                header = encode_long(len(data))
+                self._fp.write(header)
+                self._fp.write(data)
+                self.written += len(header) + len(data)
+                self._nblocks -= 1
+                self.pending_raw_bytes -= size
+                self.raw_bytes += size
+                self.compressed_bytes += len(header) + len(data)
+            else:
+                self._fp.write(item)
+                self.written += len(item)
+                self.pending_bytes -= len(item)
+            self._queue.popleft()
+
+    def ratio(self) -> float:
+        """
+        Return the compression ratio of the blocks written so far (1 before any).
+        """
+        if not self.raw_bytes:
+            return 1.0
+        return self.compressed_bytes / self.raw_bytes
+
+    def size(self, buffered: int = 0) -> int:
+        """
+        Estimate the size of the stream once the queued blocks, and a block of
+        `buffered` more uncompressed bytes, are written.
+
+        Queued and buffered blocks are assumed to compress like the written ones.
+        """
+        raw = self.pending_raw_bytes + buffered
+        return self.written + self.pending_bytes + int(raw * self.ratio())
+
+    def flush(self) -> None:
+        self._drain(0)
+        self._fp.flush()
+
+    def abort(self) -> None:
+        for item in self._queue:
+            if isinstance(item, tuple):
+                item[0].cancel()
+        self._queue.clear()
+        self._nblocks = 0
+
+    def seekable(self) -> bool:
+        return False
+
+    def fileno(self) -> int:
+        return self._fp.fileno()
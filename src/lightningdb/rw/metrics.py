@@ -0,0 +1,106 @@
+import cProfile
+import io
+import pstats
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Iterator, Optional
+
+from pydantic import BaseModel
+
+# Number of functions listed in the profile of a part
+PROFILE_LINES = 30
+
+
+class Metrics(BaseModel):
+    """
+    Counters and timings of one run of a stage part.
+
+    The timings are exclusive of each other: decode time does not include the time
+    spent waiting for input bytes, and encode time does not include the time spent
+    writing output bytes.
+
+    Attributes:
+        seconds: Wall-clock time of the run.
+        rows_in: Rows returned by iterrows.
+        rows_out: Rows written by WriteDF.
+        bytes_in: Bytes read through ReadWrapper.
+        bytes_out: Bytes written through WriteWrapper.
+        read_seconds: Time spent waiting in ReadWrapper.read (local or S3 I/O).
+        write_seconds: Time spent in WriteWrapper.write and close (local or S3 I/O).
+        decode_seconds: Time spent decoding Avro rows in iterrows.
+        encode_seconds: Time spent encoding and compressing rows in WriteDF.
+        fn_seconds: Time spent in the user functions of FlatMap and BatchMap.
+        cache_hits: S3 files read from the local S3 cache.
+        cache_misses: S3 files read from S3 while the cache is enabled.
+        profile: The cProfile report of the run, if profiling was enabled.
+    """
+
+    seconds: float = 0.0
+    rows_in: int = 0
+    rows_out: int = 0
+    bytes_in: int = 0
+    bytes_out: int = 0
+    read_seconds: float = 0.0
+    write_seconds: float = 0.0
+    decode_seconds: float = 0.0
+    encode_seconds: float = 0.0
+    fn_seconds: float = 0.0
+    cache_hits: int = 0
+    cache_misses: int = 0
+    profile: Optional[str] = None
+
+    def add(self, other: "Metrics") -> None:
+        """
+        Add the counters and timings of a run nested in this one, e.g. of a map task.
+
+        The wall-clock time is not added, since it is already part of this run's.
+        Timings of nested runs executed in parallel may add up to more than it.
+        """
+        for name in type(self).model_fields:
+            if name not in ("seconds", "profile"):
+                setattr(self, name, getattr(self, name) + getattr(other, name))
+
+
+# The hooks in the readers, writers and stages add to the Metrics of the innermost
+# active measuring(), if any. Hot loops accumulate locally and add their totals once
+# per file or chunk, and do nothing when no measurement is active.
+_measuring: ContextVar[Optional[Metrics]] = ContextVar(
+    "lightningdb_metrics", default=None
+)
+
+
+def current() -> Optional[Metrics]:
+    return _measuring.get()
+
+
+def _format_profile(profiler: cProfile.Profile) -> str:
+    out = io.StringIO()
+    stats = pstats.Stats(profiler, stream=out)
+    stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(PROFILE_LINES)
+    return out.getvalue()
+
+
+@contextmanager
+def measuring(profile: bool = False) -> Iterator[Metrics]:
+    """
+    Collect the Metrics of the reads, writes and stage functions run within the block.
+
+    Args:
+        profile (bool): Also run the block under cProfile and store the report of its
+            most expensive functions in Metrics.profile.
+    """
+    metrics = Metrics()
+    token = _measuring.set(metrics)
+    profiler = cProfile.Profile() if profile else None
+    start = time.perf_counter()
+    if profiler is not None:
+        profiler.enable()
+    try:
+        yield metrics
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            metrics.profile = _format_profile(profiler)
+        metrics.seconds += time.perf_counter() - start
+        _measuring.reset(token)
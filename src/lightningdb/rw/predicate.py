@@ -0,0 +1,74 @@
+import operator
+from typing import Any, Optional
+
+from lightningdb.rw.stats import FileStats
+
+# A predicate is a conjunction of (column, op, value) conditions,
+# e.g. [("country", "==", "FR"), ("age", ">=", 18)]
+Predicate = list[tuple[str, str, Any]]
+
+OPS = {
+    "==": operator.eq,
+    "!=": operator.ne,
+    "<": operator.lt,
+    "<=": operator.le,
+    ">": operator.gt,
+    ">=": operator.ge,
+    "in": lambda a, b: a in b,
+}
+
+
+def validate(where: Optional[Predicate]) -> None:
+    """
+    Raise ValueError if a predicate uses an unknown operator.
+    """
+    for column, op, _ in where or []:
+        if op not in OPS:
+            raise ValueError(f"Unknown operator {op!r} for column {column!r}")
+
+
+def matches(row: dict, where: Predicate) -> bool:
+    """
+    Check whether a row satisfies every condition of a predicate.
+
+    Null values never satisfy a condition.
+    """
+    for column, op, value in where:
+        v = row.get(column)
+        if v is None or not OPS[op](v, value):
+            return False
+    return True
+
+
+def may_match(stats: FileStats, where: Predicate) -> bool:
+    """
+    Check, using only the statistics of a file (or part), whether some of its rows
+    may satisfy a predicate. False means the file can be skipped without reading it.
+    """
+    if stats.rows == 0:
+        return False
+    for column, op, value in where:
+        col = stats.columns.get(column)
+        if col is None:
+            continue  # no statistics for this column
+        if col.min is None:
+            return False  # every value is null
+        lo, hi = col.min, col.max
+        try:
+            if op == "==" and (value < lo or value > hi):
+                return False
+            if op == "!=" and lo == hi == value:
+                return False
+            if op == "<" and not lo < value:
+                return False
+            if op == "<=" and not lo <= value:
+                return False
+            if op == ">" and not hi > value:
+                return False
+            if op == ">=" and not hi >= value:
+                return False
+            if op == "in" and all(v < lo or v > hi for v in value):
+                return False
+        except TypeError:
+            continue  # values not comparable with the statistics
+    return True
@@ -1,22 +1,446 @@
-from typing import Any, Iterator
+import time
+from collections import deque
+from itertools import islice
+from typing import Any, Iterator, Optional
 
+from fastavro import parse_schema
 from fastavro import reader as fastavro_reader
 
-from lightningdb.rw.read_wrapper import ReadWrapper
+from lightningdb.rw.avro_blocks import (
+    DECOMPRESS_CODECS,
+    decompress_block,
+    iter_blocks,
+    read_header,
+)
+from lightningdb.rw.columns import (
+    block_layout,
+    column_types,
+    concat_columns,
+    decode_block,
+    np,
+    rows_to_columns,
+)
+from lightningdb.rw.metrics import Metrics
+from lightningdb.rw.predicate import OPS, Predicate, matches, may_match, validate
+from lightningdb.rw.read_wrapper import PrefixedStream, ReadWrapper, block_range_uri
+from lightningdb.rw.stats import FileStats
 
+# Number of files opened ahead of the one being decoded
+# For S3 files, opening a ReadWrapper starts fetching it in the background,
+# so the next files are downloaded while the current one is decoded
+PREFETCH = 2
 
-def iterrows(files: list[str]) -> Iterator[Any]:
+# Default number of rows per chunk returned by iterchunks
+CHUNK_ROWS = 10_000
+
+# When metrics are collected, rows are decoded in batches of TIMED_ROWS so that
+# the decoding time is measured once per batch instead of once per row
+TIMED_ROWS = 1000
+
+
+class _Recorder:
+    """
+    A stream that keeps a copy of the bytes read through it.
+    """
+
+    def __init__(self, fp) -> None:
+        self._fp = fp
+        self.recorded = bytearray()
+
+    def read(self, size: int = -1) -> bytes:
+        data = self._fp.read(size)
+        self.recorded += data
+        return data
+
+
+def project_schema(writer_schema: Any, columns: list[str]) -> Optional[Any]:
+    """
+    Build a reader schema holding only the given fields of a record schema.
+
+    Returns None if the projection is not a valid schema on its own, e.g. when a kept
+    field refers to a named type defined in a dropped field.
+    """
+    fields = [f for f in writer_schema["fields"] if f["name"] in columns]
+    schema = {**writer_schema, "fields": fields}
+    try:
+        parse_schema(schema)
+    except Exception:
+        return None
+    return schema
+
+
+def open_avro(bytes_reader, columns: Optional[list[str]]) -> tuple[Iterator[Any], Any]:
+    """
+    Open an Avro file for reading only the given columns.
+
+    Fields outside the projection are skipped by fastavro without being decoded.
+
+    Returns:
+        tuple[Iterator[Any], Any]: The records, and the schema of the file, reduced
+        to the projected fields.
+    """
+    if columns is None:
+        reader = fastavro_reader(bytes_reader)
+        return reader, reader.writer_schema
+
+    # Read the header to learn the writer schema, then replay it for the real reader
+    recorder = _Recorder(bytes_reader)
+    writer_schema = fastavro_reader(recorder).writer_schema
+    stream = PrefixedStream(bytes_reader, bytes(recorder.recorded))
+
+    reader_schema = project_schema(writer_schema, columns)
+    if reader_schema is not None:
+        return fastavro_reader(stream, reader_schema=reader_schema), reader_schema
+    fields = [f for f in writer_schema["fields"] if f["name"] in columns]
+    rows = (
+        {k: v for k, v in row.items() if k in columns}
+        for row in fastavro_reader(stream)
+    )
+    return rows, {**writer_schema, "fields": fields}
+
+
+def read_avro(bytes_reader, columns: Optional[list[str]]) -> Iterator[Any]:
+    """
+    Iterate over the records of an Avro file, decoding only the given columns.
+    """
+    rows, _ = open_avro(bytes_reader, columns)
+    yield from rows
+
+
+def timed_rows(
+    rows: Iterator[Any], bytes_reader: ReadWrapper, metrics: Metrics
+) -> Iterator[Any]:
+    """
+    Yield the rows of one file, adding their count and decoding time to metrics.
+
+    The time spent waiting for the file's bytes is counted by ReadWrapper and
+    excluded from the decoding time.
+    """
+    decode_seconds = 0.0
+    count = 0
+    try:
+        while True:
+            start = time.perf_counter()
+            waited = bytes_reader.read_seconds
+            batch = list(islice(rows, TIMED_ROWS))
+            decode_seconds += time.perf_counter() - start
+            decode_seconds -= bytes_reader.read_seconds - waited
+            if not batch:
+                break
+            count += len(batch)
+            yield from batch
+    finally:
+        metrics.rows_in += count
+        metrics.decode_seconds += decode_seconds
+
+
+def prune_files(
+    files: list[str], where: Optional[Predicate], stats: dict[str, FileStats]
+) -> list[str]:
+    """
+    Drop the files whose statistics show that no row can satisfy the predicate.
+
+    Args:
+        files (list[str]): The files to prune.
+        where (Predicate): The predicate. If None, no file is dropped.
+        stats (dict[str, FileStats]): Statistics keyed by file. Files without
+            statistics are kept.
+
+    Returns:
+        list[str]: The files that may hold matching rows.
+    """
+    if not where:
+        return files
+    return [f for f in files if f not in stats or may_match(stats[f], where)]
+
+
+def split_file(file: str, stats: FileStats, split_bytes: int) -> list[str]:
+    """
+    Split a file into block ranges of about split_bytes each, using its block index.
+
+    The ranges are "<file>#<start>-<end>" URIs, which iterrows and ReadWrapper read
+    as Avro files holding only these blocks, so that a large file can be read by
+    several workers, or partially.
+
+    Args:
+        file (str): The file path or URI.
+        stats (FileStats): The statistics of the file, with its block index.
+        split_bytes (int): The size above which a range is finished.
+
+    Returns:
+        list[str]: The block range URIs in file order, or [file] if the file is not
+        larger than split_bytes or has no block index.
+    """
+    blocks = stats.blocks
+    if not blocks or stats.bytes <= split_bytes:
+        return [file]
+    ranges = []
+    start = blocks[0][0]
+    for offset, _ in blocks[1:]:
+        if offset - start >= split_bytes:
+            ranges.append((start, offset))
+            start = offset
+    ranges.append((start, stats.bytes))
+    if len(ranges) == 1:
+        return [file]
+    return [block_range_uri(file, start, end) for start, end in ranges]
+
+
+def split_files(
+    files: list[str], stats: dict[str, FileStats], split_bytes: int
+) -> list[str]:
+    """
+    Split the files with statistics in stats (keyed by file) into block ranges of
+    about split_bytes each. See split_file.
+    """
+    return [
+        split
+        for file in files
+        for split in (
+            split_file(file, stats[file], split_bytes) if file in stats else [file]
+        )
+    ]
+
+
+def iterrows(
+    files: list[str],
+    prefetch: int = PREFETCH,
+    columns: Optional[list[str]] = None,
+    where: Optional[Predicate] = None,
+    stats: Optional[dict[str, FileStats]] = None,
+) -> Iterator[Any]:
     """
     Iterate over rows from multiple files.
 
     Args:
         files (list[str]): List of file paths or URIs to read from.
+        prefetch (int): Number of files to open ahead of the current one.
+        columns (list[str]): If set, only these fields are decoded and returned.
+            Columns used by `where` must be included.
+        where (Predicate): If set, only the rows satisfying every
+            (column, op, value) condition are returned.
+        stats (dict[str, FileStats]): Statistics of the files, keyed like `files`.
+            Files that cannot hold rows satisfying `where` are not read at all.
 
     Yields:
         Any: Each row from the files.
     """
-    for file in files:
-        bytes_reader = ReadWrapper(file)
-        for row in fastavro_reader(bytes_reader):
-            yield row
-        bytes_reader.close()
+    return read_files(files, prefetch, columns, where, stats)
+
+
+def open_files(files: list[str], prefetch: int) -> Iterator[ReadWrapper]:
+    """
+    Open files one after another, each prefetch files ahead of the one being read.
+    Each file is closed when the next one is requested.
+    """
+    pending = deque()
+    next_file = 0
+    try:
+        while True:
+            while next_file < len(files) and len(pending) <= prefetch:
+                pending.append(ReadWrapper(files[next_file]))
+                next_file += 1
+            if not pending:
+                break
+
+            bytes_reader = pending.popleft()
+            try:
+                yield bytes_reader
+            finally:
+                bytes_reader.close()
+    finally:
+        for bytes_reader in pending:
+            bytes_reader.close()
+
+
+def read_files(
+    files: list[str],
+    prefetch: int,
+    columns: Optional[list[str]],
+    where: Optional[Predicate],
+    stats: Optional[dict[str, FileStats]],
+    schemas: Optional[list[Any]] = None,
+) -> Iterator[Any]:
+    """
+    The implementation of iterrows. The (projected) schema of each file is appended
+    to `schemas`, if given, when the file is opened.
+    """
+    validate(where)
+    files = prune_files(files, where, stats or {})
+    for bytes_reader in open_files(files, prefetch):
+        yield from read_rows(bytes_reader, columns, where, schemas)
+
+
+def read_rows(
+    bytes_reader,
+    columns: Optional[list[str]],
+    where: Optional[Predicate],
+    schemas: Optional[list[Any]] = None,
+    stream: Any = None,
+) -> Iterator[Any]:
+    """
+    Iterate over the rows of one open file, see read_files. The file is decoded from
+    stream instead of bytes_reader if given, e.g. when its header was already read.
+    """
+    rows, schema = open_avro(stream or bytes_reader, columns)
+    if schemas is not None:
+        schemas.append(schema)
+    if where:
+        rows = (row for row in rows if matches(row, where))
+    metrics = bytes_reader.metrics
+    if metrics is not None:
+        rows = timed_rows(rows, bytes_reader, metrics)
+    yield from rows
+
+
+def iterchunks(
+    files: list[str],
+    chunk_size: int = CHUNK_ROWS,
+    prefetch: int = PREFETCH,
+    columns: Optional[list[str]] = None,
+    where: Optional[Predicate] = None,
+    stats: Optional[dict[str, FileStats]] = None,
+) -> Iterator[list[Any]]:
+    """
+    Iterate over rows from multiple files in chunks.
+
+    Args:
+        files (list[str]): List of file paths or URIs to read from.
+        chunk_size (int): Maximum number of rows per chunk.
+        prefetch (int): Number of files to open ahead of the current one.
+        columns, where, stats: See iterrows.
+
+    Yields:
+        list[Any]: Lists of up to chunk_size rows. Only the last one may be shorter.
+    """
+    rows = iterrows(files, prefetch, columns, where, stats)
+    while True:
+        chunk = list(islice(rows, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def iterbatches(
+    files: list[str],
+    batch_size: int = CHUNK_ROWS,
+    prefetch: int = PREFETCH,
+    columns: Optional[list[str]] = None,
+    where: Optional[Predicate] = None,
+    stats: Optional[dict[str, FileStats]] = None,
+) -> Iterator[dict[str, Any]]:
+    """
+    Iterate over rows from multiple files in columnar batches of NumPy arrays.
+
+    Columns are typed from the Avro schema of the files: boolean, int, long, float
+    and double fields become bool, int32, int64, float32 and float64 arrays, and
+    other fields object arrays. Nullable numeric fields become masked arrays, with
+    nulls masked.
+
+    Files whose fields are all non-null int, long and boolean, or all non-null
+    float, double and boolean (see block_layout), and compressed with the null,
+    deflate or zstandard codec, are decoded block by block straight into arrays,
+    which is many times faster than iterrows. Other files are decoded row by row,
+    one batch of rows at a time, and converted, which is slower than iterrows.
+
+    Args:
+        files (list[str]): List of file paths or URIs to read from.
+        batch_size (int): Maximum number of rows per batch.
+        prefetch, columns, where, stats: See iterrows. Batches without columns could
+            not tell their number of rows, so columns must not be empty.
+
+    Yields:
+        dict[str, np.ndarray]: One array per column. Only the last batch may be
+        shorter than batch_size.
+    """
+    if columns is not None and not columns:
+        raise ValueError("iterbatches needs at least one column")
+    validate(where)
+    files = prune_files(files, where, stats or {})
+    pending = []
+    size = 0
+    for bytes_reader in open_files(files, prefetch):
+        for chunk in read_batches(bytes_reader, batch_size, columns, where):
+            n = len(next(iter(chunk.values()), ()))
+            if not n:
+                continue
+            pending.append(chunk)
+            size += n
+            while size >= batch_size:
+                batch = concat_columns(pending)
+                yield {name: column[:batch_size] for name, column in batch.items()}
+                size -= batch_size
+                rest = {name: column[batch_size:] for name, column in batch.items()}
+                pending = [rest] if size else []
+    if pending:
+        yield concat_columns(pending)
+
+
+def read_batches(
+    bytes_reader,
+    batch_size: int,
+    columns: Optional[list[str]],
+    where: Optional[Predicate],
+) -> Iterator[dict[str, Any]]:
+    """
+    Iterate over the rows of one open file as batches of columns, see iterbatches.
+    The batches are up to batch_size rows, or one per Avro block.
+    """
+    header = read_header(bytes_reader)
+    schema = header.schema
+    layout = block_layout(schema)
+    if layout is None or header.codec not in DECOMPRESS_CODECS:
+        stream = PrefixedStream(bytes_reader, header.raw)
+        schemas = []
+        rows = read_rows(bytes_reader, columns, where, schemas, stream)
+        while batch := list(islice(rows, batch_size)):
+            yield rows_to_columns(batch, column_types(schemas[0]))
+        return
+
+    names = [field["name"] for field in schema["fields"]]
+    decoded = names if columns is None else [n for n in names if n in columns]
+    decoded += [c for c, _, _ in where or [] if c in names and c not in decoded]
+    metrics = bytes_reader.metrics
+    count = 0
+    decode_seconds = 0.0
+    try:
+        blocks = iter_blocks(bytes_reader, header)
+        while True:
+            start = time.perf_counter()
+            waited = bytes_reader.read_seconds
+            block = next(blocks, None)
+            if block is None:
+                break
+            _, n, data = block
+            batch = decode_block(
+                decompress_block(header.codec, data), n, schema, layout, decoded
+            )
+            if where:
+                batch = filter_columns(batch, where, n)
+            if columns is not None:
+                batch = {name: batch[name] for name in names if name in columns}
+            count += len(next(iter(batch.values()), ()))
+            decode_seconds += time.perf_counter() - start
+            decode_seconds -= bytes_reader.read_seconds - waited
+            yield batch
+    finally:
+        if metrics is not None:
+            metrics.rows_in += count
+            metrics.decode_seconds += decode_seconds
+
+
+def filter_columns(batch: dict[str, Any], where: Predicate, n: int) -> dict[str, Any]:
+    """
+    Keep the rows of a batch of non-null columns satisfying a predicate. A column
+    missing from the batch is null, which never satisfies a condition.
+    """
+    keep = np.ones(n, dtype=bool)
+    for column, op, value in where:
+        values = batch.get(column)
+        if values is None:
+            keep[:] = False
+        elif op == "in":
+            keep &= np.isin(values, list(value))
+        else:
+            keep &= OPS[op](values, value)
+    return {name: column[keep] for name, column in batch.items()}
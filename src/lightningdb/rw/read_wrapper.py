@@ -1,6 +1,286 @@
-import tempfile
+import io
+import queue
+import re
+import threading
+import time
+from typing import Optional
 
-from lightningdb.rw.s3utils import download_file
+from lightningdb.rw.avro_blocks import TruncatedAvroError, read_header
+from lightningdb.rw.metrics import current
+from lightningdb.rw.s3cache import S3Cache, get_cache
+from lightningdb.rw.s3utils import (
+    get_client,
+    get_object_size,
+    get_object_version,
+    parse_s3_uri,
+    read_range,
+)
+
+# S3 objects are streamed with ranged GETs of CHUNK_SIZE bytes
+# A background thread keeps up to READ_AHEAD chunks buffered ahead of the reader,
+# so at most CHUNK_SIZE * (READ_AHEAD + 1) bytes of an object are held in memory
+CHUNK_SIZE = 8 * 1024 * 1024
+READ_AHEAD = 4
+
+# A URI may end with a "#<start>-<end>" fragment selecting the Avro blocks in the byte
+# range [start, end) of the file (see split_file in read_df). It is read as the file's
+# header followed by these blocks, which is a valid Avro file on its own.
+FRAGMENT = re.compile(r"^(.*)#(\d+)-(\d+)$")
+
+# Initial size of the ranged GET reading the header of an S3 file for a block range
+HEADER_SIZE = 64 * 1024
+
+
+class S3Stream:
+    """
+    A read-only stream over an S3 object, fetched in chunks by a background thread.
+    """
+
+    def __init__(
+        self,
+        uri: str,
+        chunk_size: int,
+        read_ahead: int,
+        size: Optional[int] = None,
+        etag: Optional[str] = None,
+        start: int = 0,
+    ) -> None:
+        self._bucket, self._key = parse_s3_uri(uri)
+        self._s3 = get_client()
+        # The stream returns the bytes [start, size) of the object
+        self._start = start
+        self._size = size  # Fetched by the background thread if not given
+        self._etag = etag  # If set, the reads fail if the object is replaced
+        self._chunk_size = chunk_size
+        self._chunks = queue.Queue(maxsize=read_ahead)
+        self._closed = threading.Event()
+        self._buffer = memoryview(b"")
+        self._eof = False
+
+        self._thread = threading.Thread(target=self._fetch, daemon=True)
+        self._thread.start()
+
+    def _put(self, item) -> bool:
+        # Block until there is room in the read-ahead buffer or the stream is closed
+        while not self._closed.is_set():
+            try:
+                self._chunks.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _fetch(self) -> None:
+        try:
+            size = self._size
+            if size is None:
+                size = get_object_size(self._s3, self._bucket, self._key)
+            for start in range(self._start, size, self._chunk_size):
+                end = min(start + self._chunk_size, size) - 1
+                data = read_range(
+                    self._s3, self._bucket, self._key, start, end, self._etag
+                )
+                if not self._put(data):
+                    return
+            self._put(None)  # end of object
+        except Exception as e:
+            self._put(e)
+
+    def _next_chunk(self) -> None:
+        item = self._chunks.get()
+        if item is None:
+            self._eof = True
+        elif isinstance(item, Exception):
+            self._eof = True
+            raise item
+        else:
+            self._buffer = memoryview(item)
+
+    def read(self, size: int = -1) -> bytes:
+        parts = []
+        while size != 0:
+            if not self._buffer:
+                if self._eof:
+                    break
+                self._next_chunk()
+                continue
+            n = len(self._buffer) if size < 0 else min(size, len(self._buffer))
+            parts.append(self._buffer[:n])
+            self._buffer = self._buffer[n:]
+            if size > 0:
+                size -= n
+        return b"".join(parts)
+
+    def close(self) -> None:
+        self._closed.set()
+        self._thread.join()
+
+
+class CachingStream:
+    """
+    A read-only stream over an S3 object version that also copies the bytes read into
+    a new S3 cache file. The copy is added to the cache once the whole object has been
+    read, and discarded otherwise.
+    """
+
+    def __init__(
+        self,
+        stream: S3Stream,
+        cache: S3Cache,
+        bucket: str,
+        key: str,
+        etag: str,
+        size: int,
+    ) -> None:
+        self._stream = stream
+        self._cache = cache
+        self._bucket, self._key, self._etag = bucket, key, etag
+        self._file = cache.new_file()
+        self._size = size
+        self._copied = 0
+
+    def read(self, size: int = -1) -> bytes:
+        data = self._stream.read(size)
+        if self._file is not None and data:
+            try:
+                self._file.write(data)
+                self._copied += len(data)
+            except OSError:
+                # The cache is best effort, e.g. when its disk is full
+                self._cache.discard(self._file)
+                self._file = None
+        return data
+
+    def close(self) -> None:
+        self._stream.close()
+        if self._file is None:
+            return
+        if self._copied == self._size:
+            self._cache.commit(self._file, self._bucket, self._key, self._etag)
+        else:
+            self._cache.discard(self._file)
+        self._file = None
+
+
+class PrefixedStream:
+    """
+    A stream that first returns the given bytes, then the rest of another stream.
+    """
+
+    def __init__(self, fp, head: bytes) -> None:
+        self._fp = fp
+        self._head = memoryview(head)
+
+    def read(self, size: int = -1) -> bytes:
+        if not self._head:
+            return self._fp.read(size)
+        if size < 0:
+            ret = bytes(self._head) + self._fp.read()
+            self._head = memoryview(b"")
+            return ret
+        ret = bytes(self._head[:size])
+        self._head = self._head[size:]
+        if len(ret) < size:
+            ret += self._fp.read(size - len(ret))
+        return ret
+
+    def close(self) -> None:
+        self._fp.close()
+
+
+class LimitedStream:
+    """
+    A stream returning at most the next `size` bytes of another stream.
+    """
+
+    def __init__(self, fp, size: int) -> None:
+        self._fp = fp
+        self._left = size
+
+    def read(self, size: int = -1) -> bytes:
+        if size < 0 or size > self._left:
+            size = self._left
+        data = self._fp.read(size)
+        self._left -= len(data)
+        return data
+
+    def close(self) -> None:
+        self._fp.close()
+
+
+def split_fragment(uri: str) -> tuple[str, Optional[tuple[int, int]]]:
+    """
+    Split a "<uri>#<start>-<end>" block range URI into the URI of the file and the
+    byte range (None for a whole file URI).
+    """
+    match = FRAGMENT.match(uri)
+    if match is None:
+        return uri, None
+    return match.group(1), (int(match.group(2)), int(match.group(3)))
+
+
+def block_range_uri(uri: str, start: int, end: int) -> str:
+    return f"{uri}#{start}-{end}"
+
+
+def open_block_range(fp, start: int, end: int):
+    """
+    Turn a seekable Avro file into a stream over its header and the blocks in the
+    byte range [start, end).
+    """
+    header = read_header(fp)
+    fp.seek(start)
+    return PrefixedStream(LimitedStream(fp, end - start), header.raw)
+
+
+def read_s3_header(s3, bucket: str, key: str, size: int, etag: Optional[str]) -> bytes:
+    """
+    Read the encoded header of an Avro file on S3 with ranged GETs.
+    """
+    length = HEADER_SIZE
+    while True:
+        data = read_range(s3, bucket, key, 0, min(length, size) - 1, etag)
+        try:
+            return read_header(io.BytesIO(data)).raw
+        except TruncatedAvroError:
+            if length >= size:
+                raise
+            length *= 2
+
+
+def open_s3_block_range(uri: str, start: int, end: int, etag: Optional[str]):
+    bucket, key = parse_s3_uri(uri)
+    header = read_s3_header(get_client(), bucket, key, end, etag)
+    stream = S3Stream(uri, CHUNK_SIZE, READ_AHEAD, size=end, etag=etag, start=start)
+    return PrefixedStream(stream, header)
+
+
+def open_s3(uri: str, byte_range: Optional[tuple[int, int]] = None):
+    """
+    Open an S3 object, or a block range of it, for streaming, through the S3 cache if
+    it is enabled. Block ranges are read from the cache, but are not added to it.
+
+    Returns:
+        tuple: The stream, and whether the object was found in the cache (None if the
+        cache is disabled).
+    """
+    cache = get_cache()
+    if cache is None:
+        if byte_range is not None:
+            return open_s3_block_range(uri, *byte_range, None), None
+        return S3Stream(uri, CHUNK_SIZE, READ_AHEAD), None
+
+    bucket, key = parse_s3_uri(uri)
+    size, etag = get_object_version(get_client(), bucket, key)
+    fp = cache.open(bucket, key, etag)
+    if fp is not None:
+        if byte_range is not None:
+            fp = open_block_range(fp, *byte_range)
+        return fp, True
+    if byte_range is not None:
+        return open_s3_block_range(uri, *byte_range, etag), False
+    stream = S3Stream(uri, CHUNK_SIZE, READ_AHEAD, size=size, etag=etag)
+    return CachingStream(stream, cache, bucket, key, etag, size), False
 
 
 class ReadWrapper:
@@ -12,15 +292,27 @@ class ReadWrapper:
     """
 
     def __init__(self, uri: str) -> None:
+        uri, byte_range = split_fragment(uri)
         if uri.startswith("s3://"):
-            # For S3 URIs, download the file to a temporary local file
-            # The temporary file is automatically deleted when closed
-            self.fp = tempfile.NamedTemporaryFile()
-            download_file(uri, self.fp)
-            self.fp.seek(0)  # Reset file pointer to the beginning after download
+            # For S3 URIs, stream the object with ranged GETs
+            # Only a bounded read-ahead buffer is kept in memory, and nothing touches
+            # the disk unless the S3 cache is enabled
+            self.fp, hit = open_s3(uri, byte_range)
         else:
             # For local files, simply open the file in binary read mode
             self.fp = open(uri, "rb")
+            if byte_range is not None:
+                self.fp = open_block_range(self.fp, *byte_range)
+            hit = None
+
+        self.metrics = current()
+        if self.metrics is not None and hit is not None:
+            if hit:
+                self.metrics.cache_hits += 1
+            else:
+                self.metrics.cache_misses += 1
+        self.bytes_read = 0  # Number of bytes returned by read()
+        self.read_seconds = 0.0  # Time spent waiting for them
 
     def read(self, size: int = -1) -> bytes:
         """
@@ -32,12 +324,22 @@ class ReadWrapper:
         Returns:
             bytes: The data read from the file.
         """
-        return self.fp.read(size)
+        if self.metrics is None:
+            return self.fp.read(size)
+        start = time.perf_counter()
+        data = self.fp.read(size)
+        self.read_seconds += time.perf_counter() - start
+        self.bytes_read += len(data)
+        return data
 
     def close(self) -> None:
         """
         Close the file pointer.
 
-        For S3 files, this also ensures the deletion of the temporary local file.
+        For S3 files, this also stops the background fetch.
         """
         self.fp.close()
+        if self.metrics is not None:
+            self.metrics.bytes_in += self.bytes_read
+            self.metrics.read_seconds += self.read_seconds
+            self.metrics = None
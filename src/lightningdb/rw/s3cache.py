@@ -0,0 +1,189 @@
+import fcntl
+import hashlib
+import os
+import re
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from typing import Iterator, Optional
+
+# The S3 cache is configured with environment variables, so that it is inherited by
+# the worker processes of ProcessExecutor. RQ workers must be started with them set.
+# The cache is disabled unless CACHE_DIR_ENV is set.
+CACHE_DIR_ENV = "LIGHTNINGDB_CACHE_DIR"
+CACHE_SIZE_ENV = "LIGHTNINGDB_CACHE_SIZE"
+
+# Default size limit of the cache directory, in bytes
+CACHE_SIZE = 10 * 1024 * 1024 * 1024
+
+# Temporary files older than this are left over by crashed processes and removed
+# on the next eviction
+STALE_SECONDS = 24 * 3600
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def cache_name(bucket: str, key: str, etag: str) -> str:
+    """
+    Name of the cache file of an object version.
+
+    The ETag changes whenever the object is overwritten, so a stale version is never
+    returned; it just ages out of the cache.
+    """
+    digest = hashlib.sha256(f"{bucket}/{key}".encode()).hexdigest()[:32]
+    return f"{digest}-{re.sub(r'[^0-9A-Za-z-]', '', etag)}"
+
+
+class S3Cache:
+    """
+    A local directory of S3 object copies, with a size limit and LRU eviction.
+
+    The cache can be shared by several processes. Files are fully written under a
+    temporary name, then renamed into place, so readers never see partial copies.
+    Inserts and evictions hold an exclusive flock on the directory. Hits only touch
+    the file's mtime, which is the LRU clock; a file evicted while it is open stays
+    readable until it is closed.
+
+    Attributes:
+        dir: The cache directory.
+        max_bytes: The size limit of the cached files.
+        hits, misses: Lookups of this process that found, or did not find, a copy.
+    """
+
+    def __init__(self, dir: str, max_bytes: int = CACHE_SIZE) -> None:
+        self.dir = dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._objects = os.path.join(dir, "objects")
+        self._tmp = os.path.join(dir, "tmp")
+        os.makedirs(self._objects, exist_ok=True)
+        os.makedirs(self._tmp, exist_ok=True)
+
+    def open(self, bucket: str, key: str, etag: str):
+        """
+        Open the cached copy of an object version.
+
+        Returns:
+            The open file, or None if the version is not cached.
+        """
+        path = os.path.join(self._objects, cache_name(bucket, key, etag))
+        try:
+            fp = open(path, "rb")
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass  # evicted since it was opened
+        self.hits += 1
+        return fp
+
+    def new_file(self):
+        """
+        Create a temporary file to fill with an object's bytes, then pass to commit()
+        or discard().
+        """
+        return tempfile.NamedTemporaryFile(dir=self._tmp, delete=False)
+
+    def commit(self, fp, bucket: str, key: str, etag: str) -> None:
+        """
+        Close a file created by new_file() and add it to the cache as the copy of an
+        object version, evicting the least recently used files above the size limit.
+        """
+        fp.close()
+        if os.path.getsize(fp.name) > self.max_bytes:
+            os.remove(fp.name)
+            return
+        path = os.path.join(self._objects, cache_name(bucket, key, etag))
+        with self._locked():
+            os.replace(fp.name, path)
+            self._evict()
+
+    def discard(self, fp) -> None:
+        fp.close()
+        try:
+            os.remove(fp.name)
+        except FileNotFoundError:
+            pass
+
+    def size(self) -> int:
+        """
+        Return the total size of the cached files.
+        """
+        return sum(size for _, size, _ in self._entries())
+
+    @contextmanager
+    def _locked(self) -> Iterator[None]:
+        with open(os.path.join(self.dir, ".lock"), "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _entries(self) -> list[tuple[float, int, str]]:
+        entries = []
+        with os.scandir(self._objects) as it:
+            for entry in it:
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        return entries
+
+    def _evict(self) -> None:
+        # Called with the lock held
+        entries = sorted(self._entries())
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            os.remove(path)
+            total -= size
+
+        now = time.time()
+        with os.scandir(self._tmp) as it:
+            for entry in it:
+                try:
+                    if entry.stat().st_mtime < now - STALE_SECONDS:
+                        os.remove(entry.path)
+                except FileNotFoundError:
+                    pass
+
+
+def get_cache() -> Optional[S3Cache]:
+    """
+    Get the process-wide S3 cache configured by the environment, or None if the cache
+    is disabled.
+    """
+    global _cache
+    dir = os.environ.get(CACHE_DIR_ENV)
+    if not dir:
+        return None
+    max_bytes = int(os.environ.get(CACHE_SIZE_ENV, CACHE_SIZE))
+    with _cache_lock:
+        if _cache is None or (_cache.dir, _cache.max_bytes) != (dir, max_bytes):
+            _cache = S3Cache(dir, max_bytes)
+        return _cache
+
+
+def configure_cache(dir: Optional[str], max_bytes: int = CACHE_SIZE) -> None:
+    """
+    Enable the S3 cache in this process and the worker processes it starts, or
+    disable it if dir is None.
+
+    Args:
+        dir (str): The cache directory, created if needed.
+        max_bytes (int): The size limit of the cached files.
+    """
+    if dir is None:
+        os.environ.pop(CACHE_DIR_ENV, None)
+        os.environ.pop(CACHE_SIZE_ENV, None)
+    else:
+        os.environ[CACHE_DIR_ENV] = dir
+        os.environ[CACHE_SIZE_ENV] = str(max_bytes)
@@ -1,6 +1,18 @@
+import os
 import re
+import threading
+from typing import Optional
 
 import boto3
+from botocore.config import Config
+
+# Size of the connection pool of the shared S3 client
+# It bounds the number of concurrent requests (ranged GETs, part uploads) per process
+MAX_POOL_CONNECTIONS = 64
+
+_client = None
+_client_pid = None
+_client_lock = threading.Lock()
 
 
 def parse_s3_uri(uri: str) -> tuple[str, str]:
@@ -26,6 +38,27 @@ def parse_s3_uri(uri: str) -> tuple[str, str]:
     return bucket, key
 
 
+def get_client():
+    """
+    Get the process-wide S3 client.
+
+    The client is created once per process, with a connection pool shared by all
+    threads, so reads and writes reuse connections instead of setting up a new
+    client per file. It is re-created after a fork.
+
+    Returns:
+        The shared boto3 S3 client.
+    """
+    global _client, _client_pid
+    with _client_lock:
+        if _client is None or _client_pid != os.getpid():
+            session = boto3.session.Session()
+            config = Config(max_pool_connections=MAX_POOL_CONNECTIONS)
+            _client = session.client("s3", config=config)
+            _client_pid = os.getpid()
+        return _client
+
+
 def upload_file(fp, uri):
     """
     Upload a file-like object to an S3 bucket.
@@ -35,7 +68,7 @@ def upload_file(fp, uri):
         uri (str): The S3 URI where the file will be uploaded.
     """
     bucket, key = parse_s3_uri(uri)
-    s3 = boto3.client("s3")
+    s3 = get_client()
     s3.upload_fileobj(fp, bucket, key)
 
 
@@ -48,5 +81,74 @@ def download_file(uri, fp):
         fp: A file-like object where the downloaded content will be written.
     """
     bucket, key = parse_s3_uri(uri)
-    s3 = boto3.client("s3")
+    s3 = get_client()
     s3.download_fileobj(bucket, key, fp)
+
+
+def get_object_size(s3, bucket: str, key: str) -> int:
+    """
+    Get the size in bytes of an S3 object.
+
+    Args:
+        s3: The boto3 S3 client to use.
+        bucket (str): The bucket name.
+        key (str): The object key.
+
+    Returns:
+        int: The size of the object in bytes.
+    """
+    return s3.head_object(Bucket=bucket, Key=key)["ContentLength"]
+
+
+def get_object_version(s3, bucket: str, key: str) -> tuple[int, str]:
+    """
+    Get the size in bytes and the ETag of an S3 object.
+
+    Args:
+        s3: The boto3 S3 client to use.
+        bucket (str): The bucket name.
+        key (str): The object key.
+
+    Returns:
+        tuple[int, str]: The size of the object in bytes, and its ETag.
+    """
+    resp = s3.head_object(Bucket=bucket, Key=key)
+    return resp["ContentLength"], resp["ETag"]
+
+
+def get_size(uri: str) -> int:
+    """
+    Get the size in bytes of a local file or S3 object.
+
+    Args:
+        uri (str): The local path or S3 URI.
+
+    Returns:
+        int: The size in bytes.
+    """
+    if not uri.startswith("s3://"):
+        return os.path.getsize(uri)
+    bucket, key = parse_s3_uri(uri)
+    return get_object_size(get_client(), bucket, key)
+
+
+def read_range(
+    s3, bucket: str, key: str, start: int, end: int, etag: Optional[str] = None
+) -> bytes:
+    """
+    Read a byte range of an S3 object with a ranged GET.
+
+    Args:
+        s3: The boto3 S3 client to use.
+        bucket (str): The bucket name.
+        key (str): The object key.
+        start (int): Offset of the first byte to read.
+        end (int): Offset of the last byte to read (inclusive).
+        etag (str): If set, the read fails if the object no longer has this ETag.
+
+    Returns:
+        bytes: The requested bytes.
+    """
+    kwargs = {"IfMatch": etag} if etag is not None else {}
+    resp = s3.get_object(Bucket=bucket, Key=key, Range=f"bytes={start}-{end}", **kwargs)
+    return resp["Body"].read()
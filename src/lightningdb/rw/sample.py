@@ -0,0 +1,163 @@
+import heapq
+import io
+import random
+from typing import Any, Optional
+
+from lightningdb.rw.avro_blocks import (
+    SYNC_SIZE,
+    TruncatedAvroError,
+    read_header,
+    read_long,
+)
+from lightningdb.rw.read_df import iterrows
+from lightningdb.rw.read_wrapper import ReadWrapper, block_range_uri, read_s3_header
+from lightningdb.rw.s3utils import (
+    get_client,
+    get_object_version,
+    parse_s3_uri,
+    read_range,
+)
+from lightningdb.rw.stats import FileStats
+
+# Size of the ranged GETs reading the block headers of an S3 file. The headers of the
+# blocks that fit in one GET are parsed from it; larger blocks are skipped over.
+COUNT_READ_SIZE = 64 * 1024
+
+
+def count_records(uri: str) -> int:
+    """
+    Count the records of an Avro file from its block headers, without decompressing
+    or decoding the blocks. Local files are skipped through block by block, and S3
+    files are read with ranged GETs of the block headers.
+    """
+    if uri.startswith("s3://"):
+        return count_s3_records(uri)
+    reader = ReadWrapper(uri)
+    try:
+        read_header(reader)
+        seek = getattr(reader.fp, "seek", None)
+        total = 0
+        while (count := read_long(reader)) is not None:
+            size = read_long(reader)
+            if seek is not None:
+                seek(size + SYNC_SIZE, 1)
+            else:
+                reader.read(size + SYNC_SIZE)
+            total += count
+        return total
+    finally:
+        reader.close()
+
+
+def count_s3_records(uri: str) -> int:
+    """
+    Count the records of an Avro file on S3 from its block headers, fetching only
+    COUNT_READ_SIZE bytes from the start of each block that does not begin in the
+    previous GET.
+    """
+    bucket, key = parse_s3_uri(uri)
+    s3 = get_client()
+    size, etag = get_object_version(s3, bucket, key)
+    offset = len(read_s3_header(s3, bucket, key, size, etag))
+    total = 0
+    while offset < size:
+        end = min(offset + COUNT_READ_SIZE, size)
+        data = read_range(s3, bucket, key, offset, end - 1, etag)
+        buffer = io.BytesIO(data)
+        pos = 0  # Offset in data of the next block header
+        while pos < len(data):
+            buffer.seek(pos)
+            try:
+                count = read_long(buffer)
+                block_size = read_long(buffer)
+            except TruncatedAvroError:
+                break
+            if block_size is None:
+                break  # The header continues in the next GET
+            total += count
+            pos = buffer.tell() + block_size + SYNC_SIZE
+        if pos == 0:
+            raise TruncatedAvroError("Truncated Avro file")
+        offset += pos
+    return total
+
+
+def head_uris(files: list[str], stats: dict[str, FileStats], n: int) -> list[str]:
+    """
+    Select the leading files, or block ranges of them, holding at least n records.
+
+    Files with a block index are cut after the block that reaches n records, so that
+    only those blocks are read (and downloaded). Files without statistics are taken
+    whole, and their records are not counted.
+    """
+    uris = []
+    for file in files:
+        s = stats.get(file)
+        if s is None or not s.blocks:
+            uris.append(file)
+            continue
+        end = None
+        for i, (_, count) in enumerate(s.blocks):
+            n -= count
+            if n <= 0:
+                end = s.blocks[i + 1][0] if i + 1 < len(s.blocks) else None
+                break
+        uris.append(file if end is None else block_range_uri(file, s.blocks[0][0], end))
+        if n <= 0:
+            break
+    return uris
+
+
+def sample_blocks(
+    files: list[str], stats: dict[str, FileStats], fraction: float, seed: int
+) -> list[str]:
+    """
+    Select each block of the files with probability fraction, as block range URIs.
+
+    Files without a block index are selected whole with probability fraction.
+    """
+    rng = random.Random(seed)
+    uris = []
+    for file in files:
+        s = stats.get(file)
+        if s is None or not s.blocks:
+            if rng.random() < fraction:
+                uris.append(file)
+            continue
+        ends = [offset for offset, _ in s.blocks[1:]] + [s.bytes]
+        for (start, _), end in zip(s.blocks, ends):
+            if rng.random() < fraction:
+                uris.append(block_range_uri(file, start, end))
+    return uris
+
+
+def sample_part(
+    files: list[str],
+    n: Optional[int],
+    fraction: Optional[float],
+    seed: int,
+    columns: Optional[list[str]],
+) -> list[tuple[float, Any]]:
+    """
+    Sample the rows of a part.
+
+    With n, keep the n rows with the smallest random keys (a reservoir sample): the n
+    smallest keys over all the parts' samples are a uniform sample of the whole df.
+    With fraction, keep each row with probability fraction.
+
+    Returns:
+        list[tuple[float, Any]]: The sampled rows, with their random keys.
+    """
+    rng = random.Random(seed)
+    rows = iterrows(files, columns=columns)
+    if n is None:
+        return [(0.0, row) for row in rows if rng.random() < fraction]
+
+    heap: list[tuple[float, int, Any]] = []  # max-heap of the n smallest keys
+    for i, row in enumerate(rows):
+        key = rng.random()
+        if len(heap) < n:
+            heapq.heappush(heap, (-key, i, row))
+        elif key < -heap[0][0]:
+            heapq.heapreplace(heap, (-key, i, row))
+    return [(-key, row) for key, _, row in heap]
@@ -0,0 +1,105 @@
+import io
+import os
+import tempfile
+from typing import Any, Iterator, Optional
+
+from fastavro import parse_schema, schemaless_reader, schemaless_writer
+
+
+class SpillBuffer:
+    """
+    Buffers rows per bucket within a memory budget, spilling to local disk.
+
+    Rows are kept Avro-encoded (without a container) in one in-memory buffer per
+    bucket, so their memory use is known exactly. When the buffered bytes exceed
+    memory_budget, all buffers are written to a new run file on local disk, one
+    contiguous segment per bucket, and cleared. Reading a bucket back replays its
+    segment of every run followed by what is still in memory, so rows come back in
+    the order they were appended. At most one run file is open at a time.
+    """
+
+    def __init__(
+        self,
+        avro_schema: Any,
+        memory_budget: int,
+        tmpdir: Optional[str] = None,
+    ) -> None:
+        self._schema = parse_schema(avro_schema)
+        self._memory_budget = memory_budget
+        self._tmpdir = tempfile.TemporaryDirectory(dir=tmpdir)
+
+        self._buffers: dict[int, io.BytesIO] = {}
+        self._buffered = 0
+        self._runs: list[tuple[str, dict[int, tuple[int, int]]]] = []
+
+    def append(self, bucket: int, row: Any) -> None:
+        buffer = self._buffers.get(bucket)
+        if buffer is None:
+            buffer = self._buffers[bucket] = io.BytesIO()
+
+        start = buffer.tell()
+        schemaless_writer(buffer, self._schema, row)
+        self._buffered += buffer.tell() - start
+
+        if self._buffered > self._memory_budget:
+            self.spill()
+
+    def spill(self) -> None:
+        """
+        Write all buffered rows to a new run file and clear the buffers.
+        """
+        if not self._buffers:
+            return
+
+        path = os.path.join(self._tmpdir.name, f"run{len(self._runs)}")
+        index = {}
+        with open(path, "wb") as f:
+            for bucket in sorted(self._buffers):
+                data = self._buffers[bucket].getbuffer()
+                index[bucket] = (f.tell(), len(data))
+                f.write(data)
+                data.release()
+        self._runs.append((path, index))
+
+        self._buffers = {}
+        self._buffered = 0
+
+    def buckets(self) -> list[int]:
+        """
+        Return the buckets holding at least one row, in ascending order.
+        """
+        buckets = set(self._buffers)
+        for _, index in self._runs:
+            buckets.update(index)
+        return sorted(buckets)
+
+    def _decode(self, data: bytes) -> Iterator[Any]:
+        fo = io.BytesIO(data)
+        while fo.tell() < len(data):
+            yield schemaless_reader(fo, self._schema, None)
+
+    def iterbucket(self, bucket: int) -> Iterator[Any]:
+        """
+        Iterate over the rows of a bucket, in the order they were appended.
+        """
+        for path, index in self._runs:
+            if bucket not in index:
+                continue
+            offset, size = index[bucket]
+            with open(path, "rb") as f:
+                f.seek(offset)
+                data = f.read(size)
+            yield from self._decode(data)
+
+        buffer = self._buffers.get(bucket)
+        if buffer is not None:
+            yield from self._decode(buffer.getvalue())
+
+    def close(self) -> None:
+        """
+        Drop the buffers and delete the run files.
+        """
+        self._buffers = {}
+        self._buffered = 0
+        self._runs = []
+        self._tmpdir.cleanup()
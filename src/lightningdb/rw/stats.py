@@ -0,0 +1,219 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+from operator import itemgetter
+from typing import Any, Iterator, Optional, Union
+
+from pydantic import BaseModel
+
+# Avro types whose values are tracked with min/max/null counts
+PRIMITIVE_TYPES = {"boolean", "int", "long", "float", "double", "string"}
+
+# Number of rows whose values are buffered before they are folded into the statistics
+STATS_BATCH = 4096
+
+# The fields of the files written by a stage that get min/max/null statistics: True
+# for every primitive field, False for none, or a list of field names
+ColumnStatsOption = Union[bool, list[str]]
+
+
+def key_stats(column_stats: Optional[ColumnStatsOption], keys: list[str]) -> Any:
+    """
+    Resolve the column_stats attribute of a stage with keys (sort, partition or
+    group keys), where None, the default, stands for the keys.
+    """
+    return list(keys) if column_stats is None else column_stats
+
+
+class ColumnStats(BaseModel):
+    min: Any = None
+    max: Any = None
+    nulls: int = 0
+
+
+class FileStats(BaseModel):
+    """
+    Statistics of one Avro file, collected by WriteDF while writing it.
+
+    Attributes:
+        file: The file name, relative to the df directory (None for merged stats).
+        rows: The number of records.
+        bytes: The size of the file.
+        raw_bytes: The size of the encoded records before compression.
+        columns: Min/max/null counts of the primitive fields, by field name.
+        blocks: The offset and number of records of each Avro block (block index).
+    """
+
+    file: Optional[str] = None
+    rows: int = 0
+    bytes: int = 0
+    raw_bytes: int = 0
+    columns: dict[str, ColumnStats] = {}
+    blocks: list[tuple[int, int]] = []
+
+
+def primitive_fields(avro_schema: Any) -> list[str]:
+    """
+    Return the names of the fields of a record schema whose type is a primitive type,
+    or a union of null and a primitive type.
+    """
+    if not isinstance(avro_schema, dict):
+        return []
+    names = []
+    for field in avro_schema.get("fields", []):
+        t = field["type"]
+        if isinstance(t, dict) and set(t) == {"type"}:
+            t = t["type"]
+        if isinstance(t, list):
+            t = [branch for branch in t if branch != "null"]
+            t = t[0] if len(t) == 1 else None
+        if isinstance(t, str) and t in PRIMITIVE_TYPES:
+            names.append(field["name"])
+    return names
+
+
+class StatsCollector:
+    """
+    Accumulates min/max/null counts of the primitive fields of the rows of a file, or
+    of the given columns among them.
+
+    The values of the fields are copied out of each row with an itemgetter and
+    buffered; every STATS_BATCH rows they are folded into the statistics column by
+    column, with the builtin min and max, rather than compared row by row in Python.
+    """
+
+    def __init__(self, avro_schema: Any, columns: Optional[list[str]] = None) -> None:
+        self.names = [
+            name
+            for name in primitive_fields(avro_schema)
+            if columns is None or name in columns
+        ]
+        self.mins = [None] * len(self.names)
+        self.maxs = [None] * len(self.names)
+        self.nulls = [0] * len(self.names)
+        # Returns the tuple of values of a row (a single value for a single field)
+        self._get = itemgetter(*self.names) if self.names else None
+        self._pending = []
+
+    def _values(self, row: dict) -> Any:
+        # Fields missing from a row are written as nulls
+        values = tuple(row.get(name) for name in self.names)
+        return values if len(values) > 1 else values[0]
+
+    def update(self, row: dict) -> None:
+        if self._get is None:
+            return
+        try:
+            self._pending.append(self._get(row))
+        except KeyError:
+            self._pending.append(self._values(row))
+        if len(self._pending) >= STATS_BATCH:
+            self._fold()
+
+    def update_many(self, rows: list[dict]) -> None:
+        if self._get is None:
+            return
+        try:
+            self._pending.extend(map(self._get, rows))
+        except KeyError:
+            self._pending.extend(map(self._values, rows))
+        if len(self._pending) >= STATS_BATCH:
+            self._fold()
+
+    def update_columns(self, columns: dict[str, Any]) -> None:
+        """
+        Updates the statistics with a batch of rows given as NumPy column arrays, as
+        written by WriteDF.extend_columns.
+        """
+        for i, name in enumerate(self.names):
+            column = columns[name]
+            if hasattr(column, "compressed"):
+                values = column.compressed()  # The unmasked values
+            elif isinstance(column, list) or column.dtype == object:
+                values = [v for v in column if v is not None]
+            else:
+                values = column
+            self.nulls[i] += len(column) - len(values)
+            if not len(values):
+                continue
+            if (
+                getattr(values, "dtype", None) is not None
+                and values.dtype.kind in "biuf"
+            ):
+                lo, hi = values.min().item(), values.max().item()
+            else:
+                lo, hi = min(values), max(values)
+            if self.mins[i] is None or lo < self.mins[i]:
+                self.mins[i] = lo
+            if self.maxs[i] is None or hi > self.maxs[i]:
+                self.maxs[i] = hi
+
+    def _fold(self) -> None:
+        pending, self._pending = self._pending, []
+        columns = [pending] if len(self.names) == 1 else zip(*pending)
+        for i, values in enumerate(columns):
+            values = [v for v in values if v is not None]
+            self.nulls[i] += len(pending) - len(values)
+            if not values:
+                continue
+            lo, hi = min(values), max(values)
+            if self.mins[i] is None or lo < self.mins[i]:
+                self.mins[i] = lo
+            if self.maxs[i] is None or hi > self.maxs[i]:
+                self.maxs[i] = hi
+
+    def columns(self) -> dict[str, ColumnStats]:
+        if self._pending:
+            self._fold()
+        return {
+            name: ColumnStats(min=self.mins[i], max=self.maxs[i], nulls=self.nulls[i])
+            for i, name in enumerate(self.names)
+        }
+
+
+def merge_stats(stats: list[FileStats]) -> FileStats:
+    """
+    Combine the statistics of several files, e.g. all the files of a part.
+    """
+    merged = FileStats()
+    for s in stats:
+        merged.rows += s.rows
+        merged.bytes += s.bytes
+        merged.raw_bytes += s.raw_bytes
+        for name, col in s.columns.items():
+            cur = merged.columns.get(name)
+            if cur is None:
+                merged.columns[name] = col.model_copy()
+                continue
+            cur.nulls += col.nulls
+            if col.min is not None and (cur.min is None or col.min < cur.min):
+                cur.min = col.min
+            if col.max is not None and (cur.max is None or col.max > cur.max):
+                cur.max = col.max
+    return merged
+
+
+# The statistics of the files closed by WriteDF are appended to the list of the
+# innermost active recording(), if any. run_pipeline uses it to gather the
+# statistics of the files written by a stage and store them in LightningCtx.
+_recording: ContextVar[Optional[list[FileStats]]] = ContextVar(
+    "lightningdb_stats", default=None
+)
+
+
+@contextmanager
+def recording() -> Iterator[list[FileStats]]:
+    """
+    Collect the FileStats of all files written by WriteDF within the block.
+    """
+    recorded = []
+    token = _recording.set(recorded)
+    try:
+        yield recorded
+    finally:
+        _recording.reset(token)
+
+
+def record(stats: FileStats) -> None:
+    recorded = _recording.get()
+    if recorded is not None:
+        recorded.append(stats)
@@ -1,8 +1,43 @@
+import io
+from typing import Any, NamedTuple, Optional
+
 from fastavro import parse_schema
 from fastavro.write import Writer
+from pydantic import BaseModel
 
+from lightningdb.rw.compress import COMPRESSORS, MAX_PENDING_BLOCKS, OrderedSink
 from lightningdb.rw.write_wrapper import WriteWrapper
 
+# Default uncompressed size at which an Avro block is finished and compressed
+# Larger blocks compress better and amortize the hand-off to the compression threads
+BLOCK_SIZE = 256 * 1024
+
+
+class EncodedBlock(NamedTuple):
+    # The block interface of fastavro's Writer.write_block
+    num_records: int
+    bytes_: io.BytesIO
+
+
+class WriteOptions(BaseModel):
+    """
+    How the Avro files of a WriteDF or a stage are encoded.
+
+    Attributes:
+        codec: The Avro codec, e.g. "zstandard", "deflate", "snappy" or "null".
+        compression_level: The codec's compression level, None for its default.
+        block_size: The uncompressed size in bytes at which a block is finished
+            (fastavro's sync_interval).
+        parallel: Compress the blocks on a thread pool while the next rows are
+            encoded. Only zstandard and deflate blocks are compressed in parallel;
+            other codecs are compressed inline.
+    """
+
+    codec: str = "zstandard"
+    compression_level: Optional[int] = None
+    block_size: int = BLOCK_SIZE
+    parallel: bool = True
+
 
 class WriteAvro:
     """
@@ -10,31 +45,137 @@ class WriteAvro:
     Uses WriteWrapper for handling local or S3 destinations and fastavro for Avro encoding.
     """
 
-    def __init__(self, uri, schema) -> None:
+    def __init__(self, uri, schema, options: Optional[WriteOptions] = None) -> None:
         """
         Initialize the WriteAvro object.
 
         :param uri: The destination URI (local path or S3 URI)
         :param schema: The Avro schema for the data to be written
+        :param options: The codec, compression level and block size (see WriteOptions)
         """
+        options = options or WriteOptions()
         self._bytes_writer = WriteWrapper(uri)
-        # Use zstandard codec for compression
+        # Blocks are written through an OrderedSink, which keeps them in order when
+        # they are compressed on the compression pool
+        self._sink = OrderedSink(self._bytes_writer, MAX_PENDING_BLOCKS)
         self._avro_writer = Writer(
-            self._bytes_writer, schema=parse_schema(schema), codec="zstandard"
+            self._sink,
+            schema=parse_schema(schema),
+            codec=options.codec,
+            compression_level=options.compression_level,
+            sync_interval=options.block_size,
         )
 
+        self.rows = 0  # Number of records written
+        self.raw_size = 0  # Size of the encoded records before compression
+        # Estimated size of the file up to the last finished block, updated once per
+        # block so that it can be checked after every row (see size())
+        self.block_end_size = 0
+        self._block_size = options.block_size
+
+        # Records encoded by extend_encoded, buffered until they fill a block
+        self._encoded: list[bytes] = []
+        self._encoded_rows = 0
+        self._encoded_size = 0
+
+        # Count the uncompressed size of each block as it is handed to the codec
+        compress = COMPRESSORS.get(options.codec) if options.parallel else None
+        block_writer = self._avro_writer.block_writer
+
+        def write_block(fo, data, level):
+            self.raw_size += len(data)
+            count = self._avro_writer.block_count or self._encoded_rows
+            if compress is not None:
+                self._sink.submit(compress, data, level, count)
+            else:
+                self._sink.write_inline(block_writer, data, level, count)
+            self.block_end_size = self._sink.size()
+
+        self._avro_writer.block_writer = write_block
+
     def append(self, row) -> None:
+        if self._encoded:
+            self._write_encoded()
         self._avro_writer.write(row)
+        self.rows += 1
+
+    def extend(self, rows) -> None:
+        if self._encoded:
+            self._write_encoded()
+        write = self._avro_writer.write
+        for row in rows:
+            write(row)
+        self.rows += len(rows)
+
+    def extend_encoded(self, data: bytes, ends: Any) -> None:
+        """
+        Append records already encoded, e.g. by columns.encode_columns, in blocks of
+        about the block size like the rows written by append.
+
+        :param data: The encoded records
+        :param ends: The offset at which each record ends in data
+        """
+        if self._avro_writer.block_count:
+            self._avro_writer.dump()  # Finish the block of the rows appended before
+        start = row = 0
+        while row < len(ends):
+            # Take the records up to the one that fills the block
+            room = self._block_size - self._encoded_size
+            stop = min(int(ends.searchsorted(start + room)) + 1, len(ends))
+            end = int(ends[stop - 1])
+            self._encoded.append(data[start:end])
+            self._encoded_rows += stop - row
+            self._encoded_size += end - start
+            if self._encoded_size >= self._block_size:
+                self._write_encoded()
+            start, row = end, stop
+        self.rows += len(ends)
+
+    def _write_encoded(self) -> None:
+        data = io.BytesIO(b"".join(self._encoded))
+        self._avro_writer.write_block(EncodedBlock(self._encoded_rows, data))
+        self._encoded = []
+        self._encoded_rows = 0
+        self._encoded_size = 0
 
     def close(self) -> None:
         """
         Finalize the Avro file and close the underlying WriteWrapper.
         """
-        self._avro_writer.flush()
+        try:
+            if self._encoded:
+                self._write_encoded()
+            self._avro_writer.flush()
+        except BaseException:
+            self.abort()
+            raise
         self._bytes_writer.close()
 
+    def abort(self) -> None:
+        """
+        Discard the file after an error, e.g. a row that does not match the schema,
+        aborting its S3 upload.
+        """
+        self._sink.abort()
+        self._bytes_writer.abort()
+
     def size(self) -> int:
         """
-        Return the current size of the written data in bytes.
+        Return the size of the file if it were closed now, in bytes.
+
+        Blocks still being compressed and the rows not yet in a block are counted
+        at the compression ratio of the blocks written so far.
+        """
+        return self._sink.size(self._avro_writer.io.tell() + self._encoded_size)
+
+    def blocks(self) -> list[tuple[int, int]]:
+        """
+        Return the offset and number of records of each block written, once closed.
+        """
+        return self._sink.blocks
+
+    def write_seconds(self) -> float:
+        """
+        Return the time spent writing the encoded data to the destination.
         """
-        return self._bytes_writer.size
+        return self._bytes_writer.write_seconds
@@ -1,9 +1,13 @@
 import os
 import random
 import string
-from typing import Any
+import time
+from typing import Any, Optional, Union
 
-from lightningdb.rw.write_avro import WriteAvro
+from lightningdb.rw.columns import column_encoding, columns_to_rows, encode_columns
+from lightningdb.rw.metrics import current
+from lightningdb.rw.stats import FileStats, StatsCollector, record
+from lightningdb.rw.write_avro import WriteAvro, WriteOptions
 
 # SPLIT_SIZE defines the target size for each file slice in bytes
 # When the current file size exceeds this value, a new slice is created
@@ -27,14 +31,40 @@ def new_file() -> str:
 class WriteDF:
     """
     A class for writing dataframes to Avro files, with support for splitting large datasets.
+    Implements context manager protocol: the files are closed on success, and the file
+    being written is aborted if an exception is raised.
     """
 
-    def __init__(self, dir: str, avro_schema: Any):
+    def __init__(
+        self,
+        dir: str,
+        avro_schema: Any,
+        collect_stats: Union[bool, list[str]] = False,
+        options: Optional[WriteOptions] = None,
+    ):
         self.dir = dir
         self.avro_schema = avro_schema
+        # The columns whose min/max/null counts are recorded, see ColumnStatsOption
+        self.collect_stats = collect_stats
+        self.options = options  # Codec, compression level and block size
 
         self.files = []  # List to store names of created files
+        self.stats = []  # FileStats of the closed files
         self.writer = None  # Current Avro writer
+        self.collector = None  # Column statistics of the current file
+        self.metrics = current()  # Metrics of the enclosing measuring(), if any
+        self.seconds = 0.0  # Time spent in append/extend for the current file
+        # How extend_columns encodes the columns, None to write them as rows
+        self.encoding = column_encoding(avro_schema)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is not None:
+            self.abort()
+        else:
+            self.close()
 
     def _new_slice(self) -> None:
         """
@@ -46,7 +76,10 @@ class WriteDF:
         self.files.append(file)
 
         fullpath = os.path.join(self.dir, file)
-        self.writer = WriteAvro(fullpath, self.avro_schema)
+        self.writer = WriteAvro(fullpath, self.avro_schema, self.options)
+        if self.collect_stats:
+            columns = None if self.collect_stats is True else self.collect_stats
+            self.collector = StatsCollector(self.avro_schema, columns)
 
     def append(self, row: Any) -> None:
         """
@@ -55,10 +88,68 @@ class WriteDF:
         if self.writer is None:
             self._new_slice()
 
-        self.writer.append(row)
+        if self.metrics is None:
+            self.writer.append(row)
+        else:
+            start = time.perf_counter()
+            self.writer.append(row)
+            self.seconds += time.perf_counter() - start
+        if self.collector is not None:
+            self.collector.update(row)
 
         # If the current file exceeds the size limit, finalize it and prepare for a new one
-        if self.writer.size() > SPLIT_SIZE:
+        # The size is checked at block granularity, so files overshoot by up to a block
+        if self.writer.block_end_size > SPLIT_SIZE:
+            self.close()
+
+    def extend(self, rows: list[Any]) -> None:
+        """
+        Appends a batch of rows, checking the file size once per batch instead of once per row.
+        """
+        if not rows:
+            return
+        if self.writer is None:
+            self._new_slice()
+
+        start = time.perf_counter()
+        self.writer.extend(rows)
+        self.seconds += time.perf_counter() - start
+        if self.collector is not None:
+            self.collector.update_many(rows)
+
+        # Checked at block granularity like append, so both split at the same point
+        if self.writer.block_end_size > SPLIT_SIZE:
+            self.close()
+
+    def extend_columns(self, columns: dict[str, Any]) -> None:
+        """
+        Appends a batch of rows given as a dict of column arrays (or lists), e.g. one
+        returned by iterbatches. Masked values are written as nulls.
+
+        Columns of primitive types are encoded column by column, without a dict per
+        row; other columns are converted to rows and written with extend.
+        """
+        encoded = None
+        if self.encoding is not None:
+            start = time.perf_counter()
+            encoded = encode_columns(columns, self.encoding)
+            encode_seconds = time.perf_counter() - start
+        if encoded is None:
+            self.extend(columns_to_rows(columns))
+            return
+        data, ends = encoded
+        if not len(ends):
+            return
+        if self.writer is None:
+            self._new_slice()
+
+        start = time.perf_counter()
+        self.writer.extend_encoded(data, ends)
+        self.seconds += time.perf_counter() - start + encode_seconds
+        if self.collector is not None:
+            self.collector.update_columns(columns)
+
+        if self.writer.block_end_size > SPLIT_SIZE:
             self.close()
 
     def close(self) -> None:
@@ -66,5 +157,36 @@ class WriteDF:
         Closes the current Avro writer and finalizes the last slice.
         """
         if self.writer is not None:
+            start = time.perf_counter()
             self.writer.close()
+            if self.metrics is not None:
+                self.seconds += time.perf_counter() - start
+                self.metrics.rows_out += self.writer.rows
+                self.metrics.encode_seconds += (
+                    self.seconds - self.writer.write_seconds()
+                )
+            self.seconds = 0.0
+            stats = FileStats(
+                file=self.files[-1],
+                rows=self.writer.rows,
+                bytes=self.writer.size(),
+                raw_bytes=self.writer.raw_size,
+                columns=self.collector.columns() if self.collector else {},
+                blocks=self.writer.blocks(),
+            )
+            self.stats.append(stats)
+            record(stats)
+            self.writer = None
+            self.collector = None
+
+    def abort(self) -> None:
+        """
+        Discards the slice being written, e.g. after an error in the rows' producer.
+        Its multipart S3 upload is aborted; the files already closed are kept.
+        """
+        if self.writer is not None:
+            self.writer.abort()
+            self.files.pop()
             self.writer = None
+            self.collector = None
+            self.seconds = 0.0
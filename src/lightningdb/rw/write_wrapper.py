@@ -1,24 +1,165 @@
+import io
 import os
-import tempfile
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
 
-from lightningdb.rw.s3utils import upload_file
+from lightningdb.rw.metrics import current
+from lightningdb.rw.s3cache import get_cache
+from lightningdb.rw.s3utils import get_client, parse_s3_uri
+
+# S3 outputs are uploaded in multipart parts of PART_SIZE bytes as they are written
+# S3 requires every part but the last to be at least 5 MiB
+PART_SIZE = 8 * 1024 * 1024
+
+# Maximum number of parts of a single file being uploaded at once
+# Writes block when the limit is reached, bounding memory to about
+# PART_SIZE * (MAX_IN_FLIGHT + 1) per open file
+MAX_IN_FLIGHT = 4
+
+# Number of threads uploading parts, shared by all open files of the process
+UPLOAD_THREADS = 16
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+
+def get_upload_pool() -> ThreadPoolExecutor:
+    """
+    Get the process-wide thread pool used to upload multipart parts.
+    """
+    global _pool, _pool_pid
+    with _pool_lock:
+        if _pool is None or _pool_pid != os.getpid():
+            _pool = ThreadPoolExecutor(UPLOAD_THREADS)
+            _pool_pid = os.getpid()
+        return _pool
+
+
+class S3Upload:
+    """
+    A write-only stream that uploads to S3 with a multipart upload.
+
+    Bytes are buffered until a full part is available, which is then uploaded in the
+    background while writing continues. Files smaller than one part are uploaded with
+    a single PUT on close.
+    """
+
+    def __init__(self, uri: str, part_size: int, max_in_flight: int) -> None:
+        self._bucket, self._key = parse_s3_uri(uri)
+        self._s3 = get_client()
+        self._part_size = part_size
+        self._buffer = bytearray()
+        self._upload_id = None
+        self._futures: list[Future] = []
+        self.etag = None  # ETag of the object, once uploaded
+        self._slots = threading.BoundedSemaphore(max_in_flight)
+
+    def _upload_part(self, number: int, data: bytes) -> dict:
+        try:
+            resp = self._s3.upload_part(
+                Bucket=self._bucket,
+                Key=self._key,
+                UploadId=self._upload_id,
+                PartNumber=number,
+                Body=data,
+            )
+            return {"PartNumber": number, "ETag": resp["ETag"]}
+        finally:
+            self._slots.release()
+
+    def _submit_part(self, data: bytes) -> None:
+        if self._upload_id is None:
+            resp = self._s3.create_multipart_upload(Bucket=self._bucket, Key=self._key)
+            self._upload_id = resp["UploadId"]
+
+        # Surface failures of earlier parts as soon as possible
+        for future in self._futures:
+            if future.done() and future.exception() is not None:
+                raise future.exception()
+
+        self._slots.acquire()
+        number = len(self._futures) + 1
+        self._futures.append(get_upload_pool().submit(self._upload_part, number, data))
+
+    def write(self, buffer) -> int:
+        self._buffer += buffer
+        while len(self._buffer) >= self._part_size:
+            self._submit_part(bytes(self._buffer[: self._part_size]))
+            del self._buffer[: self._part_size]
+        return len(buffer)
+
+    def close(self) -> None:
+        try:
+            if self._upload_id is None:
+                resp = self._s3.put_object(
+                    Bucket=self._bucket, Key=self._key, Body=bytes(self._buffer)
+                )
+                self.etag = resp["ETag"]
+                return
+
+            if self._buffer:
+                self._submit_part(bytes(self._buffer))
+            parts = [future.result() for future in self._futures]
+            resp = self._s3.complete_multipart_upload(
+                Bucket=self._bucket,
+                Key=self._key,
+                UploadId=self._upload_id,
+                MultipartUpload={"Parts": parts},
+            )
+            self.etag = resp["ETag"]
+        except BaseException:
+            self.abort()
+            raise
+        finally:
+            self._buffer = bytearray()
+
+    def abort(self) -> None:
+        for future in self._futures:
+            future.cancel()
+        for future in self._futures:
+            if not future.cancelled():
+                future.exception()  # wait for the part to finish
+        if self._upload_id is not None:
+            self._s3.abort_multipart_upload(
+                Bucket=self._bucket, Key=self._key, UploadId=self._upload_id
+            )
+            self._upload_id = None
+        self._futures = []
+
+    def flush(self) -> None:
+        pass
+
+    def fileno(self) -> int:
+        raise io.UnsupportedOperation("S3 uploads have no file descriptor")
 
 
 class WriteWrapper:
     """
     A wrapper class for writing data to either a local file or an S3 bucket.
     Provides a unified interface for writing, regardless of the destination.
-    Includes self.size attribute for tracking the total number of bytes written.
+    Includes self.size attribute for tracking the total number of bytes written,
+    and self.write_seconds for the time spent writing them.
     Implements context manager protocol for safe resource management.
     """
 
     def __init__(self, uri):
         self._uri = uri
         self.size = 0
+        self.write_seconds = 0.0
+        self._metrics = current()
+        self._cache = None
+        self._cache_file = None
 
         if uri.startswith("s3://"):
-            # For S3, create a temporary local file
-            self._fp = tempfile.NamedTemporaryFile()
+            # For S3, stream the bytes with a multipart upload
+            self._fp = S3Upload(uri, PART_SIZE, MAX_IN_FLIGHT)
+            # and copy them to the S3 cache if it is enabled, so that the stages
+            # reading the file next find it there
+            self._cache = get_cache()
+            if self._cache is not None:
+                self._cache_file = self._cache.new_file()
         else:
             dir = os.path.dirname(uri)
             os.makedirs(dir, exist_ok=True)
@@ -28,19 +169,59 @@ class WriteWrapper:
         return self
 
     def __exit__(self, exc_type, exc_value, traceback):
-        self.close()
+        if exc_type is not None:
+            self.abort()
+        else:
+            self.close()
 
     def write(self, buffer, /) -> int:
+        start = time.perf_counter()
         n = self._fp.write(buffer)
+        if self._cache_file is not None:
+            try:
+                self._cache_file.write(buffer)
+            except OSError:
+                # The cache is best effort, e.g. when its disk is full
+                self._discard_cache_file()
+        self.write_seconds += time.perf_counter() - start
         self.size += n
         return n
 
     def close(self):
-        if self._uri.startswith("s3://"):
-            # For S3, upload the temporary file to the specified S3 location
-            self._fp.seek(0)
-            upload_file(self._fp, self._uri)
-        self._fp.close()
+        start = time.perf_counter()
+        try:
+            self._fp.close()
+        except BaseException:
+            self._discard_cache_file()
+            raise
+        if self._cache_file is not None:
+            bucket, key = parse_s3_uri(self._uri)
+            self._cache.commit(self._cache_file, bucket, key, self._fp.etag)
+            self._cache_file = None
+        self.write_seconds += time.perf_counter() - start
+        if self._metrics is not None:
+            self._metrics.bytes_out += self.size
+            self._metrics.write_seconds += self.write_seconds
+            self._metrics = None
+
+    def abort(self):
+        """
+        Stop writing after an error. A multipart S3 upload is aborted, so that no
+        partial object is published and its parts are not left behind, and a partial
+        local file is removed.
+        """
+        if isinstance(self._fp, S3Upload):
+            self._fp.abort()
+        elif not self._fp.closed:
+            self._fp.close()
+            os.remove(self._uri)
+        self._discard_cache_file()
+        self._metrics = None
+
+    def _discard_cache_file(self):
+        if self._cache_file is not None:
+            self._cache.discard(self._cache_file)
+            self._cache_file = None
 
     def seekable(self):
         return False
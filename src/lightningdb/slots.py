@@ -0,0 +1,45 @@
+import fcntl
+import os
+import time
+from contextlib import contextmanager
+from typing import Iterator
+
+# Directory holding the lock files of the per-node slot pools
+SLOT_DIR = "/tmp/lightningdb-slots"
+
+
+@contextmanager
+def node_slot(name: str, nslots: int, poll_interval: float = 0.05) -> Iterator[int]:
+    """
+    Hold one of the nslots slots of the named pool for the duration of the block.
+
+    Slots are exclusive flock()s on lock files under SLOT_DIR, so the limit is shared
+    by every process and thread of the machine (e.g. several pipelines or workers),
+    and a slot is released automatically if its holder dies.
+
+    Args:
+        name (str): The name of the pool.
+        nslots (int): The number of slots of the pool.
+        poll_interval (float): Seconds to wait between attempts when all slots are taken.
+
+    Yields:
+        int: The number of the slot held.
+    """
+    os.makedirs(SLOT_DIR, exist_ok=True)
+    while True:
+        for slot in range(nslots):
+            fd = os.open(
+                os.path.join(SLOT_DIR, f"{name}.{slot}"), os.O_RDWR | os.O_CREAT
+            )
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                os.close(fd)
+                continue
+            try:
+                yield slot
+                return
+            finally:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+                os.close(fd)
+        time.sleep(poll_interval)
@@ -0,0 +1,379 @@
+import io
+import os
+import tempfile
+import zlib
+from contextlib import ExitStack
+from typing import Any, Iterator, Literal, Optional
+
+import cloudpickle
+from fastavro import parse_schema, schemaless_writer
+from pydantic import BaseModel
+
+from lightningdb.executor import run_part, run_tasks
+from lightningdb.rw.metrics import current
+from lightningdb.rw.predicate import Predicate
+from lightningdb.rw.read_df import iterrows
+from lightningdb.rw.spill import SpillBuffer
+from lightningdb.rw.stats import ColumnStatsOption, key_stats, record
+from lightningdb.rw.write_avro import WriteOptions
+from lightningdb.rw.write_df import WriteDF
+
+# Default memory budget of a hash table, in bytes of Avro-encoded partial rows
+# Python objects take several times more memory than their encoding
+MEMORY_BUDGET = 256 * 1024 * 1024
+
+# The encoded size of one group in SIZE_SAMPLE is measured to estimate the size of
+# the hash table
+SIZE_SAMPLE = 64
+
+# Number of buckets the groups that do not fit in a finalize hash table are spilled to
+# Each bucket is aggregated on its own afterwards, recursively if it does not fit
+SPILL_BUCKETS = 16
+
+# Partial count_distinct states are shuffled as arrays of primitive values
+DISTINCT_ITEMS = ["null", "boolean", "long", "double", "string", "bytes"]
+
+Function = Literal["count", "sum", "min", "max", "count_distinct"]
+
+
+def group_part(key: tuple, nparts: int, level: int = 0) -> int:
+    """
+    Assign a group key to one of nparts parts with a stable hash.
+
+    Spilled buckets are re-partitioned with a different level, so that the groups of
+    a bucket are spread over the buckets of the next level.
+    """
+    return zlib.crc32(str((level, *key)).encode()) % nparts
+
+
+def new_state(fn: str, value: Any) -> Any:
+    """
+    Return the partial state of an aggregate function over a single value.
+
+    count counts non-null values, and the other functions ignore nulls.
+    """
+    if fn == "count":
+        return 0 if value is None else 1
+    if fn == "count_distinct":
+        return set() if value is None else {value}
+    return value
+
+
+def merge_state(fn: str, state: Any, other: Any) -> Any:
+    """
+    Merge two partial states of an aggregate function.
+    """
+    if fn == "count":
+        return state + other
+    if fn == "count_distinct":
+        state.update(other)
+        return state
+    if state is None:
+        return other
+    if other is None:
+        return state
+    if fn == "sum":
+        return state + other
+    if fn == "min":
+        return min(state, other)
+    return max(state, other)
+
+
+def partial_schema(
+    avro_schema: Any, keys: list[str], aggs: dict[str, tuple[Function, Optional[str]]]
+) -> dict:
+    """
+    Build the schema of the partial rows shuffled between the two phases of Aggregate.
+
+    Keys, counts, sums, minimums and maximums have the type of the output field;
+    count_distinct states are arrays of distinct values.
+    """
+    types = {field["name"]: field["type"] for field in avro_schema["fields"]}
+    fields = [{"name": key, "type": types[key]} for key in keys]
+    for name, (fn, _) in aggs.items():
+        if fn == "count":
+            fields.append({"name": name, "type": "long"})
+        elif fn == "count_distinct":
+            fields.append(
+                {"name": name, "type": {"type": "array", "items": DISTINCT_ITEMS}}
+            )
+        else:
+            fields.append({"name": name, "type": types[name]})
+    return {"type": "record", "name": "AggregatePartial", "fields": fields}
+
+
+class HashAggregator:
+    """
+    A hash table of partial aggregate states per group key, with a size estimate.
+
+    Attributes:
+        groups: The partial states of each group, in aggregate order.
+    """
+
+    def __init__(
+        self,
+        keys: list[str],
+        aggs: dict[str, tuple[Function, Optional[str]]],
+        schema: Any,
+    ) -> None:
+        self.keys = keys
+        self.names = list(aggs)
+        self.fns = [fn for fn, _ in aggs.values()]
+        self.columns = [column for _, column in aggs.values()]
+        self.schema = schema  # The parsed partial schema
+        self.groups: dict[tuple, list] = {}
+        self._sampled_groups = 0
+        self._sampled_bytes = 0
+        self._sample = io.BytesIO()
+
+    def key(self, row: dict) -> tuple:
+        return tuple(row[k] for k in self.keys)
+
+    def states(self, row: dict) -> list:
+        """
+        Return the partial states of an input row.
+        """
+        return [
+            new_state(fn, True if column is None else row[column])
+            for fn, column in zip(self.fns, self.columns)
+        ]
+
+    def partial_states(self, row: dict) -> list:
+        """
+        Return the partial states of a partial row.
+        """
+        return [
+            set(row[name]) if fn == "count_distinct" else row[name]
+            for fn, name in zip(self.fns, self.names)
+        ]
+
+    def add(self, key: tuple, states: list) -> None:
+        group = self.groups.get(key)
+        if group is None:
+            self.groups[key] = states
+            if (len(self.groups) - 1) % SIZE_SAMPLE == 0:
+                self._measure(key, states)
+            return
+        for i, fn in enumerate(self.fns):
+            group[i] = merge_state(fn, group[i], states[i])
+
+    def _measure(self, key: tuple, states: list) -> None:
+        self._sample.seek(0)
+        self._sample.truncate()
+        schemaless_writer(self._sample, self.schema, self.partial_row(key, states))
+        self._sampled_groups += 1
+        self._sampled_bytes += self._sample.tell()
+
+    def size(self) -> int:
+        """
+        Estimate the encoded size of the partial rows of the table.
+
+        count_distinct states are measured when their group is created, so large
+        sets grown afterwards are underestimated.
+        """
+        if not self._sampled_groups:
+            return 0
+        return len(self.groups) * self._sampled_bytes // self._sampled_groups
+
+    def partial_row(self, key: tuple, states: list) -> dict:
+        row = dict(zip(self.keys, key))
+        for fn, name, state in zip(self.fns, self.names, states):
+            row[name] = list(state) if fn == "count_distinct" else state
+        return row
+
+    def final_row(self, key: tuple, states: list) -> dict:
+        row = dict(zip(self.keys, key))
+        for fn, name, state in zip(self.fns, self.names, states):
+            row[name] = len(state) if fn == "count_distinct" else state
+        return row
+
+    def clear(self) -> None:
+        self.groups = {}
+
+
+def finalize_rows(
+    agg: HashAggregator,
+    rows: Iterator[dict],
+    memory_budget: int,
+    level: int = 0,
+) -> Iterator[dict]:
+    """
+    Merge partial rows into final rows, within a memory budget (hybrid hash
+    aggregation).
+
+    Groups are merged in a hash table until its estimated size exceeds memory_budget.
+    Rows of the groups already in the table keep being merged in memory, while rows
+    of new groups are spilled to SPILL_BUCKETS buckets on local disk. Each bucket
+    holds whole groups and is aggregated on its own once the input is consumed.
+
+    Yields:
+        dict: One final row per group, in no particular order.
+    """
+    agg.clear()
+    spill = None
+    try:
+        for row in rows:
+            key = agg.key(row)
+            if spill is not None and key not in agg.groups:
+                spill.append(group_part(key, SPILL_BUCKETS, level), row)
+                continue
+            agg.add(key, agg.partial_states(row))
+            if spill is None and agg.size() > memory_budget:
+                spill = SpillBuffer(agg.schema, memory_budget)
+
+        groups = agg.groups
+        for key, states in groups.items():
+            yield agg.final_row(key, states)
+        if spill is None:
+            return
+        for bucket in spill.buckets():
+            yield from finalize_rows(
+                agg, spill.iterbucket(bucket), memory_budget, level + 1
+            )
+    finally:
+        if spill is not None:
+            spill.close()
+
+
+# The two phases of Aggregate, run as per-part stages with run_part
+
+
+class Combine(BaseModel):
+    """
+    Map phase of Aggregate: partially aggregate one input part and route the partial
+    rows to their output part. The hash table is flushed whenever it outgrows the
+    memory budget, so a group may be routed several times; finalize merges them.
+    """
+
+    stage: Any  # The Aggregate
+
+    def run(self, input_files: list[str], output_dir: str) -> list[list[str]]:
+        stage = self.stage
+        schema = partial_schema(stage.avro_schema, stage.keys, stage.aggs)
+        agg = HashAggregator(stage.keys, stage.aggs, parse_schema(schema))
+
+        def flush() -> None:
+            for key, states in agg.groups.items():
+                part = group_part(key, stage.nparts)
+                writers[part].append(agg.partial_row(key, states))
+            agg.clear()
+
+        with ExitStack() as stack:
+            writers = [
+                stack.enter_context(WriteDF(output_dir, schema, collect_stats=False))
+                for _ in range(stage.nparts)
+            ]
+            rows = iterrows(
+                input_files, columns=stage.input_columns(), where=stage.where
+            )
+            for row in rows:
+                agg.add(agg.key(row), agg.states(row))
+                if agg.size() > stage.memory_budget:
+                    flush()
+            flush()
+        return [writer.files for writer in writers]
+
+
+class Finalize(BaseModel):
+    """
+    Reduce phase of Aggregate: merge the partial rows of one output part.
+    """
+
+    stage: Any  # The Aggregate
+
+    def run(self, input_files: list[str], output_dir: str) -> list[str]:
+        stage = self.stage
+        schema = partial_schema(stage.avro_schema, stage.keys, stage.aggs)
+        agg = HashAggregator(stage.keys, stage.aggs, parse_schema(schema))
+        rows = iterrows(input_files)
+        with WriteDF(
+            output_dir,
+            stage.avro_schema,
+            collect_stats=key_stats(stage.column_stats, stage.keys),
+            options=stage.write_options,
+        ) as writer:
+            for row in finalize_rows(agg, rows, stage.memory_budget):
+                writer.append(row)
+        return writer.files
+
+
+# Aggregate groups the rows of a dataframe by one or more keys and computes aggregate
+# functions per group, like SQL's GROUP BY, without a Sql process or a separate
+# Shuffle of the raw rows:
+#   Aggregate(nparts=8, keys=["user"], avro_schema=schema,
+#             aggs={"n": ("count", None), "total": ("sum", "amount"),
+#                   "days": ("count_distinct", "day")})
+#
+# Each input part is first aggregated on its own (map-side combine), and only the
+# partial aggregates are shuffled to the nparts output parts, where they are merged.
+# Both phases use hash tables bounded by memory_budget: the map phase flushes its
+# table early, and the final phase spills the groups that do not fit to local disk.
+# Both run on a pool of up to max_workers processes (default: one per core).
+# Each group ends up in a single output part, routed by a stable hash of its key.
+#
+# Functions, computed over the non-null values of a column:
+#   count (of rows if the column is None), sum, min, max and count_distinct.
+# sum, min and max are null for groups without values. count_distinct values must be
+# primitive (boolean, long, double, string or bytes).
+#
+# Attributes:
+#   nparts: The number of output parts.
+#   keys: The group key fields.
+#   aggs: The output field of each aggregate, mapped to its function and column.
+#   avro_schema: The schema of the output rows: the keys, then the aggregates.
+#   memory_budget: Bytes of encoded partial rows held in each hash table.
+#   max_workers: The maximum number of worker processes.
+#   where: Filter of the input rows, as in FlatMap.
+#   write_options: The codec, compression level and block size of the output files.
+#   column_stats: The fields whose min/max/null statistics are recorded, for filters:
+#       by default the keys, True for all fields (see ColumnStatsOption).
+class Aggregate(BaseModel):
+    nparts: int
+    keys: list[str]
+    aggs: dict[str, tuple[Function, Optional[str]]]
+    avro_schema: Any
+    memory_budget: int = MEMORY_BUDGET
+    max_workers: Optional[int] = None
+    where: Optional[Predicate] = None
+    write_options: WriteOptions = WriteOptions()
+    column_stats: Optional[ColumnStatsOption] = None
+
+    def input_columns(self) -> list[str]:
+        columns = self.keys + [column for _, column in self.aggs.values() if column]
+        columns += [column for column, _, _ in self.where or []]
+        return list(dict.fromkeys(columns))
+
+    def runall(self, input_pfiles: list[list[str]], output_dir: str) -> list[list[str]]:
+        with tempfile.TemporaryDirectory() as tmpdir:
+            payload = cloudpickle.dumps(Combine(stage=self))
+            tasks = [
+                (payload, part, files, tmpdir)
+                for part, files in enumerate(input_pfiles)
+                if files
+            ]
+            combined = run_tasks(run_part, tasks, self.max_workers)
+
+            partial_pfiles = [[] for _ in range(self.nparts)]
+            for result in combined:
+                for part, files in enumerate(result.output):
+                    partial_pfiles[part].extend(os.path.join(tmpdir, f) for f in files)
+
+            payload = cloudpickle.dumps(Finalize(stage=self))
+            tasks = [
+                (payload, part, files, output_dir)
+                for part, files in enumerate(partial_pfiles)
+                if files
+            ]
+            finalized = run_tasks(run_part, tasks, self.max_workers)
+
+        # The statistics of the temporary partial files are dropped
+        metrics = current()
+        output_pfiles = [[] for _ in range(self.nparts)]
+        for result in finalized:
+            output_pfiles[result.part] = result.output
+            for stats in result.stats:
+                record(stats)
+        if metrics is not None:
+            for result in combined + finalized:
+                metrics.add(result.metrics)
+        return output_pfiles
@@ -0,0 +1,96 @@
+import os
+
+from pydantic import BaseModel
+
+from lightningdb.rw.avro_blocks import BlockWriter, iter_blocks, read_header
+from lightningdb.rw.metrics import current
+from lightningdb.rw.read_wrapper import ReadWrapper
+from lightningdb.rw.stats import FileStats, record
+from lightningdb.rw.write_df import SPLIT_SIZE, new_file
+from lightningdb.rw.write_wrapper import WriteWrapper
+
+
+def compact_files(
+    input_files: list[str], output_dir: str, split_size: int
+) -> list[str]:
+    """
+    Concatenate Avro files by copying their compressed blocks, without decoding them.
+
+    Consecutive files with the same schema and codec are copied into the same output
+    file, until it exceeds split_size; a file with a different schema or codec starts
+    a new one. Rows keep their order. Statistics are recorded for the output files,
+    without column statistics, and with the uncompressed size only counted for the
+    zstandard and null codecs.
+
+    Args:
+        input_files (list[str]): The files to compact, as paths or URIs.
+        output_dir (str): The directory (or S3 prefix) of the output files.
+        split_size (int): The size above which an output file is finished.
+
+    Returns:
+        list[str]: The names of the output files, relative to output_dir.
+    """
+    files = []
+    writer = None
+    fp = None
+
+    def close() -> None:
+        nonlocal writer, fp
+        if writer is None:
+            return
+        fp.close()
+        record(
+            FileStats(
+                file=files[-1],
+                rows=writer.rows,
+                bytes=fp.size,
+                raw_bytes=writer.raw_size,
+                blocks=writer.blocks,
+            )
+        )
+        metrics = current()
+        if metrics is not None:
+            metrics.rows_in += writer.rows
+            metrics.rows_out += writer.rows
+        writer = fp = None
+
+    try:
+        for input_file in input_files:
+            reader = ReadWrapper(input_file)
+            try:
+                header = read_header(reader)
+                if writer is not None and not writer.header.compatible(header):
+                    close()
+                for _, count, data in iter_blocks(reader, header):
+                    if writer is None:
+                        files.append(new_file())
+                        fp = WriteWrapper(os.path.join(output_dir, files[-1]))
+                        writer = BlockWriter(fp, header)
+                    writer.write_block(count, data)
+                    if fp.size > split_size:
+                        close()
+            finally:
+                reader.close()
+        close()
+    except BaseException:
+        if fp is not None:
+            # Do not publish a partial S3 object
+            fp.abort()
+        raise
+    return files
+
+
+# Compact merges the many small files of each part into files of about split_size bytes,
+# e.g. after a Shuffle with a large nparts. The compressed Avro blocks are copied as is,
+# without decompressing or decoding the rows, so it runs at I/O speed. The rows and
+# their order are unchanged.
+# Files with a different schema or codec than the previous ones start a new file.
+# The output files have no column statistics, so filters on them cannot skip files.
+#
+# Attributes:
+#   split_size: The size above which an output file is finished.
+class Compact(BaseModel):
+    split_size: int = SPLIT_SIZE
+
+    def run(self, input_files: list[str], output_dir: str) -> list[str]:
+        return compact_files(input_files, output_dir, self.split_size)
@@ -1,20 +1,35 @@
-from typing import Any
+from typing import Any, Iterator, Optional
 
 from pydantic import BaseModel
 
+from lightningdb.rw.stats import ColumnStatsOption
+from lightningdb.rw.write_avro import WriteOptions
 from lightningdb.rw.write_df import WriteDF
 
 
 # Const class generates a constant dataset by writing a predefined list of items to output files.
 # It ignores input files and always produces the same output based on its 'items' attribute.
 # This is useful for creating static datasets or injecting constant data into a processing pipeline.
+# write_options sets the codec, compression level and block size of the output files,
+# and column_stats the fields whose min/max/null statistics are recorded, as in FlatMap.
 class Const(BaseModel, extra="forbid"):
     items: list[Any]
     avro_schema: Any
+    write_options: WriteOptions = WriteOptions()
+    column_stats: ColumnStatsOption = False
+
+    def transform(
+        self, rows: Iterator[Any], input_schemas: Optional[list[Any]] = None
+    ) -> Iterator[Any]:
+        yield from self.items
 
     def run(self, input_files: list[str], output_dir: str) -> list[str]:
-        writer = WriteDF(output_dir, self.avro_schema)
-        for item in self.items:
-            writer.append(item)
-        writer.close()
+        with WriteDF(
+            output_dir,
+            self.avro_schema,
+            collect_stats=self.column_stats,
+            options=self.write_options,
+        ) as writer:
+            for item in self.items:
+                writer.append(item)
         return writer.files
@@ -1,27 +1,65 @@
-from itertools import chain
-from typing import Any, Callable
+import time
+from typing import Any, Callable, Iterator, Optional
 
 from pydantic import BaseModel
 
+from lightningdb.rw.metrics import current
+from lightningdb.rw.predicate import Predicate
 from lightningdb.rw.read_df import iterrows
+from lightningdb.rw.stats import ColumnStatsOption
+from lightningdb.rw.write_avro import WriteOptions
 from lightningdb.rw.write_df import WriteDF
 
 
 # FlatMap class applies a function to each input row, potentially producing multiple output rows.
 # It reads input files, processes each row with the given function, and writes the results to output files.
+# transform() exposes the same processing as a generator, so that the pipeline can fuse it with
+# adjacent stages without writing the intermediate rows.
 #
 # Attributes:
 #   fn: A function that takes a single row and returns a list of rows.
 #   avro_schema: The schema for the output data.
+#   columns: If set, only these input columns are decoded and passed to fn.
+#   where: If set, only the input rows satisfying this predicate are passed to fn.
+#          Input files whose statistics rule out any match are not read.
+#   write_options: The codec, compression level and block size of the output files.
+#   column_stats: The output fields whose min/max/null statistics are recorded, so
+#       that filters on them can skip files: True for all, or a list of fields.
 class FlatMap(BaseModel):
     fn: Callable[[Any], list[Any]]
     avro_schema: Any
+    columns: Optional[list[str]] = None
+    where: Optional[Predicate] = None
+    write_options: WriteOptions = WriteOptions()
+    column_stats: ColumnStatsOption = False
+
+    def transform(
+        self, rows: Iterator[Any], input_schemas: Optional[list[Any]] = None
+    ) -> Iterator[Any]:
+        metrics = current()
+        if metrics is None:
+            for row in rows:
+                yield from self.fn(row)
+            return
+
+        fn_seconds = 0.0
+        try:
+            for row in rows:
+                start = time.perf_counter()
+                results = self.fn(row)
+                fn_seconds += time.perf_counter() - start
+                yield from results
+        finally:
+            metrics.fn_seconds += fn_seconds
 
     def run(self, input_files: list[str], output_dir: str) -> list[str]:
-        writer = WriteDF(output_dir, self.avro_schema)
-        for row in iterrows(input_files):
-            results = self.fn(row)
-            for result in results:
+        rows = iterrows(input_files, columns=self.columns, where=self.where)
+        with WriteDF(
+            output_dir,
+            self.avro_schema,
+            collect_stats=self.column_stats,
+            options=self.write_options,
+        ) as writer:
+            for result in self.transform(rows):
                 writer.append(result)
-        writer.close()
         return writer.files
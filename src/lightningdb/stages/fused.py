@@ -0,0 +1,93 @@
+from contextlib import ExitStack
+from typing import Any, Iterator, Optional
+
+from pydantic import BaseModel
+
+from lightningdb.rw.predicate import Predicate, matches, validate
+from lightningdb.rw.read_df import PREFETCH, read_files
+from lightningdb.rw.write_df import WriteDF
+
+
+def tee(rows: Iterator[Any], writer: WriteDF) -> Iterator[Any]:
+    for row in rows:
+        writer.append(row)
+        yield row
+
+
+def restrict(
+    rows: Iterator[Any], columns: Optional[list[str]], where: Optional[Predicate]
+) -> Iterator[Any]:
+    """
+    Filter and project rows in memory, as iterrows does when it reads them, for the
+    input of a fused stage after the first.
+    """
+    validate(where)
+    if where:
+        rows = (row for row in rows if matches(row, where))
+    if columns is not None:
+        rows = ({k: v for k, v in row.items() if k in columns} for row in rows)
+    return rows
+
+
+# Fused runs a chain of per-part stages as one streaming generator chain per part.
+# It is created by run_pipeline for adjacent stages that implement transform().
+# Only the output of the last stage is written, unless an intermediate stage is given
+# an output directory in intermediate_dirs, in which case its rows are also written
+# there (for debugging).
+#
+# The columns and where of the first stage are pushed down into iterrows; those of
+# the next stages are applied to the rows passed to them (see restrict), so a fused
+# chain returns the same rows as the stages run one by one.
+#
+# Each stage's transform() is also given the schemas of its input rows, the last one
+# being current: those of the input files opened so far for the first stage, and the
+# avro_schema of the previous stage for the next ones. BatchMap types its NumPy
+# columns with them, as it does when it reads its input with iterbatches.
+#
+# run() returns one list of output files per fused stage, so that the pipeline can
+# record each of them; unrecorded intermediate stages get an empty list.
+class Fused(BaseModel):
+    stages: list[Any]
+    intermediate_dirs: list[Optional[str]]
+
+    # The input projection and filter are those of the first stage
+    @property
+    def columns(self) -> Optional[list[str]]:
+        return getattr(self.stages[0], "columns", None)
+
+    @property
+    def where(self) -> Optional[Predicate]:
+        return getattr(self.stages[0], "where", None)
+
+    def run(self, input_files: list[str], output_dir: str) -> list[list[str]]:
+        output_dirs = [*self.intermediate_dirs, output_dir]
+        writers = []
+
+        schemas = []  # The schema of each input file, appended when it is opened
+        rows = read_files(
+            input_files, PREFETCH, self.columns, self.where, None, schemas
+        )
+        # Every writer is closed on success, or aborted if a stage fails
+        with ExitStack() as stack:
+            for i, (stage, dir) in enumerate(zip(self.stages, output_dirs)):
+                if i > 0:
+                    columns = getattr(stage, "columns", None)
+                    rows = restrict(rows, columns, getattr(stage, "where", None))
+                    schemas = [self.stages[i - 1].avro_schema]
+                rows = stage.transform(rows, schemas)
+                if dir is not None:
+                    writer = WriteDF(
+                        dir,
+                        stage.avro_schema,
+                        collect_stats=getattr(stage, "column_stats", False),
+                        options=getattr(stage, "write_options", None),
+                    )
+                    writers.append(stack.enter_context(writer))
+                    rows = tee(rows, writer)
+                else:
+                    writers.append(None)
+
+            for _ in rows:
+                pass
+
+        return [[] if writer is None else writer.files for writer in writers]
@@ -0,0 +1,79 @@
+from typing import Any, Callable, Literal, Optional
+
+from pydantic import BaseModel
+
+from lightningdb.rw.read_df import iterrows
+from lightningdb.rw.stats import ColumnStatsOption, key_stats
+from lightningdb.rw.write_avro import WriteOptions
+from lightningdb.rw.write_df import WriteDF
+
+
+def merge_rows(left: dict, right: Optional[dict]) -> dict:
+    """
+    Default output row of a join: the fields of both rows, the right ones winning.
+    """
+    if right is None:
+        return left
+    return {**left, **right}
+
+
+# Join is a hash join of two dataframes, run part by part with run_dag:
+#   Node(name="joined", stage=Join(...), inputs=["left", "right"])
+#
+# By default the inputs must be co-partitioned, e.g. two Shuffle outputs with the
+# same nparts and key, and part i of the left df is joined with part i of the
+# right df. With broadcast=True, the whole right df (which should be small) is
+# joined with every part of the left df, whatever their partitioning.
+# The right rows of a part are loaded in an in-memory hash table, so the right
+# side should be the smaller one. Null keys never match.
+#
+# Attributes:
+#   on: The key fields, present in both inputs.
+#   avro_schema: The schema of the output rows.
+#   how: "inner" drops the left rows without a match, "left" keeps them, with
+#        right=None passed to fn.
+#   broadcast: Pass the whole right df to every part.
+#   fn: Builds an output row from a left row and a matching right row.
+#   left_columns, right_columns: If set, only these input columns are decoded.
+#   write_options: The codec, compression level and block size of the output files.
+#   column_stats: The fields whose min/max/null statistics are recorded, for filters:
+#       by default the keys, True for all fields (see ColumnStatsOption).
+class Join(BaseModel):
+    on: list[str]
+    avro_schema: Any
+    how: Literal["inner", "left"] = "inner"
+    broadcast: bool = False
+    fn: Callable[[dict, Optional[dict]], dict] = merge_rows
+    left_columns: Optional[list[str]] = None
+    right_columns: Optional[list[str]] = None
+    write_options: WriteOptions = WriteOptions()
+    column_stats: Optional[ColumnStatsOption] = None
+
+    # Indexes of the inputs passed whole to every part
+    @property
+    def broadcast_inputs(self) -> list[int]:
+        return [1] if self.broadcast else []
+
+    def run_multi(self, input_files: list[list[str]], output_dir: str) -> list[str]:
+        left_files, right_files = input_files
+
+        table: dict[tuple, list[dict]] = {}
+        for row in iterrows(right_files, columns=self.right_columns):
+            key = tuple(row[k] for k in self.on)
+            if None not in key:
+                table.setdefault(key, []).append(row)
+
+        with WriteDF(
+            output_dir,
+            self.avro_schema,
+            collect_stats=key_stats(self.column_stats, self.on),
+            options=self.write_options,
+        ) as writer:
+            for row in iterrows(left_files, columns=self.left_columns):
+                matches = table.get(tuple(row[k] for k in self.on))
+                if matches:
+                    for match in matches:
+                        writer.append(self.fn(row, match))
+                elif self.how == "left":
+                    writer.append(self.fn(row, None))
+        return writer.files
@@ -1,19 +1,27 @@
 import os
+import statistics
 import subprocess
+import time
+from datetime import datetime, timezone
+from typing import Iterator, Optional
 
 from pydantic import BaseModel
 from redis import Redis
 from rq import Queue
-from rq.command import send_kill_horse_command
-from rq.job import Job
+from rq.command import send_kill_horse_command, send_stop_job_command
+from rq.job import Job, JobStatus
 from rq.worker import Worker, WorkerStatus
 
+from lightningdb.rw.metrics import Metrics
+
 
 class RQContext:
-    def __init__(self):
-        redis_url = os.environ.get("REDIS_URL")
-        self.redis = Redis.from_url(redis_url) if redis_url else Redis()
-        self.queue = Queue(connection=self.redis, name="superfetch")
+    def __init__(self, redis: Optional[Redis] = None, queue: str = "superfetch"):
+        if redis is None:
+            redis_url = os.environ.get("REDIS_URL")
+            redis = Redis.from_url(redis_url) if redis_url else Redis()
+        self.redis = redis
+        self.queue = Queue(connection=self.redis, name=queue)
 
     # Send commands to all workers to abort their jobs
     def reset_all(self):
@@ -22,50 +30,206 @@ class RQContext:
             if worker.state == WorkerStatus.BUSY:
                 send_kill_horse_command(self.redis, worker.name)
 
+    # Cancel a job, whether it is still queued or already running
+    def cancel(self, job: Job):
+        try:
+            if job.get_status() == JobStatus.STARTED:
+                send_stop_job_command(self.redis, job.id)
+            else:
+                job.cancel()
+        except Exception:
+            pass  # the job finished in the meantime
+
 
 class MultiFetchError(Exception):
     pass
 
 
+FAILED_STATUSES = (JobStatus.FAILED, JobStatus.STOPPED, JobStatus.CANCELED)
+
+
+def find_stragglers(
+    elapsed: dict[int, float],
+    durations: list[float],
+    factor: float,
+    min_done: int,
+) -> list[int]:
+    """
+    Find the running parts that take much longer than the completed ones.
+
+    Args:
+        elapsed (dict[int, float]): Seconds since each running part started.
+        durations (list[float]): Durations of the completed parts, in seconds.
+        factor (float): A part is a straggler past factor times the median duration.
+        min_done (int): Minimum number of completed parts for the median to be trusted.
+
+    Returns:
+        list[int]: The straggling parts.
+    """
+    if len(durations) < min_done:
+        return []
+    limit = factor * statistics.median(durations)
+    return [part for part, seconds in elapsed.items() if seconds > limit]
+
+
+def attempt_file(subdir: str, line: str) -> str:
+    """
+    Return the name of an output file printed by the fetch command, relative to the
+    df directory. Relative names are relative to the attempt's subdirectory; absolute
+    paths and URIs are kept as is.
+    """
+    if os.path.isabs(line) or "://" in line:
+        return line
+    return f"{subdir}/{line}"
+
+
+class PartJobs:
+    """
+    The state of one part: its active RQ jobs and how often it was re-dispatched.
+    """
+
+    def __init__(self) -> None:
+        self.retries = 0
+        self.attempts = 0
+        self.active: list[Job] = []
+        self.dirs: dict[str, str] = {}  # The output subdirectory of each job
+        self.speculated = False
+        self.done = False
+        self.error: Optional[str] = None
+
+
 # MultiFetch uses Redis Queue (RQ) to distribute fetch tasks across multiple workers.
 # RQContext sets up the Redis connection and queue.
-# MultiFetch creates and manages the distributed jobs.
-# Each job runs a subprocess to execute the 'superfetch' command for data fetching.
-# Results are collected and processed with error handling in place.
+# MultiFetch creates and manages the distributed jobs, one per part.
+# Each job runs a subprocess to execute the fetch command ('superfetch' by default).
+#
+# iterall() polls all jobs together and yields each part as soon as it finishes,
+# with the duration of its job, so run_pipeline commits it right away and re-runs
+# skip it.
+# A failed part is retried up to max_retries times.
+# A part running longer than straggler_factor times the median duration of the
+# completed parts is re-dispatched once; the first attempt to finish wins and the
+# other one is cancelled.
+# Every attempt writes to its own subdirectory of output_dir, "<part>-<attempt>",
+# and only the winner's files are returned: a cancelled job may leave its fetch
+# process running, and a losing attempt that still finishes must not overwrite the
+# winner's files. The losers' subdirectories are left behind.
+# runall() collects all parts and raises MultiFetchError if any of them failed.
 class MultiFetch(BaseModel):
-    def runall(self, input_pfiles: list[list[str]], output_dir: str) -> list[list[str]]:
+    command: list[str] = ["/tmp/superfetch"]
+    max_retries: int = 2
+    straggler_factor: float = 3.0
+    straggler_min_done: int = 3
+    poll_interval: float = 1.0
+
+    def _enqueue(self, ctx: RQContext, input_files: list[str], output_dir: str) -> Job:
+        job = Job.create(
+            subprocess.check_output,
+            args=[[*self.command, output_dir, *input_files]],
+            kwargs={"text": True},
+            result_ttl="1d",
+            timeout="5d",
+            connection=ctx.redis,
+        )
+        ctx.queue.enqueue_job(job)
+        return job
+
+    def iterall(
+        self, input_pfiles: list[list[str]], output_dir: str
+    ) -> Iterator[tuple[int, list[str], Metrics]]:
         ctx = RQContext()
+        parts = [PartJobs() for _ in input_pfiles]
+
+        def dispatch(part: int) -> None:
+            state = parts[part]
+            subdir = f"{part}-{state.attempts}"
+            state.attempts += 1
+            attempt_dir = os.path.join(output_dir, subdir)
+            job = self._enqueue(ctx, input_pfiles[part], attempt_dir)
+            state.active.append(job)
+            state.dirs[job.id] = subdir
+
+        for part in range(len(parts)):
+            dispatch(part)
 
-        jobs = []
-        for input_files in input_pfiles:
-            job = Job.create(
-                subprocess.check_output,
-                args=[
-                    [
-                        "/tmp/superfetch",  # the superfetch command is hardcoded
-                        output_dir,
-                        *input_files,
-                    ]
-                ],
-                kwargs={"text": True},
-                result_ttl="1d",
-                timeout="5d",
-                connection=ctx.redis,
-            )
-            ctx.queue.enqueue_job(job)
-            jobs.append(job)
-
-        output_pfiles = []
-        for part, job in enumerate(jobs):
+        durations = []
+        try:
             while True:
-                result = job.latest_result(timeout=10)
-                if result is not None:
+                pending = [p for p in range(len(parts)) if parts[p].active]
+                if not pending:
                     break
-            if result.exc_string is not None:
-                raise MultiFetchError(result.exc_string)
-            if result.return_value is None:
-                raise MultiFetchError(f"No result for part {part}")
 
-            output_files = result.return_value.splitlines()
-            output_pfiles.append(output_files)
+                ids = [job.id for p in pending for job in parts[p].active]
+                jobs = {job.id: job for job in Job.fetch_many(ids, ctx.redis) if job}
+                now = datetime.now(timezone.utc)
+                elapsed = {}
+
+                for p in pending:
+                    state = parts[p]
+                    for old in list(state.active):
+                        job = jobs.get(old.id, old)
+                        status = job.get_status(refresh=False)
+
+                        if status == JobStatus.FINISHED:
+                            state.active.remove(old)
+                            if state.done:
+                                continue
+                            state.done = True
+                            for other in state.active:
+                                ctx.cancel(other)
+                            state.active = []
+                            metrics = Metrics()
+                            if job.started_at and job.ended_at:
+                                metrics.seconds = (
+                                    job.ended_at - job.started_at
+                                ).total_seconds()
+                                durations.append(metrics.seconds)
+                            lines = (job.return_value() or "").splitlines()
+                            subdir = state.dirs[job.id]
+                            files = [attempt_file(subdir, line) for line in lines]
+                            yield p, files, metrics
+
+                        elif status in FAILED_STATUSES:
+                            state.active.remove(old)
+                            result = job.latest_result()
+                            state.error = result.exc_string if result else str(status)
+                            if (
+                                not state.active
+                                and not state.done
+                                and state.retries < self.max_retries
+                            ):
+                                state.retries += 1
+                                dispatch(p)
+
+                        elif status == JobStatus.STARTED and job.started_at:
+                            started_at = job.started_at
+                            if started_at.tzinfo is None:
+                                started_at = started_at.replace(tzinfo=timezone.utc)
+                            seconds = (now - started_at).total_seconds()
+                            elapsed[p] = max(elapsed.get(p, 0), seconds)
+
+                for p in find_stragglers(
+                    elapsed, durations, self.straggler_factor, self.straggler_min_done
+                ):
+                    if not parts[p].speculated and not parts[p].done:
+                        parts[p].speculated = True
+                        dispatch(p)
+
+                if any(parts[p].active for p in range(len(parts))):
+                    time.sleep(self.poll_interval)
+        finally:
+            # Do not leave jobs running when the caller stops early or fails
+            for state in parts:
+                for job in state.active:
+                    ctx.cancel(job)
+
+        failed = [p for p, state in enumerate(parts) if not state.done]
+        if failed:
+            errors = "\n".join(f"part {p}: {parts[p].error}" for p in failed)
+            raise MultiFetchError(f"{len(failed)} parts failed:\n{errors}")
+
+    def runall(self, input_pfiles: list[list[str]], output_dir: str) -> list[list[str]]:
+        output_pfiles = [[] for _ in input_pfiles]
+        for part, files, _ in self.iterall(input_pfiles, output_dir):
+            output_pfiles[part] = files
         return output_pfiles
@@ -0,0 +1,171 @@
+import math
+import zlib
+from bisect import bisect_left, bisect_right
+from collections import defaultdict
+from typing import Any, Callable, Literal, Optional
+
+from pydantic import BaseModel, PrivateAttr
+
+from lightningdb.executor import run_tasks
+from lightningdb.rw.predicate import Predicate
+from lightningdb.rw.s3utils import get_size
+from lightningdb.rw.stats import ColumnStatsOption
+from lightningdb.rw.write_avro import WriteOptions
+from lightningdb.stages.shuffle import run_map_tasks
+from lightningdb.stages.sort import (
+    SAMPLE_SIZE,
+    choose_boundaries,
+    sample_keys,
+    sort_key,
+    weigh_samples,
+)
+
+# Default target size of an output part, in bytes of compressed Avro files
+TARGET_PART_BYTES = 128 * 1024 * 1024
+
+# Default maximum number of output parts chosen from the input size
+MAX_PARTS = 1024
+
+
+def plan_nparts(
+    input_pfiles: list[list[str]], target_part_bytes: int, max_parts: int
+) -> int:
+    """
+    Choose the number of parts of a repartition from the size of its input files.
+    """
+    total = sum(get_size(file) for files in input_pfiles for file in files)
+    return max(1, min(max_parts, math.ceil(total / target_part_bytes)))
+
+
+def find_heavy_keys(
+    samples: list[tuple[tuple, float]], nparts: int, skew_factor: float
+) -> dict[tuple, int]:
+    """
+    Find the keys whose estimated share of the rows exceeds skew_factor parts.
+
+    Returns:
+        dict[tuple, int]: The number of parts each heavy key is spread over.
+    """
+    total = sum(weight for _, weight in samples)
+    weights = defaultdict(float)
+    for key, weight in samples:
+        weights[key] += weight
+    heavy = {}
+    for key, weight in weights.items():
+        parts = weight / total * nparts if total else 0
+        if parts > skew_factor:
+            heavy[key] = min(nparts, max(2, math.ceil(parts)))
+    return heavy
+
+
+# Repartition redistributes a dataframe into evenly sized parts, for when the skew of a
+# Shuffle would make one part the straggler of the next stages.
+#
+# If nparts is not set, it is chosen from the total size of the input files, so that
+# the output parts are about target_part_bytes each. Before routing the rows, up to
+# sample_size keys are sampled from every input part, weighted by the part's row
+# count, to estimate the share of the rows of each key.
+#
+# With mode="hash", rows are routed by a stable hash of their key, as in Shuffle.
+# With mode="range", parts are ranges of keys with sampled boundaries, as in
+# GlobalSort (but the parts are not sorted): every key of part i sorts before every
+# key of part i + 1. Nulls sort last.
+#
+# In both modes, a heavy key, whose sampled share exceeds skew_factor parts, is spread
+# round-robin over as many parts as its share (consecutive ones in range mode), from
+# a different part in each map task, so the rows of a key are no longer in a single
+# part. Stages that need all the rows of a
+# key together should use Shuffle.
+#
+# Attributes:
+#   keys: The fields to partition by.
+#   avro_schema: The schema of the rows.
+#   mode: "hash" or "range" partitioning.
+#   nparts: The number of output parts, or None to choose it from the input size.
+#   target_part_bytes: The target size of the output parts, when nparts is None.
+#   max_parts: The maximum number of parts chosen from the input size.
+#   skew_factor: Keys expected to hold more rows than this many parts are spread.
+#   sample_size: The number of keys sampled per input part.
+#   max_workers, memory_budget, columns, where, write_options, column_stats: As in
+#       Shuffle.
+class Repartition(BaseModel):
+    keys: list[str]
+    avro_schema: Any
+    mode: Literal["hash", "range"] = "hash"
+    nparts: Optional[int] = None
+    target_part_bytes: int = TARGET_PART_BYTES
+    max_parts: int = MAX_PARTS
+    skew_factor: float = 1.0
+    sample_size: int = SAMPLE_SIZE
+    max_workers: Optional[int] = None
+    memory_budget: Optional[int] = None
+    columns: Optional[list[str]] = None
+    where: Optional[Predicate] = None
+    write_options: WriteOptions = WriteOptions()
+    column_stats: Optional[ColumnStatsOption] = None
+
+    # The routing plan, set on the copy of the stage sent to the map tasks
+    _key: Optional[Callable[[dict], tuple]] = PrivateAttr(default=None)
+    _boundaries: list[tuple] = PrivateAttr(default_factory=list)
+    _heavy: dict[tuple, list[int]] = PrivateAttr(default_factory=dict)
+    # The round-robin position of each heavy key in the current map task, which
+    # starts at the map task's input part so that the tasks do not all send the
+    # first rows of a key to the same part
+    _seed: int = PrivateAttr(default=0)
+    _next: dict[tuple, int] = PrivateAttr(default_factory=dict)
+
+    def partition(self, row: dict) -> int:
+        key = self._key(row)
+        parts = self._heavy.get(key)
+        if parts is not None:
+            i = self._next.get(key, self._seed)
+            self._next[key] = i + 1
+            return parts[i % len(parts)]
+        if self.mode == "range":
+            return bisect_right(self._boundaries, key)
+        return zlib.crc32(str(key).encode()) % self.nparts
+
+    def plan(self, samples: list[tuple[tuple, float]], nparts: int) -> "Repartition":
+        """
+        Return a copy of the stage routing rows to nparts parts, given the weighted
+        sampled keys.
+        """
+        router = self.model_copy(update={"nparts": nparts})
+        router._key = sort_key(self.keys)
+        heavy = find_heavy_keys(samples, nparts, self.skew_factor)
+        if self.mode == "range":
+            router._boundaries = boundaries = choose_boundaries(samples, nparts)
+            for key in heavy:
+                # The boundaries repeat a heavy key once per range it fills
+                first = bisect_left(boundaries, key)
+                last = bisect_right(boundaries, key)
+                if last > first:
+                    router._heavy[key] = list(range(first, last + 1))
+        else:
+            for key, n in heavy.items():
+                start = zlib.crc32(str(key).encode()) % nparts
+                router._heavy[key] = [(start + i) % nparts for i in range(n)]
+        return router
+
+    def seeded(self, part: int) -> "Repartition":
+        """
+        Return a copy of the router for the map task of the given input part.
+        """
+        router = self.model_copy()
+        router._seed = part
+        router._next = {}
+        return router
+
+    def runall(self, input_pfiles: list[list[str]], output_dir: str) -> list[list[str]]:
+        nparts = self.nparts
+        if nparts is None:
+            nparts = plan_nparts(input_pfiles, self.target_part_bytes, self.max_parts)
+
+        tasks = [
+            (files, self.keys, self.where, self.sample_size, part)
+            for part, files in enumerate(input_pfiles)
+            if files
+        ]
+        samples = weigh_samples(run_tasks(sample_keys, tasks, self.max_workers))
+        router = self.plan(samples, nparts)
+        return run_map_tasks(router, input_pfiles, output_dir, self.max_workers)
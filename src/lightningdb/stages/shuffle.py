@@ -1,31 +1,143 @@
-from typing import Any
+import zlib
+from contextlib import ExitStack
+from typing import Any, Optional
 
+import cloudpickle
 from pydantic import BaseModel
 
+from lightningdb.executor import run_part, run_tasks
+from lightningdb.rw.metrics import current
+from lightningdb.rw.predicate import Predicate
 from lightningdb.rw.read_df import iterrows
+from lightningdb.rw.spill import SpillBuffer
+from lightningdb.rw.stats import ColumnStatsOption, key_stats, record
+from lightningdb.rw.write_avro import WriteOptions
 from lightningdb.rw.write_df import WriteDF
 
 
+# crc32 is used instead of hash(), which is salted per interpreter, so that the
+# partition of a row is the same in every process and every run
 def to_part(row: dict, key: str, nparts: int) -> int:
-    return hash(str(row[key])) % nparts
+    return zlib.crc32(str(row[key]).encode()) % nparts
+
+
+# Map task of a shuffle, run with run_part: routes the rows of one input part to
+# per-destination files. Any stage with a partition() method can be routed this way.
+#
+# Without a memory budget, one WriteDF per destination part is kept open.
+# With a memory budget, rows are buffered per destination in a SpillBuffer, which
+# spills runs to local disk, and the destination parts are written one at a time
+# in a final pass, so memory and open files do not grow with nparts.
+#
+# Stages whose routing depends on the map task (Repartition) have a seeded(part)
+# method returning the router of the given input part.
+class MapTask(BaseModel):
+    stage: Any  # The stage routing the rows
+    part: int = 0  # The input part
+
+    def run(self, input_files: list[str], output_dir: str) -> list[list[str]]:
+        stage = self.stage
+        if hasattr(stage, "seeded"):
+            stage = stage.seeded(self.part)
+        return route_rows(stage, input_files, output_dir)
+
+
+def route_rows(stage: Any, input_files: list[str], output_dir: str) -> list[list[str]]:
+    output_pfiles = [[] for _ in range(stage.nparts)]
+    keys = stage.keys if hasattr(stage, "keys") else [stage.key]
+    column_stats = key_stats(stage.column_stats, keys)
+
+    if stage.memory_budget is None:
+        # Every writer is closed on success, or aborted if routing fails
+        with ExitStack() as stack:
+            writers = [
+                stack.enter_context(
+                    WriteDF(
+                        output_dir,
+                        stage.avro_schema,
+                        collect_stats=column_stats,
+                        options=stage.write_options,
+                    )
+                )
+                for _ in range(stage.nparts)
+            ]
+            for row in iterrows(input_files, columns=stage.columns, where=stage.where):
+                writers[stage.partition(row)].append(row)
+        return [writer.files for writer in writers]
+
+    buffer = SpillBuffer(stage.avro_schema, stage.memory_budget)
+    try:
+        for row in iterrows(input_files, columns=stage.columns, where=stage.where):
+            buffer.append(stage.partition(row), row)
+        for part in buffer.buckets():
+            writer = WriteDF(
+                output_dir,
+                stage.avro_schema,
+                collect_stats=column_stats,
+                options=stage.write_options,
+            )
+            with writer:
+                for row in buffer.iterbucket(part):
+                    writer.append(row)
+            output_pfiles[part] = writer.files
+    finally:
+        buffer.close()
+    return output_pfiles
+
+
+# Runs a MapTask for every input part, in parallel when there is more than one,
+# and merges the file lists of each destination part in input part order.
+def run_map_tasks(
+    stage: Any,
+    input_pfiles: list[list[str]],
+    output_dir: str,
+    max_workers: Optional[int],
+) -> list[list[str]]:
+    tasks = [
+        (cloudpickle.dumps(MapTask(stage=stage, part=part)), part, files, output_dir)
+        for part, files in enumerate(input_pfiles)
+        if files
+    ]
+    results = run_tasks(run_part, tasks, max_workers)
+
+    # The statistics and metrics were collected in the map tasks, hand them to the
+    # caller's recording and measurement
+    metrics = current()
+    output_pfiles = [[] for _ in range(stage.nparts)]
+    for result in results:
+        for part, files in enumerate(result.output):
+            output_pfiles[part].extend(files)
+        for stats in result.stats:
+            record(stats)
+        if metrics is not None:
+            metrics.add(result.metrics)
+    return output_pfiles
 
 
 # The Shuffle class redistributes data across multiple partitions based on a specified key.
-# It reads input files, assigns each row to a partition using a hash function,
-# and writes the rows to their respective output files.
+# Each input part is handled by its own map task, run on a pool of up to max_workers
+# processes (default: one per core), which writes one set of files per destination part.
+# Partition assignment uses a stable hash, so the layout is reproducible across runs.
+# Setting memory_budget (bytes per map task) bounds memory use and open files for
+# large nparts, at the cost of spilling rows to local disk.
+# columns and where restrict the rows that are read, e.g. to the fields of avro_schema.
+# write_options sets the codec, compression level and block size of the output files.
+# column_stats sets the fields whose min/max/null statistics are recorded, which filters
+# can use to skip files: by default the key, True for all fields (see ColumnStatsOption).
 # This is useful for balancing data distribution or preparing for parallel processing.
 class Shuffle(BaseModel):
     nparts: int
     key: str
     avro_schema: Any
+    max_workers: Optional[int] = None
+    memory_budget: Optional[int] = None
+    columns: Optional[list[str]] = None
+    where: Optional[Predicate] = None
+    write_options: WriteOptions = WriteOptions()
+    column_stats: Optional[ColumnStatsOption] = None
+
+    def partition(self, row: dict) -> int:
+        return to_part(row, self.key, self.nparts)
 
     def runall(self, input_pfiles: list[list[str]], output_dir: str) -> list[list[str]]:
-        input_files = [file for files in input_pfiles for file in files]
-        writers = [WriteDF(output_dir, self.avro_schema) for _ in range(self.nparts)]
-
-        for row in iterrows(input_files):
-            part = to_part(row, self.key, self.nparts)
-            writers[part].append(row)
-        for writer in writers:
-            writer.close()
-        return [writer.files for writer in writers]
+        return run_map_tasks(self, input_pfiles, output_dir, self.max_workers)
@@ -0,0 +1,332 @@
+import heapq
+import io
+import itertools
+import os
+import random
+import tempfile
+from bisect import bisect_right
+from contextlib import ExitStack
+from typing import Any, Callable, Iterator, Optional
+
+import cloudpickle
+from fastavro import parse_schema
+from fastavro import reader as fastavro_reader
+from fastavro import schemaless_writer
+from fastavro import writer as fastavro_writer
+from pydantic import BaseModel, PrivateAttr
+
+from lightningdb.executor import run_part, run_tasks
+from lightningdb.rw.metrics import current
+from lightningdb.rw.predicate import Predicate
+from lightningdb.rw.read_df import iterrows
+from lightningdb.rw.stats import ColumnStatsOption, key_stats, record
+from lightningdb.rw.write_avro import WriteOptions
+from lightningdb.rw.write_df import WriteDF
+from lightningdb.stages.shuffle import run_map_tasks
+
+# Default memory budget of a sort task, in bytes of Avro-encoded rows
+# Python objects take several times more memory than their encoding
+MEMORY_BUDGET = 256 * 1024 * 1024
+
+# The encoded size of one row in SIZE_SAMPLE is measured to estimate the size of
+# the buffered rows
+SIZE_SAMPLE = 64
+
+# Maximum number of runs merged at once
+# With more runs, the oldest ones are first merged into bigger runs, so that the
+# number of open files stays bounded
+MERGE_FANIN = 64
+
+# Default number of keys sampled per input part to choose the range boundaries
+SAMPLE_SIZE = 1000
+
+# Sorted runs are spilled to local disk, where fast compression is enough
+SPILL_CODEC = "zstandard"
+SPILL_LEVEL = 1
+
+
+def sort_key(keys: list[str]) -> Callable[[dict], tuple]:
+    """
+    Build a sort key function over the given fields. Nulls sort after all values.
+    """
+
+    def key(row: dict) -> tuple:
+        return tuple((row[k] is None, row[k]) for k in keys)
+
+    return key
+
+
+def write_run(path: str, schema: Any, rows: Iterator[Any]) -> None:
+    with open(path, "wb") as f:
+        fastavro_writer(
+            f, schema, rows, codec=SPILL_CODEC, codec_compression_level=SPILL_LEVEL
+        )
+
+
+def merge_runs(
+    paths: list[str], key: Callable, reverse: bool, tail: list[Any]
+) -> Iterator[Any]:
+    """
+    Merge sorted run files, and an already sorted list of rows after them.
+
+    Rows with equal keys come out in run order, so the merge is stable.
+    """
+    with ExitStack() as stack:
+        readers = [
+            fastavro_reader(stack.enter_context(open(path, "rb"))) for path in paths
+        ]
+        yield from heapq.merge(*readers, tail, key=key, reverse=reverse)
+
+
+def sort_rows(
+    rows: Iterator[Any],
+    key: Callable,
+    reverse: bool,
+    avro_schema: Any,
+    memory_budget: int,
+    tmpdir: Optional[str] = None,
+) -> Iterator[Any]:
+    """
+    Sort rows within a memory budget (external merge sort).
+
+    Rows are buffered until their estimated encoded size exceeds memory_budget, then
+    sorted and spilled as a run to a local Avro file. The runs and the last buffer
+    are k-way merged. The sort is stable.
+
+    Args:
+        rows (Iterator[Any]): The rows to sort.
+        key (Callable): The sort key of a row.
+        reverse (bool): Sort in descending order.
+        avro_schema: The schema of the rows, used to spill them.
+        memory_budget (int): Bytes of encoded rows buffered before spilling.
+        tmpdir (str): Parent directory of the run files. Defaults to the system's.
+
+    Yields:
+        Any: The rows in sorted order.
+    """
+    schema = parse_schema(avro_schema)
+    with tempfile.TemporaryDirectory(dir=tmpdir) as dir:
+        runs = []
+        names = (os.path.join(dir, f"run{i}.avro") for i in itertools.count())
+        buffer = []
+        sampled_rows = 0
+        sampled_bytes = 0
+        sample = io.BytesIO()
+
+        def spill() -> None:
+            buffer.sort(key=key, reverse=reverse)
+            path = next(names)
+            write_run(path, schema, buffer)
+            runs.append(path)
+            buffer.clear()
+
+        for row in rows:
+            if len(buffer) % SIZE_SAMPLE == 0:
+                sample.seek(0)
+                sample.truncate()
+                schemaless_writer(sample, schema, row)
+                sampled_rows += 1
+                sampled_bytes += sample.tell()
+                if len(buffer) * sampled_bytes / sampled_rows > memory_budget:
+                    spill()
+            buffer.append(row)
+
+            # Keep the number of runs below the merge fan-in
+            if len(runs) == MERGE_FANIN:
+                path = next(names)
+                write_run(path, schema, merge_runs(runs, key, reverse, []))
+                for run in runs:
+                    os.remove(run)
+                runs[:] = [path]
+
+        buffer.sort(key=key, reverse=reverse)
+        if not runs:
+            yield from buffer
+        else:
+            yield from merge_runs(runs, key, reverse, buffer)
+
+
+# Sort orders the rows of each part by one or more keys, within a memory budget.
+# Rows that do not fit in memory_budget are spilled as sorted runs to local Avro
+# files and k-way merged. The sort is stable, and nulls sort after all values
+# (before them when descending).
+# Parts are sorted independently; use GlobalSort to sort a whole dataframe.
+#
+# Attributes:
+#   keys: The fields to sort by, most significant first.
+#   avro_schema: The schema of the rows.
+#   descending: Sort in descending order.
+#   memory_budget: Bytes of encoded rows buffered before spilling a run.
+#   columns, where: Projection and filter of the input rows, as in FlatMap.
+#   write_options: The codec, compression level and block size of the output files.
+#   column_stats: The fields whose min/max/null statistics are recorded, for filters:
+#       by default the keys, True for all fields (see ColumnStatsOption).
+class Sort(BaseModel):
+    keys: list[str]
+    avro_schema: Any
+    descending: bool = False
+    memory_budget: int = MEMORY_BUDGET
+    columns: Optional[list[str]] = None
+    where: Optional[Predicate] = None
+    write_options: WriteOptions = WriteOptions()
+    column_stats: Optional[ColumnStatsOption] = None
+
+    def run(self, input_files: list[str], output_dir: str) -> list[str]:
+        rows = iterrows(input_files, columns=self.columns, where=self.where)
+        with WriteDF(
+            output_dir,
+            self.avro_schema,
+            collect_stats=key_stats(self.column_stats, self.keys),
+            options=self.write_options,
+        ) as writer:
+            for row in sort_rows(
+                rows,
+                sort_key(self.keys),
+                self.descending,
+                self.avro_schema,
+                self.memory_budget,
+            ):
+                writer.append(row)
+        return writer.files
+
+
+def sample_keys(
+    input_files: list[str],
+    keys: list[str],
+    where: Optional[Predicate],
+    sample_size: int,
+    seed: int,
+) -> tuple[list[tuple], int]:
+    """
+    Draw a uniform sample (reservoir sampling) of the sort keys of a part's rows.
+
+    Returns:
+        tuple[list[tuple], int]: The sampled keys, and the number of rows of the part.
+    """
+    columns = list(dict.fromkeys(keys + [c for c, _, _ in where or []]))
+    key = sort_key(keys)
+    rng = random.Random(seed)
+    sample = []
+    rows = 0
+    for i, row in enumerate(iterrows(input_files, columns=columns, where=where)):
+        rows += 1
+        if i < sample_size:
+            sample.append(key(row))
+        else:
+            j = rng.randrange(i + 1)
+            if j < sample_size:
+                sample[j] = key(row)
+    return sample, rows
+
+
+def weigh_samples(samples: list[tuple[list[tuple], int]]) -> list[tuple[tuple, float]]:
+    """
+    Pair the keys sampled from each part with the number of rows each one stands for,
+    so that parts of different sizes are represented in proportion.
+    """
+    return [
+        (key, rows / len(sample))
+        for sample, rows in samples
+        if sample
+        for key in sample
+    ]
+
+
+def choose_boundaries(samples: list[tuple[tuple, float]], nparts: int) -> list[tuple]:
+    """
+    Choose nparts - 1 ascending keys splitting the weighted sampled keys into ranges of
+    equal weight. A key heavier than a range is repeated.
+    """
+    samples = sorted(samples, key=lambda sample: sample[0])
+    if not samples:
+        return []
+    total = sum(weight for _, weight in samples)
+    boundaries = []
+    before = 0.0  # Weight of the samples before the current one
+    for key, weight in samples:
+        while (
+            len(boundaries) < nparts - 1
+            and before >= total * (len(boundaries) + 1) / nparts
+        ):
+            boundaries.append(key)
+        before += weight
+    boundaries += [samples[-1][0]] * (nparts - 1 - len(boundaries))
+    return boundaries
+
+
+# GlobalSort sorts a whole dataframe into nparts range-partitioned parts: every row
+# of part i sorts before every row of part i + 1, and each part is sorted.
+#
+# It first samples up to sample_size keys per input part to choose the range
+# boundaries, then routes the rows to their range with the Shuffle map tasks into a
+# local temporary directory, and finally sorts each range with Sort. All three
+# phases run on a pool of up to max_workers processes (default: one per core).
+# Ranges are only as balanced as the sample; heavily repeated keys cannot be split.
+#
+# Attributes:
+#   nparts: The number of output parts.
+#   keys, avro_schema, descending, memory_budget, columns, where, write_options,
+#   column_stats: As in Sort. memory_budget also bounds the routing map tasks.
+#   sample_size: The number of keys sampled per input part.
+#   max_workers: The maximum number of worker processes.
+class GlobalSort(BaseModel):
+    nparts: int
+    keys: list[str]
+    avro_schema: Any
+    descending: bool = False
+    memory_budget: int = MEMORY_BUDGET
+    sample_size: int = SAMPLE_SIZE
+    max_workers: Optional[int] = None
+    columns: Optional[list[str]] = None
+    where: Optional[Predicate] = None
+    write_options: WriteOptions = WriteOptions()
+    column_stats: Optional[ColumnStatsOption] = None
+
+    # The routing plan, set on the copy of the stage sent to the map tasks
+    _key: Optional[Callable[[dict], tuple]] = PrivateAttr(default=None)
+    _boundaries: list[tuple] = PrivateAttr(default_factory=list)
+
+    def partition(self, row: dict) -> int:
+        part = bisect_right(self._boundaries, self._key(row))
+        return self.nparts - 1 - part if self.descending else part
+
+    def runall(self, input_pfiles: list[list[str]], output_dir: str) -> list[list[str]]:
+        tasks = [
+            (files, self.keys, self.where, self.sample_size, part)
+            for part, files in enumerate(input_pfiles)
+            if files
+        ]
+        samples = weigh_samples(run_tasks(sample_keys, tasks, self.max_workers))
+
+        router = self.model_copy()
+        router._key = sort_key(self.keys)
+        router._boundaries = choose_boundaries(samples, self.nparts)
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            range_pfiles = run_map_tasks(router, input_pfiles, tmpdir, self.max_workers)
+
+            sort = Sort(
+                keys=self.keys,
+                avro_schema=self.avro_schema,
+                descending=self.descending,
+                memory_budget=self.memory_budget,
+                write_options=self.write_options,
+                column_stats=self.column_stats,
+            )
+            payload = cloudpickle.dumps(sort)
+            tasks = [
+                (payload, part, [os.path.join(tmpdir, f) for f in files], output_dir)
+                for part, files in enumerate(range_pfiles)
+                if files
+            ]
+            results = run_tasks(run_part, tasks, self.max_workers)
+
+        metrics = current()
+        output_pfiles = [[] for _ in range(self.nparts)]
+        for result in results:
+            output_pfiles[result.part] = result.output
+            for stats in result.stats:
+                record(stats)
+            if metrics is not None:
+                metrics.add(result.metrics)
+        return output_pfiles
@@ -1,25 +1,37 @@
 import os
+import re
+import shutil
 import subprocess
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Iterator, Optional
 
 from pydantic import BaseModel
 
-from lightningdb.rw.s3utils import parse_s3_uri
+from lightningdb.rw.metrics import Metrics, current
+from lightningdb.rw.s3utils import get_size, parse_s3_uri
 from lightningdb.rw.write_df import new_file
 from lightningdb.rw.write_wrapper import WriteWrapper
+from lightningdb.slots import node_slot
 
+CLICKHOUSE = "/tmp/clickhouse"  # Clickhouse binary is hardcoded
 
-# ClickHouse requires S3 URIs to be presented as HTTP URIs for direct access
+
+# ClickHouse requires S3 URIs to be presented as HTTP(S) URIs for direct access
 def format_s3_uri(uri: str) -> str:
     if not uri.startswith("s3://"):
         return uri
     bucket, key = parse_s3_uri(uri)
-    return f"http://{bucket}.s3.amazonaws.com/{key}"
+    return f"https://{bucket}.s3.amazonaws.com/{key}"
 
 
-# This function runs ClickHouse locally to process data from one or more input
-# files (local or S3) and outputs to a single file.
-# It executes SQL queries on the input data and handles the ClickHouse command execution.
-def run_clickhouse(sql: str, output_file: str, input_files: list[str]):
+# Builds the query defining the `input` view over one or more input files (local or S3)
+def input_view_query(input_files: list[str]) -> str:
+    # The table function is chosen from the files, before they are joined in a glob
+    s3 = [f.startswith("s3://") for f in input_files]
+    if any(s3) and not all(s3):
+        raise ValueError("Sql cannot read local and S3 input files together")
     input_files = [format_s3_uri(f) for f in input_files]
 
     if len(input_files) == 1:
@@ -27,46 +39,233 @@ def run_clickhouse(sql: str, output_file: str, input_files: list[str]):
     elif len(input_files) > 1:
         input_str = "{" + ",".join(input_files) + "}"
     else:
-        assert False, "No input files"
+        raise ValueError("No input files")
+
+    if all(s3):
+        return f"create view input as select * from s3('{input_str}')"
+    return f"create view input as select * from file('{input_str}')"
+
+
+def clickhouse_settings(max_threads: Optional[int]) -> list[str]:
+    settings = ["--output_format_avro_codec", "zstd"]
+    if max_threads is not None:
+        settings += ["--max_threads", str(max_threads)]
+    return settings
 
-    if "http://" in input_str:
-        view_query = f"create view input as select * from s3('{input_str}')"
-    else:
-        view_query = f"create view input as select * from file('{input_str}')"
 
+def check_call(cmd: list[str], stdout=subprocess.DEVNULL, output=None) -> None:
+    """
+    Run a ClickHouse command, optionally copying its stdout to output, and raise
+    CalledProcessError with its stderr if it fails.
+    """
+    with tempfile.TemporaryFile() as stderr:
+        proc = subprocess.Popen(cmd, stdout=stdout, stderr=stderr)
+        if output is not None:
+            shutil.copyfileobj(proc.stdout, output)
+            proc.stdout.close()
+        if proc.wait() != 0:
+            stderr.seek(0)
+            raise subprocess.CalledProcessError(
+                proc.returncode, cmd, stderr=stderr.read().decode()
+            )
+
+
+# This function runs ClickHouse locally to process data from one or more input
+# files (local or S3) and outputs to a single file.
+# It executes SQL queries on the input data and handles the ClickHouse command execution.
+# It returns the size of the output file.
+def run_clickhouse(
+    sql: str,
+    output_file: str,
+    input_files: list[str],
+    max_threads: Optional[int] = None,
+) -> int:
     try:
         cmd = [
-            "/tmp/clickhouse",  # Clickhouse binary is hardcoded
+            CLICKHOUSE,
             "--query",
-            view_query,
+            input_view_query(input_files),
             "--query",
             sql,
-            "--output_format_avro_codec",
-            "zstd",
+            *clickhouse_settings(max_threads),
             "--output-format",
             "avro",
         ]
+        # The output is streamed through WriteWrapper, which has no file
+        # descriptor for S3 destinations
         with WriteWrapper(output_file) as f:
-            subprocess.run(
-                cmd,
-                check=True,
-                text=True,
-                stdout=f,
-                stderr=subprocess.PIPE,
-            )
+            check_call(cmd, stdout=subprocess.PIPE, output=f)
+        return f.size
     except subprocess.CalledProcessError as e:
         print(e)
         raise e
 
 
+# A FORMAT clause ending a query, which a subquery cannot have
+FORMAT_CLAUSE = re.compile(r"\s+format\s+\w+$", re.IGNORECASE)
+
+
+# Builds the query writing the result of sql to a local Avro file. sql is wrapped in
+# a subquery, so that it may end with SETTINGS or a semicolon; its own FORMAT clause
+# is dropped, since the output is Avro anyway.
+def outfile_query(sql: str, output_file: str) -> str:
+    sql = FORMAT_CLAUSE.sub("", sql.strip().rstrip(";").rstrip())
+    return f"select * from (\n{sql}\n) into outfile '{output_file}' format Avro"
+
+
+# This function runs the same SQL query on several parts in a single ClickHouse
+# process, to pay its startup cost once. The `input` view is redefined before each
+# part's query, whose result is written with INTO OUTFILE to a local temporary file
+# and then moved (or uploaded) to the part's output file. It returns the sizes of the
+# output files.
+def run_clickhouse_many(
+    sql: str,
+    outputs: list[tuple[str, list[str]]],
+    max_threads: Optional[int] = None,
+) -> list[int]:
+    with tempfile.TemporaryDirectory() as tmpdir:
+        cmd = [CLICKHOUSE, *clickhouse_settings(max_threads)]
+        tmp_files = []
+        for i, (_, input_files) in enumerate(outputs):
+            tmp_file = os.path.join(tmpdir, f"{i}.avro")
+            tmp_files.append(tmp_file)
+            cmd += [
+                "--query",
+                "drop view if exists input",
+                "--query",
+                input_view_query(input_files),
+                "--query",
+                outfile_query(sql, tmp_file),
+            ]
+        try:
+            check_call(cmd)
+        except subprocess.CalledProcessError as e:
+            print(e)
+            raise e
+
+        sizes = [os.path.getsize(tmp_file) for tmp_file in tmp_files]
+        for tmp_file, (output_file, _) in zip(tmp_files, outputs):
+            if output_file.startswith("s3://"):
+                with open(tmp_file, "rb") as src, WriteWrapper(output_file) as dst:
+                    shutil.copyfileobj(src, dst)
+            else:
+                os.makedirs(os.path.dirname(output_file), exist_ok=True)
+                shutil.move(tmp_file, output_file)
+    return sizes
+
+
 # The Sql class executes SQL queries on input files using ClickHouse.
 # It processes the input data, runs the specified SQL query, and outputs the result to a single file.
 # This class is useful for performing complex data transformations using SQL.
+#
+# Up to max_concurrency ClickHouse processes run at a time on a machine, through a
+# slot pool shared by all processes, so concurrent pipelines, workers or parts run by
+# an executor do not oversubscribe the node. max_threads caps the threads of each
+# ClickHouse process.
+# iterall() runs the parts concurrently from one process and yields each part as soon
+# as it finishes, with its Metrics: the wall time of its ClickHouse process and the
+# bytes it read and wrote. When small_part_bytes is set, consecutive parts are packed
+# into one ClickHouse invocation until their input reaches that size; the parts of an
+# invocation share its wall time.
+# Parts without input files produce no output files.
 class Sql(BaseModel):
     sql: str
+    max_concurrency: int = 4
+    max_threads: Optional[int] = None
+    small_part_bytes: Optional[int] = None
 
     def run(self, input_files: list[str], output_dir: str) -> list[str]:
         output_file = new_file()
         output_fullpath = os.path.join(output_dir, output_file)
-        run_clickhouse(self.sql, output_fullpath, input_files)
+        with node_slot("clickhouse", self.max_concurrency):
+            run_clickhouse(self.sql, output_fullpath, input_files, self.max_threads)
+        metrics = current()
+        if metrics is not None:
+            metrics.bytes_in += sum(map(get_size, input_files))
         return [output_file]
+
+    def _group_parts(self, sizes: list[Optional[int]]) -> list[list[int]]:
+        groups = []
+        group_bytes = 0
+        for part, size in enumerate(sizes):
+            if sizes[part] is None:
+                continue  # no input
+            if (
+                self.small_part_bytes is not None
+                and groups
+                and group_bytes + size <= self.small_part_bytes
+            ):
+                groups[-1].append(part)
+                group_bytes += size
+            else:
+                groups.append([part])
+                group_bytes = size
+        return groups
+
+    def _run_group(
+        self,
+        group: list[int],
+        input_pfiles: list[list[str]],
+        output_dir: str,
+        sizes: list[Optional[int]],
+    ) -> list[tuple[int, list[str], Metrics]]:
+        output_files = [new_file() for _ in group]
+        outputs = [
+            (os.path.join(output_dir, file), input_pfiles[part])
+            for file, part in zip(output_files, group)
+        ]
+        with node_slot("clickhouse", self.max_concurrency):
+            start = time.perf_counter()
+            if len(group) == 1:
+                output_sizes = [run_clickhouse(self.sql, *outputs[0], self.max_threads)]
+            else:
+                output_sizes = run_clickhouse_many(self.sql, outputs, self.max_threads)
+            seconds = time.perf_counter() - start
+
+        return [
+            (
+                part,
+                [file],
+                Metrics(seconds=seconds, bytes_in=sizes[part], bytes_out=output_size),
+            )
+            for file, part, output_size in zip(output_files, group, output_sizes)
+        ]
+
+    def iterall(
+        self, input_pfiles: list[list[str]], output_dir: str
+    ) -> Iterator[tuple[int, list[str], Metrics]]:
+        pool = ThreadPoolExecutor(self.max_concurrency)
+        try:
+            # Sizes of the parts' inputs, None for parts without input files
+            sizes = list(
+                pool.map(
+                    lambda files: sum(map(get_size, files)) if files else None,
+                    input_pfiles,
+                )
+            )
+            futures = [
+                pool.submit(self._run_group, group, input_pfiles, output_dir, sizes)
+                for group in self._group_parts(sizes)
+            ]
+            for part, size in enumerate(sizes):
+                if size is None:
+                    yield part, [], Metrics()
+
+            # The parts that finished are reported even if others failed
+            error = None
+            for future in as_completed(futures):
+                try:
+                    yield from future.result()
+                except Exception as e:
+                    error = error or e
+            if error is not None:
+                raise error
+        finally:
+            # Do not start more ClickHouse processes when the caller stops early
+            pool.shutdown(cancel_futures=True)
+
+    def runall(self, input_pfiles: list[list[str]], output_dir: str) -> list[list[str]]:
+        output_pfiles = [[] for _ in input_pfiles]
+        for part, files, _ in self.iterall(input_pfiles, output_dir):
+            output_pfiles[part] = files
+        return output_pfiles
@@ -0,0 +1,120 @@
+import os
+from collections import defaultdict
+
+from lightningdb.df import LightningCtx
+from lightningdb.pipeline import run_pipeline
+from lightningdb.rw.read_df import iterrows
+from lightningdb.stages import aggregate as aggregate_module
+from lightningdb.stages.aggregate import Aggregate
+from lightningdb.stages.const import Const
+
+input_schema = {
+    "type": "record",
+    "name": "Sale",
+    "fields": [
+        {"name": "user", "type": "string"},
+        {"name": "day", "type": "long"},
+        {"name": "amount", "type": ["null", "double"]},
+    ],
+}
+
+output_schema = {
+    "type": "record",
+    "name": "UserSales",
+    "fields": [
+        {"name": "user", "type": "string"},
+        {"name": "n", "type": "long"},
+        {"name": "amounts", "type": "long"},
+        {"name": "total", "type": ["null", "double"]},
+        {"name": "first", "type": ["null", "long"]},
+        {"name": "last", "type": ["null", "long"]},
+        {"name": "days", "type": "long"},
+    ],
+}
+
+
+def expected_groups(rows: list[dict]) -> dict[str, dict]:
+    groups = defaultdict(list)
+    for row in rows:
+        groups[row["user"]].append(row)
+    expected = {}
+    for user, rows in groups.items():
+        amounts = [r["amount"] for r in rows if r["amount"] is not None]
+        expected[user] = {
+            "user": user,
+            "n": len(rows),
+            "amounts": len(amounts),
+            "total": sum(amounts) if amounts else None,
+            "first": min(r["day"] for r in rows),
+            "last": max(r["day"] for r in rows),
+            "days": len({r["day"] for r in rows}),
+        }
+    return expected
+
+
+def aggregate(**kwargs) -> Aggregate:
+    return Aggregate(
+        keys=["user"],
+        aggs={
+            "n": ("count", None),
+            "amounts": ("count", "amount"),
+            "total": ("sum", "amount"),
+            "first": ("min", "day"),
+            "last": ("max", "day"),
+            "days": ("count_distinct", "day"),
+        },
+        avro_schema=output_schema,
+        **kwargs,
+    )
+
+
+rows = [
+    {
+        "user": f"u{(i * 7919) % 300}",
+        "day": i % 11,
+        "amount": None if i % 5 == 0 else float(i % 100),
+    }
+    for i in range(6000)
+]
+
+
+def test_aggregate_spills(monkeypatch):
+    # A tiny memory budget makes the map phase flush early and the final phase spill
+    monkeypatch.setattr(aggregate_module, "SPILL_BUCKETS", 3)
+    stage = aggregate(nparts=4, memory_budget=500, max_workers=1)
+
+    # Two input parts with the same users
+    input_pfiles = []
+    for part, chunk in enumerate([rows[:3000], rows[3000:]]):
+        dir = f"/tmp/test_aggregate_in/{part}"
+        files = Const(items=chunk, avro_schema=input_schema).run([], dir)
+        input_pfiles.append([os.path.join(dir, f) for f in files])
+
+    output_pfiles = stage.runall(input_pfiles, "/tmp/test_aggregate_out")
+    assert len(output_pfiles) == 4
+    result = {}
+    for files in output_pfiles:
+        for row in iterrows(
+            [os.path.join("/tmp/test_aggregate_out", f) for f in files]
+        ):
+            assert row["user"] not in result  # each group is in a single part
+            result[row["user"]] = row
+    assert result == expected_groups(rows)
+
+
+def test_aggregate_pipeline():
+    dbname = "/tmp/test_aggregate.db"
+    if os.path.exists(dbname):
+        os.remove(dbname)
+    ctx = LightningCtx(dbname, "/tmp/")
+    run_pipeline(
+        ctx,
+        "test_aggregate",
+        [Const(items=rows, avro_schema=input_schema), aggregate(nparts=2)],
+    )
+    files = [
+        os.path.join("/tmp/test_aggregate@1", f)
+        for part in range(2)
+        for f in ctx.get_files("test_aggregate@1", part)
+    ]
+    assert {row["user"]: row for row in iterrows(files)} == expected_groups(rows)
@@ -1,5 +1,10 @@
-from lightningdb.rw.read_df import iterrows
-from lightningdb.rw.write_avro import WriteAvro
+import os
+
+from lightningdb.rw.avro_blocks import iter_blocks, read_header
+from lightningdb.rw.read_df import iterrows, split_file
+from lightningdb.rw.stats import STATS_BATCH, ColumnStats, StatsCollector
+from lightningdb.rw.write_avro import WriteAvro, WriteOptions
+from lightningdb.rw.write_df import WriteDF
 
 
 def test_write_and_read_avro():
@@ -18,3 +23,144 @@ def test_write_and_read_avro():
     received = list(iterrows(["/tmp/a.avro"]))
     print(received)
     assert received == rows
+
+
+def test_projection_and_predicate():
+    schema = {
+        "type": "record",
+        "name": "User",
+        "fields": [
+            {"name": "name", "type": "string"},
+            {"name": "age", "type": "int"},
+            {"name": "tags", "type": {"type": "array", "items": "string"}},
+        ],
+    }
+    writer = WriteDF("/tmp/test_pushdown", schema)
+    for i in range(100):
+        writer.append({"name": f"user{i}", "age": i, "tags": ["a", "b"]})
+    writer.close()
+    (file,) = [os.path.join("/tmp/test_pushdown", f) for f in writer.files]
+
+    rows = list(iterrows([file], columns=["age"], where=[("age", ">=", 95)]))
+    assert rows == [{"age": i} for i in range(95, 100)]
+
+    # The statistics rule out the (missing) second file, so it is never opened
+    (stats,) = writer.stats
+    missing = "/tmp/test_pushdown/missing.avro"
+    all_stats = {file: stats, missing: stats.model_copy(update={"file": "missing"})}
+    all_stats[missing].columns = {"age": ColumnStats(min=0, max=10, nulls=0)}
+    rows = list(iterrows([file, missing], where=[("age", "==", 42)], stats=all_stats))
+    assert [row["name"] for row in rows] == ["user42"]
+
+
+def test_codecs_and_parallel_compression():
+    schema = {
+        "type": "record",
+        "name": "User",
+        "fields": [{"name": "name", "type": "string"}, {"name": "age", "type": "int"}],
+    }
+    rows = [{"name": f"user{i}", "age": i} for i in range(5000)]
+    for options in [
+        WriteOptions(block_size=1000),
+        WriteOptions(block_size=1000, compression_level=9, parallel=False),
+        WriteOptions(codec="deflate", compression_level=1, block_size=1000),
+        WriteOptions(codec="null"),
+    ]:
+        writer = WriteAvro("/tmp/codec.avro", schema, options)
+        writer.extend(rows)
+        estimate = writer.size()
+        writer.close()
+
+        # Blocks compressed out of line are written in order
+        assert list(iterrows(["/tmp/codec.avro"])) == rows
+        size = os.path.getsize("/tmp/codec.avro")
+        assert writer.size() == size
+        assert abs(estimate - size) < 0.1 * size
+
+
+def test_block_index_and_splits():
+    schema = {
+        "type": "record",
+        "name": "Row",
+        "fields": [{"name": "x", "type": "long"}, {"name": "s", "type": "string"}],
+    }
+    rows = [{"x": i, "s": f"row {i}"} for i in range(5000)]
+    for parallel in [True, False]:
+        writer = WriteDF(
+            "/tmp/test_blocks",
+            schema,
+            options=WriteOptions(block_size=2000, parallel=parallel),
+        )
+        writer.extend(rows)
+        writer.close()
+        (stats,) = writer.stats
+        path = os.path.join("/tmp/test_blocks", stats.file)
+
+        # The index matches the blocks of the file
+        with open(path, "rb") as f:
+            header = read_header(f)
+            blocks = [(offset, count) for offset, count, _ in iter_blocks(f, header)]
+        assert blocks == stats.blocks
+        assert len(blocks) > 10
+        assert sum(count for _, count in blocks) == len(rows)
+
+        splits = split_file(path, stats, stats.bytes // 4)
+        assert 3 <= len(splits) <= 5
+        parts = [list(iterrows([split])) for split in splits]
+        assert all(parts)
+        assert sum(parts, []) == rows
+        assert list(iterrows(splits, columns=["x"])) == [{"x": r["x"]} for r in rows]
+        assert split_file(path, stats, stats.bytes) == [path]
+
+
+def test_stats_collector():
+    schema = {
+        "type": "record",
+        "name": "Row",
+        "fields": [
+            {"name": "x", "type": "long"},
+            {"name": "s", "type": ["null", "string"]},
+        ],
+    }
+    n = STATS_BATCH * 2 + 10
+    rows = [{"x": i, "s": None if i % 2 else f"{i:06}"} for i in range(n)]
+    rows[5] = {"x": -1}  # A missing nullable field is written as null
+
+    collector = StatsCollector(schema)
+    for row in rows[:100]:
+        collector.update(row)
+    collector.update_many(rows[100:])
+    columns = collector.columns()
+    assert columns["x"] == ColumnStats(min=-1, max=n - 1, nulls=0)
+    assert columns["s"] == ColumnStats(min="000000", max=f"{n - 2:06}", nulls=n // 2)
+
+    single = StatsCollector({**schema, "fields": schema["fields"][:1]})
+    single.update_many(rows)
+    assert single.columns() == {"x": ColumnStats(min=-1, max=n - 1, nulls=0)}
+
+
+def test_append_and_extend_split_alike(monkeypatch):
+    monkeypatch.setattr("lightningdb.rw.write_df.SPLIT_SIZE", 1000)
+    schema = {
+        "type": "record",
+        "name": "Row",
+        "fields": [{"name": "x", "type": "long"}, {"name": "s", "type": "string"}],
+    }
+    rows = [{"x": i, "s": f"row {i}"} for i in range(2000)]
+    options = WriteOptions(block_size=1000, parallel=False)
+
+    appended = WriteDF("/tmp/test_split_append", schema, options=options)
+    for row in rows:
+        appended.append(row)
+    appended.close()
+    extended = WriteDF("/tmp/test_split_extend", schema, options=options)
+    for i in range(0, len(rows), 50):
+        extended.extend(rows[i : i + 50])
+    extended.close()
+
+    # Both split once a finished block takes the file past SPLIT_SIZE
+    assert len(appended.stats) > 3
+    assert len(extended.stats) == len(appended.stats)
+    for stats in appended.stats[:-1] + extended.stats[:-1]:
+        assert stats.bytes > 1000
+    assert sum(s.rows for s in extended.stats) == len(rows)
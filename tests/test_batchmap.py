@@ -0,0 +1,265 @@
+import os
+
+import pytest
+
+from lightningdb.df import LightningCtx
+from lightningdb.pipeline import run_pipeline
+from lightningdb.rw.read_df import iterbatches, iterchunks, iterrows
+from lightningdb.rw.write_avro import WriteOptions
+from lightningdb.rw.write_df import WriteDF
+from lightningdb.stages.batchmap import BatchMap
+from lightningdb.stages.const import Const
+
+schema = {
+    "type": "record",
+    "name": "Point",
+    "fields": [{"name": "x", "type": "long"}, {"name": "y", "type": "double"}],
+}
+
+
+def write_input(dir: str, n: int) -> list[str]:
+    writer = WriteDF(dir, schema)
+    writer.extend([{"x": i, "y": i / 2} for i in range(n)])
+    writer.close()
+    return [os.path.join(dir, file) for file in writer.files]
+
+
+def test_iterchunks():
+    files = write_input("/tmp/test_iterchunks", 25)
+    chunks = list(iterchunks(files, chunk_size=10))
+    assert [len(chunk) for chunk in chunks] == [10, 10, 5]
+    assert [row for chunk in chunks for row in chunk] == list(iterrows(files))
+
+
+def test_batchmap_rows():
+    files = write_input("/tmp/test_batchmap_in", 100)
+    stage = BatchMap(
+        fn=lambda rows: [{"x": r["x"], "y": r["y"] * 2} for r in rows if r["x"] % 2],
+        avro_schema=schema,
+        batch_size=7,
+    )
+    output = stage.run(files, "/tmp/test_batchmap_out")
+    rows = list(iterrows([os.path.join("/tmp/test_batchmap_out", f) for f in output]))
+    assert rows == [{"x": i, "y": float(i)} for i in range(1, 100, 2)]
+
+
+def test_batchmap_numpy():
+    pytest.importorskip("numpy")
+    files = write_input("/tmp/test_batchmap_np_in", 100)
+    stage = BatchMap(
+        fn=lambda cols: {"x": cols["x"] + 1, "y": cols["y"] * cols["x"]},
+        avro_schema=schema,
+        batch_size=30,
+        format="numpy",
+    )
+    output = stage.run(files, "/tmp/test_batchmap_np_out")
+    rows = list(
+        iterrows([os.path.join("/tmp/test_batchmap_np_out", f) for f in output])
+    )
+    assert rows == [{"x": i + 1, "y": i * i / 2} for i in range(100)]
+
+
+def test_iterbatches():
+    np = pytest.importorskip("numpy")
+    nullable_schema = {
+        "type": "record",
+        "name": "Nullable",
+        "fields": [
+            {"name": "x", "type": "long"},
+            {"name": "y", "type": ["null", "float"]},
+            {"name": "tags", "type": {"type": "array", "items": "string"}},
+        ],
+    }
+    dir = "/tmp/test_iterbatches"
+    writer = WriteDF(dir, nullable_schema)
+    rows = [
+        {"x": i, "y": None if i % 3 == 0 else i / 2, "tags": [str(i)] * (i % 2)}
+        for i in range(25)
+    ]
+    writer.extend(rows)
+    writer.close()
+    files = [os.path.join(dir, file) for file in writer.files]
+
+    batches = list(iterbatches(files, batch_size=10))
+    assert [len(batch["x"]) for batch in batches] == [10, 10, 5]
+    batch = batches[0]
+    assert batch["x"].dtype == np.int64
+    assert batch["y"].dtype == np.float32
+    assert batch["y"].mask.tolist() == [i % 3 == 0 for i in range(10)]
+    assert batch["tags"].dtype == object
+    assert batch["tags"][1] == ["1"]
+
+    # Projection, and the round trip through extend_columns
+    assert list(next(iterbatches(files, columns=["y"]))) == ["y"]
+    with pytest.raises(ValueError):
+        next(iterbatches(files, columns=[]))
+    out = WriteDF("/tmp/test_iterbatches_out", nullable_schema)
+    for batch in batches:
+        out.extend_columns(batch)
+    out.close()
+    assert (
+        list(
+            iterrows([os.path.join("/tmp/test_iterbatches_out", f) for f in out.files])
+        )
+        == rows
+    )
+
+
+@pytest.mark.parametrize("codec", ["zstandard", "deflate", "null"])
+@pytest.mark.parametrize("types", [["long", "int", "boolean"], ["double", "float"]])
+def test_iterbatches_block_decoding(codec, types):
+    np = pytest.importorskip("numpy")
+    numeric_schema = {
+        "type": "record",
+        "name": "Numeric",
+        "fields": [{"name": f"c{i}", "type": t} for i, t in enumerate(types)],
+    }
+    values = {
+        "long": lambda i: [-(2**63), 2**63 - 1, 0, -1][i] if i < 4 else i * 3**30,
+        "int": lambda i: -i * 1000,
+        "boolean": lambda i: i % 3 == 0,
+        "double": lambda i: i / 3,
+        "float": lambda i: i / 4,
+    }
+    rows = [{f"c{c}": values[t](i) for c, t in enumerate(types)} for i in range(2500)]
+    dir = f"/tmp/test_iterbatches_blocks_{codec}_{types[0]}"
+    options = WriteOptions(codec=codec, block_size=1000)
+    files = []
+    for chunk in [rows[:1000], rows[1000:]]:
+        writer = WriteDF(dir, numeric_schema, options=options)
+        writer.extend(chunk)
+        writer.close()
+        files += [os.path.join(dir, f) for f in writer.files]
+
+    batches = list(iterbatches(files, batch_size=300))
+    assert [len(batch["c0"]) for batch in batches] == [300] * 8 + [100]
+    for c, t in enumerate(types):
+        column = np.concatenate([batch[f"c{c}"] for batch in batches])
+        assert (
+            column.dtype
+            == {
+                "long": np.int64,
+                "int": np.int32,
+                "boolean": bool,
+                "double": np.float64,
+                "float": np.float32,
+            }[t]
+        )
+        assert column.tolist() == [row[f"c{c}"] for row in rows]
+
+    # Projection and filter, as iterrows
+    where = [("c0", ">=", rows[2000]["c0"])]
+    (batch,) = iterbatches(files, batch_size=5000, columns=["c1", "c0"], where=where)
+    assert list(batch) == ["c0", "c1"]
+    expected = list(iterrows(files, columns=["c1", "c0"], where=where))
+    assert len(expected) >= 500
+    assert batch["c1"].tolist() == [row["c1"] for row in expected]
+
+
+def test_extend_columns_encoding():
+    np = pytest.importorskip("numpy")
+    encoded_schema = {
+        "type": "record",
+        "name": "Encoded",
+        "fields": [
+            {"name": "l", "type": "long"},
+            {"name": "i", "type": ["int", "null"]},
+            {"name": "b", "type": "boolean"},
+            {"name": "f", "type": "float"},
+            {"name": "d", "type": ["null", "double"]},
+            {"name": "s", "type": ["null", "string"]},
+            {"name": "raw", "type": "bytes"},
+        ],
+    }
+    n = 3000
+    rows = [
+        {
+            "l": [-(2**63), 2**63 - 1][i] if i < 2 else (i - 1500) * 3**30,
+            "i": None if i % 4 == 0 else -i * 1000,
+            "b": i % 3 == 0,
+            "f": i / 4,
+            "d": None if i % 5 == 0 else i / 3,
+            "s": None if i % 7 == 0 else f"é{i}" * (i % 3),
+            "raw": bytes(i % 200),
+        }
+        for i in range(n)
+    ]
+    columns = {
+        "l": np.array([row["l"] for row in rows]),
+        "i": np.ma.MaskedArray(
+            [row["i"] or 0 for row in rows], mask=[row["i"] is None for row in rows]
+        ),
+        "b": np.array([row["b"] for row in rows]),
+        "f": np.array([row["f"] for row in rows], dtype=np.float32),
+        "d": [row["d"] for row in rows],  # A list with nulls
+        "s": np.array([row["s"] for row in rows], dtype=object),
+        "raw": [row["raw"] for row in rows],
+    }
+    dir = "/tmp/test_extend_columns"
+    writer = WriteDF(
+        dir,
+        encoded_schema,
+        collect_stats=True,
+        options=WriteOptions(block_size=10_000),
+    )
+    assert writer.encoding is not None
+    writer.append(rows[0])
+    writer.extend_columns({name: col[1:1000] for name, col in columns.items()})
+    writer.extend_columns({name: col[1000:] for name, col in columns.items()})
+    writer.close()
+    (stats,) = writer.stats
+    files = [os.path.join(dir, f) for f in writer.files]
+    assert list(iterrows(files)) == rows
+    # The encoded records are written in blocks of the block size, like rows
+    assert sum(count for _, count in stats.blocks) == n
+    row_writer = WriteDF(dir, encoded_schema, options=WriteOptions(block_size=10_000))
+    row_writer.extend(rows)
+    row_writer.close()
+    assert stats.raw_bytes == row_writer.stats[0].raw_bytes
+    assert abs(len(stats.blocks) - len(row_writer.stats[0].blocks)) <= 2
+    assert stats.columns["i"].nulls == n // 4
+    assert stats.columns["l"].min == -(2**63)
+
+    # Columns of other types than the schema's are written as rows by fastavro
+    writer = WriteDF(dir, encoded_schema)
+    fallback = {**columns, "l": [str(v) for v in columns["l"]]}
+    with pytest.raises((TypeError, ValueError)):
+        writer.extend_columns(fallback)
+
+
+def test_batchmap_numpy_fused():
+    pytest.importorskip("numpy")
+    nullable_schema = {
+        "type": "record",
+        "name": "Nullable",
+        "fields": [{"name": "y", "type": ["null", "double"]}],
+    }
+    kinds = []
+
+    def double(cols):
+        kinds.append(type(cols["y"]).__name__)
+        return {"y": cols["y"] * 2}
+
+    pipeline = [
+        Const(
+            items=[{"y": None if i % 3 == 0 else i} for i in range(10)],
+            avro_schema=nullable_schema,
+        ),
+        BatchMap(fn=double, avro_schema=nullable_schema, format="numpy"),
+    ]
+    outputs = []
+    for fuse in [False, True]:
+        dbname = "/tmp/test_batchmap_fused.db"
+        if os.path.exists(dbname):
+            os.remove(dbname)
+        ctx = LightningCtx(dbname, "/tmp/")
+        kinds.clear()
+        run_pipeline(ctx, "test_batchmap_fused", pipeline, fuse=fuse)
+        # Nullable numeric columns are masked arrays in both cases
+        assert kinds == ["MaskedArray"]
+
+        files = ctx.get_files("test_batchmap_fused@1", 0)
+        paths = [os.path.join("/tmp/test_batchmap_fused@1", f) for f in files]
+        outputs.append([row["y"] for row in iterrows(paths)])
+    assert outputs[0] == outputs[1]
+    assert outputs[0][:4] == [None, 2.0, 4.0, None]
@@ -0,0 +1,84 @@
+import os
+
+import pytest
+
+from lightningdb.df import LightningCtx
+from lightningdb.pipeline import run_pipeline
+from lightningdb.rw.read_df import iterrows
+from lightningdb.rw.stats import recording
+from lightningdb.rw.write_avro import WriteOptions
+from lightningdb.rw.write_df import WriteDF
+from lightningdb.stages.compact import Compact, compact_files
+from lightningdb.stages.const import Const
+from lightningdb.stages.shuffle import Shuffle
+
+schema = {
+    "type": "record",
+    "name": "Row",
+    "fields": [{"name": "x", "type": "long"}, {"name": "s", "type": "string"}],
+}
+
+
+def write_files(dir: str, chunks: list[list[dict]], options=None) -> list[str]:
+    files = []
+    for chunk in chunks:
+        writer = WriteDF(dir, schema, options=options)
+        writer.extend(chunk)
+        writer.close()
+        files += [os.path.join(dir, f) for f in writer.files]
+    return files
+
+
+@pytest.mark.parametrize("codec", ["zstandard", "deflate", "null"])
+def test_compact_files(codec):
+    options = WriteOptions(codec=codec, block_size=1000)
+    rows = [{"x": i, "s": f"row {i}"} for i in range(3000)]
+    chunks = [rows[i : i + 100] for i in range(0, len(rows), 100)]
+    files = write_files(f"/tmp/test_compact_in_{codec}", chunks, options)
+
+    # A file with another codec starts a new output file
+    other_codec = WriteOptions(codec="deflate" if codec == "null" else "null")
+    other = write_files(f"/tmp/test_compact_in_{codec}", [rows[:10]], other_codec)
+    dir = f"/tmp/test_compact_out_{codec}"
+    with recording() as stats:
+        output = compact_files(files + other, dir, split_size=20_000)
+
+    assert 1 < len(output) < len(chunks)
+    assert list(iterrows([os.path.join(dir, f) for f in output])) == rows + rows[:10]
+    assert [s.file for s in stats] == output
+    assert sum(s.rows for s in stats) == len(rows) + 10
+    assert all(s.bytes == os.path.getsize(os.path.join(dir, s.file)) for s in stats)
+    if codec != "deflate":
+        assert all(s.raw_bytes > 0 for s in stats[:-1])
+
+
+def test_compact_stage_and_coalesce():
+    dbname = "/tmp/test_compact.db"
+    if os.path.exists(dbname):
+        os.remove(dbname)
+    ctx = LightningCtx(dbname, "/tmp/")
+    rows = [{"x": i, "s": str(i)} for i in range(500)]
+    run_pipeline(
+        ctx,
+        "test_compact",
+        [
+            Const(items=rows, avro_schema=schema),
+            Shuffle(nparts=8, key="x", avro_schema=schema),
+            Compact(),
+        ],
+    )
+
+    def read(df: str, part: int) -> list[dict]:
+        files = ctx.get_files(df, part)
+        return list(iterrows([os.path.join("/tmp", df, f) for f in files]))
+
+    assert all(len(ctx.get_files("test_compact@2", p)) == 1 for p in range(8))
+    assert read("test_compact@2", 3) == read("test_compact@1", 3)
+
+    parts = [read("test_compact@1", p) for p in range(8)]
+    assert ctx.coalesce("test_compact@1", 3) == 3
+    assert ctx.get_nparts("test_compact@1") == 3
+    assert sum((read("test_compact@1", p) for p in range(3)), []) == sum(parts, [])
+    stats = ctx.get_part_stats("test_compact@1")
+    assert sum(s.rows for s in stats.values()) == 500
+    assert ctx.get_fingerprints("test_compact@1") == {}
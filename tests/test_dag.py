@@ -0,0 +1,130 @@
+import os
+
+import pytest
+
+from lightningdb.dag import Node, run_dag
+from lightningdb.df import LightningCtx
+from lightningdb.rw.read_df import iterrows
+from lightningdb.stages.const import Const
+from lightningdb.stages.flatmap import FlatMap
+from lightningdb.stages.join import Join
+from lightningdb.stages.shuffle import Shuffle
+
+users_schema = {
+    "type": "record",
+    "name": "User",
+    "fields": [{"name": "id", "type": "long"}, {"name": "name", "type": "string"}],
+}
+orders_schema = {
+    "type": "record",
+    "name": "Order",
+    "fields": [{"name": "id", "type": "long"}, {"name": "amount", "type": "long"}],
+}
+joined_schema = {
+    "type": "record",
+    "name": "Joined",
+    "fields": [
+        {"name": "id", "type": "long"},
+        {"name": "amount", "type": "long"},
+        {"name": "name", "type": ["null", "string"]},
+    ],
+}
+
+
+def read_df(ctx: LightningCtx, name: str) -> list[dict]:
+    rows = []
+    for part in range(ctx.get_nparts(name)):
+        files = ctx.get_files(name, part)
+        rows += iterrows([os.path.join(ctx.repodir, name, f) for f in files])
+    return rows
+
+
+def test_dag_join():
+    dbname = "/tmp/test_dag.db"
+    if os.path.exists(dbname):
+        os.remove(dbname)
+    ctx = LightningCtx(dbname, "/tmp/")
+
+    users = [{"id": i, "name": f"user{i}"} for i in range(20)]
+    orders = [{"id": i % 25, "amount": i} for i in range(100)]
+    nodes = [
+        Node(
+            name="dag_joined",
+            stage=Join(on=["id"], avro_schema=joined_schema, how="left"),
+            inputs=["dag_orders_by_id", "dag_users_by_id"],
+        ),
+        Node(name="dag_users", stage=Const(items=users, avro_schema=users_schema)),
+        Node(name="dag_orders", stage=Const(items=orders, avro_schema=orders_schema)),
+        Node(
+            name="dag_users_by_id",
+            stage=Shuffle(nparts=3, key="id", avro_schema=users_schema),
+            inputs=["dag_users"],
+        ),
+        Node(
+            name="dag_orders_by_id",
+            stage=Shuffle(nparts=3, key="id", avro_schema=orders_schema),
+            inputs=["dag_orders"],
+        ),
+        Node(
+            name="dag_broadcast",
+            stage=Join(on=["id"], avro_schema=joined_schema, broadcast=True),
+            inputs=["dag_orders_by_id", "dag_users"],
+        ),
+    ]
+    run_dag(ctx, nodes, max_concurrency=2)
+
+    names = {u["id"]: u["name"] for u in users}
+    expected = sorted((o["id"], o["amount"], names.get(o["id"])) for o in orders)
+    joined = read_df(ctx, "dag_joined")
+    assert ctx.get_nparts("dag_joined") == 3
+    assert sorted((r["id"], r["amount"], r["name"]) for r in joined) == expected
+
+    broadcast = read_df(ctx, "dag_broadcast")
+    assert sorted((r["id"], r["amount"], r["name"]) for r in broadcast) == [
+        e for e in expected if e[2] is not None
+    ]
+
+    # Nothing changed: every part is skipped
+    files = ctx.get_files("dag_joined", 0)
+    run_dag(ctx, nodes)
+    assert ctx.get_files("dag_joined", 0) == files
+
+
+def test_dag_errors():
+    dbname = "/tmp/test_dag_errors.db"
+    if os.path.exists(dbname):
+        os.remove(dbname)
+    ctx = LightningCtx(dbname, "/tmp/")
+    identity = FlatMap(fn=lambda row: [row], avro_schema=users_schema)
+
+    with pytest.raises(ValueError, match="Cycle"):
+        run_dag(
+            ctx,
+            [
+                Node(name="dag_a", stage=identity, inputs=["dag_b"]),
+                Node(name="dag_b", stage=identity, inputs=["dag_a"]),
+            ],
+        )
+    with pytest.raises(ValueError, match="Unknown input"):
+        run_dag(ctx, [Node(name="dag_a", stage=identity, inputs=["dag_missing"])])
+
+    users = [{"id": i, "name": f"user{i}"} for i in range(10)]
+    with pytest.raises(ValueError, match="co-partitioned"):
+        run_dag(
+            ctx,
+            [
+                Node(
+                    name="dag_one", stage=Const(items=users, avro_schema=users_schema)
+                ),
+                Node(
+                    name="dag_two",
+                    stage=Shuffle(nparts=2, key="id", avro_schema=users_schema),
+                    inputs=["dag_one"],
+                ),
+                Node(
+                    name="dag_bad_join",
+                    stage=Join(on=["id"], avro_schema=users_schema),
+                    inputs=["dag_one", "dag_two"],
+                ),
+            ],
+        )
@@ -0,0 +1,180 @@
+import sys
+import threading
+
+import pytest
+
+from lightningdb.df import LightningCtx
+from lightningdb.executor import RQExecutor
+from lightningdb.pipeline import run_pipeline
+from lightningdb.rw.read_df import iterrows
+from lightningdb.stages import multifetch
+from lightningdb.stages.const import Const
+from lightningdb.stages.flatmap import FlatMap
+from lightningdb.stages.multifetch import (
+    MultiFetch,
+    MultiFetchError,
+    RQContext,
+    find_stragglers,
+)
+from lightningdb.stages.shuffle import Shuffle
+
+fakeredis = pytest.importorskip("fakeredis")
+rq = pytest.importorskip("rq")
+
+# Dummy fetch command: prints one output file per input file, and fails on
+# inputs named "fail" or, the first time only, on inputs named "fail-once:<marker>"
+FETCH = """
+import os, sys
+output_dir, *inputs = sys.argv[1:]
+for f in inputs:
+    if f == "fail":
+        sys.exit(1)
+    if f.startswith("fail-once:"):
+        marker = f.split(":", 1)[1]
+        if not os.path.exists(marker):
+            open(marker, "w").close()
+            sys.exit(1)
+    print(os.path.join(output_dir, os.path.basename(f) + ".out"))
+"""
+
+
+# Dummy fetch command writing its output files, named relative to the attempt's
+# output directory, with the directory as content. Inputs named "slow" take a while.
+WRITE_FETCH = """
+import os, sys, time
+output_dir, *inputs = sys.argv[1:]
+os.makedirs(output_dir, exist_ok=True)
+for f in inputs:
+    if f == "slow":
+        time.sleep(1)
+    with open(os.path.join(output_dir, f + ".out"), "w") as fp:
+        fp.write(output_dir)
+    print(f + ".out")
+"""
+
+
+def run_with_worker(stage, redis, input_pfiles, output_dir="/out"):
+    """
+    Run stage.iterall in a thread while a SimpleWorker processes the jobs.
+    """
+    results = []
+    errors = []
+
+    def consume():
+        try:
+            for part, files, _ in stage.iterall(input_pfiles, output_dir):
+                results.append((part, files))
+        except Exception as e:
+            errors.append(e)
+
+    thread = threading.Thread(target=consume)
+    thread.start()
+    queue = rq.Queue("superfetch", connection=redis)
+    worker = rq.SimpleWorker([queue], connection=redis)
+    while thread.is_alive():
+        worker.work(burst=True, logging_level="WARNING")
+        thread.join(0.05)
+    return results, errors
+
+
+@pytest.fixture
+def redis(monkeypatch):
+    redis = fakeredis.FakeRedis()
+    monkeypatch.setattr(multifetch, "RQContext", lambda: RQContext(redis))
+    return redis
+
+
+def test_multifetch_retries(redis, tmp_path):
+    stage = MultiFetch(
+        command=[sys.executable, "-c", FETCH], max_retries=1, poll_interval=0.01
+    )
+    marker = tmp_path / "marker"
+    input_pfiles = [["a"], [f"fail-once:{marker}"], ["b", "c"]]
+    results, errors = run_with_worker(stage, redis, input_pfiles)
+
+    assert not errors
+    # Every attempt writes to its own subdirectory; part 1 succeeded on its retry
+    assert sorted(results) == [
+        (0, ["/out/0-0/a.out"]),
+        (1, [f"/out/1-1/{marker.name}.out"]),
+        (2, ["/out/2-0/b.out", "/out/2-0/c.out"]),
+    ]
+
+
+def test_multifetch_failure_keeps_finished_parts(redis):
+    stage = MultiFetch(
+        command=[sys.executable, "-c", FETCH], max_retries=1, poll_interval=0.01
+    )
+    results, errors = run_with_worker(stage, redis, [["a"], ["fail"]])
+
+    assert results == [(0, ["/out/0-0/a.out"])]
+    (error,) = errors
+    assert isinstance(error, MultiFetchError)
+
+
+def test_multifetch_straggler_loser_finishes_last(redis, tmp_path, monkeypatch):
+    # The cancellation of the speculative attempt does not stop it, as when the
+    # fetch process outlives its RQ job: it runs after the original attempt won
+    monkeypatch.setattr(RQContext, "cancel", lambda self, job: None)
+    stage = MultiFetch(
+        command=[sys.executable, "-c", WRITE_FETCH],
+        straggler_factor=1.0,
+        straggler_min_done=1,
+        poll_interval=0.01,
+    )
+    results, errors = run_with_worker(
+        stage, redis, [["a"], ["slow"]], output_dir=str(tmp_path)
+    )
+    assert not errors
+    assert sorted(results) == [(0, ["0-0/a.out"]), (1, ["1-0/slow.out"])]
+
+    # Let the losing attempt finish
+    queue = rq.Queue("superfetch", connection=redis)
+    rq.SimpleWorker([queue], connection=redis).work(burst=True, logging_level="WARNING")
+    assert (tmp_path / "1-1" / "slow.out").read_text() == str(tmp_path / "1-1")
+    assert (tmp_path / "1-0" / "slow.out").read_text() == str(tmp_path / "1-0")
+
+
+def test_find_stragglers():
+    assert find_stragglers({0: 10.0, 1: 2.0}, [1.0, 1.0], 3.0, 3) == []
+    assert find_stragglers({0: 10.0, 1: 2.0}, [1.0, 1.0, 2.0], 3.0, 3) == [0]
+
+
+def test_rq_executor_pipeline(tmp_path):
+    redis = fakeredis.FakeRedis()
+    schema = {
+        "type": "record",
+        "name": "User",
+        "fields": [{"name": "a", "type": "int"}],
+    }
+    pipeline = [
+        Const(items=[{"a": i} for i in range(20)], avro_schema=schema),
+        Shuffle(nparts=4, key="a", avro_schema=schema),
+        FlatMap(fn=lambda row: [{"a": row["a"] * 2}], avro_schema=schema),
+    ]
+    executor = RQExecutor(max_in_flight=2, poll_interval=0.01, redis=redis)
+    errors = []
+
+    def run():
+        try:
+            ctx = LightningCtx(str(tmp_path / "test.db"), str(tmp_path))
+            run_pipeline(ctx, "test_rq", pipeline, executor)
+        except Exception as e:
+            errors.append(e)
+
+    thread = threading.Thread(target=run)
+    thread.start()
+    queue = rq.Queue("lightningdb", connection=redis)
+    worker = rq.SimpleWorker([queue], connection=redis)
+    while thread.is_alive():
+        worker.work(burst=True, logging_level="WARNING")
+        thread.join(0.05)
+    assert not errors
+
+    ctx = LightningCtx(str(tmp_path / "test.db"), str(tmp_path))
+    files = [
+        str(tmp_path / "test_rq@2" / file)
+        for part in range(4)
+        for file in ctx.get_files("test_rq@2", part)
+    ]
+    assert sorted(row["a"] for row in iterrows(files)) == [i * 2 for i in range(20)]
@@ -1,11 +1,25 @@
 import os
 import sqlite3
+import threading
+
+import pytest
 
 from lightningdb.df import LightningCtx
-from lightningdb.pipeline import run_pipeline
+from lightningdb.executor import ProcessExecutor
+from lightningdb.fingerprint import fingerprint_stage
+from lightningdb.pipeline import plan_pipeline, run_pipeline
+from lightningdb.rw.read_df import iterrows
 from lightningdb.stages.const import Const
+from lightningdb.stages.flatmap import FlatMap
 from lightningdb.stages.shuffle import Shuffle
 
+# Read by scale() in test_pipeline_incremental_globals
+FACTOR = 2
+
+
+def scale(row):
+    return [{"a": row["a"] * FACTOR}]
+
 
 def test_pipeline():
     schema = {
@@ -26,3 +40,273 @@ def test_pipeline():
     cur = db.execute("select count(*) from df where name='test@1'")
     (result,) = cur.fetchone()
     assert result == 2
+
+
+def test_pipeline_process_executor():
+    schema = {
+        "type": "record",
+        "name": "User",
+        "fields": [{"name": "a", "type": "int"}],
+    }
+    pipeline = [
+        Const(items=[{"a": i} for i in range(10)], avro_schema=schema),
+        Shuffle(nparts=4, key="a", avro_schema=schema),
+        FlatMap(fn=lambda row: [row, {"a": row["a"] * 10}], avro_schema=schema),
+    ]
+    dbname = "/tmp/test_executor.db"
+    if os.path.exists(dbname):
+        os.remove(dbname)
+    ctx = LightningCtx(dbname, "/tmp/")
+    run_pipeline(ctx, "test_executor", pipeline, ProcessExecutor(max_workers=2))
+
+    files = [
+        os.path.join("/tmp/test_executor@2", file)
+        for part in range(4)
+        for file in ctx.get_files("test_executor@2", part)
+    ]
+    received = sorted(row["a"] for row in iterrows(files))
+    assert received == sorted([i for i in range(10)] + [i * 10 for i in range(10)])
+
+
+def test_pipeline_fusion():
+    schema = {
+        "type": "record",
+        "name": "User",
+        "fields": [{"name": "a", "type": "int"}],
+    }
+    pipeline = [
+        Const(items=[{"a": 1}, {"a": 2}, {"a": 3}], avro_schema=schema),
+        FlatMap(fn=lambda row: [{"a": row["a"] + 1}], avro_schema=schema),
+        FlatMap(fn=lambda row: [row] * row["a"], avro_schema=schema),
+    ]
+    assert plan_pipeline(pipeline, fuse=True) == [[0, 1, 2]]
+
+    for keep_intermediate in [False, True]:
+        dbname = "/tmp/test_fusion.db"
+        if os.path.exists(dbname):
+            os.remove(dbname)
+        ctx = LightningCtx(dbname, "/tmp/")
+        run_pipeline(ctx, "test_fusion", pipeline, keep_intermediate=keep_intermediate)
+
+        files = ctx.get_files("test_fusion@2", 0)
+        rows = list(iterrows([os.path.join("/tmp/test_fusion@2", f) for f in files]))
+        assert [row["a"] for row in rows] == [2, 2, 3, 3, 3, 4, 4, 4, 4]
+        assert bool(ctx.get_files("test_fusion@1", 0)) == keep_intermediate
+
+
+def test_pipeline_fusion_where():
+    schema = {
+        "type": "record",
+        "name": "User",
+        "fields": [{"name": "x", "type": "int"}, {"name": "y", "type": "int"}],
+    }
+    seen = []
+
+    def keep_x(row):
+        seen.append(sorted(row))
+        return [{"x": row["x"], "y": 0}]
+
+    pipeline = [
+        Const(items=[{"x": i, "y": -i} for i in range(10)], avro_schema=schema),
+        FlatMap(fn=lambda row: [row], avro_schema=schema),
+        FlatMap(fn=keep_x, avro_schema=schema, columns=["x"], where=[("x", ">=", 5)]),
+    ]
+    outputs = []
+    for fuse in [False, True]:
+        dbname = "/tmp/test_fusion_where.db"
+        if os.path.exists(dbname):
+            os.remove(dbname)
+        ctx = LightningCtx(dbname, "/tmp/")
+        seen.clear()
+        run_pipeline(ctx, "test_fusion_where", pipeline, fuse=fuse)
+        assert seen == [["x"]] * 5
+
+        files = ctx.get_files("test_fusion_where@2", 0)
+        paths = [os.path.join("/tmp/test_fusion_where@2", f) for f in files]
+        outputs.append([row["x"] for row in iterrows(paths)])
+    assert outputs[0] == outputs[1] == [5, 6, 7, 8, 9]
+
+
+def test_pipeline_incremental():
+    schema = {
+        "type": "record",
+        "name": "User",
+        "fields": [{"name": "a", "type": "int"}],
+    }
+
+    def make_pipeline(factor):
+        return [
+            Const(items=[{"a": 1}, {"a": 2}, {"a": 3}], avro_schema=schema),
+            Shuffle(nparts=2, key="a", avro_schema=schema),
+            FlatMap(fn=lambda row: [{"a": row["a"] + 1}], avro_schema=schema),
+            FlatMap(fn=lambda row: [{"a": row["a"] * factor}], avro_schema=schema),
+        ]
+
+    dbname = "/tmp/test_incremental.db"
+    if os.path.exists(dbname):
+        os.remove(dbname)
+    ctx = LightningCtx(dbname, "/tmp/")
+
+    def snapshot():
+        return [
+            [ctx.get_files(f"test_incremental@{i}", part) for part in range(2)]
+            for i in range(4)
+        ]
+
+    run_pipeline(ctx, "test_incremental", make_pipeline(10), fuse=False)
+    first = snapshot()
+
+    # Nothing changed: every part is skipped
+    run_pipeline(ctx, "test_incremental", make_pipeline(10), fuse=False)
+    assert snapshot() == first
+
+    # Only the last stage changed: only it is recomputed
+    run_pipeline(ctx, "test_incremental", make_pipeline(100), fuse=False)
+    second = snapshot()
+    assert second[:3] == first[:3]
+    assert second[3] != first[3]
+
+
+def test_pipeline_incremental_globals():
+    global FACTOR
+    schema = {
+        "type": "record",
+        "name": "User",
+        "fields": [{"name": "a", "type": "int"}],
+    }
+    pipeline = [
+        Const(items=[{"a": i} for i in range(5)], avro_schema=schema),
+        FlatMap(fn=scale, avro_schema=schema),
+    ]
+    dbname = "/tmp/test_incremental_globals.db"
+    if os.path.exists(dbname):
+        os.remove(dbname)
+    ctx = LightningCtx(dbname, "/tmp/")
+
+    def output():
+        files = ctx.get_files("test_incremental_globals@1", 0)
+        paths = [os.path.join("/tmp/test_incremental_globals@1", f) for f in files]
+        return [row["a"] for row in iterrows(paths)]
+
+    try:
+        run_pipeline(ctx, "test_incremental_globals", pipeline, fuse=False)
+        assert output() == [0, 2, 4, 6, 8]
+
+        # Changing a global read by the function recomputes the stage
+        FACTOR = 100
+        run_pipeline(ctx, "test_incremental_globals", pipeline, fuse=False)
+        assert output() == [0, 100, 200, 300, 400]
+    finally:
+        FACTOR = 2
+
+
+def test_fingerprint_values():
+    np = pytest.importorskip("numpy")
+    schema = {
+        "type": "record",
+        "name": "User",
+        "fields": [{"name": "a", "type": "double"}],
+    }
+    weights = np.arange(10_000.0)
+
+    def stage():
+        return FlatMap(
+            fn=lambda row: [{"a": weights[int(row["a"])]}], avro_schema=schema
+        )
+
+    before = fingerprint_stage(stage())
+    assert fingerprint_stage(stage()) == before
+    # An element that repr() elides
+    weights[5000] = -1
+    assert fingerprint_stage(stage()) != before
+
+    # Objects that cannot be fingerprinted are not fingerprinted by their repr
+    lock = threading.Lock()
+    locked = FlatMap(fn=lambda row: [row] if lock else [], avro_schema=schema)
+    with pytest.raises(TypeError):
+        fingerprint_stage(locked)
+    pipeline = [Const(items=[{"a": 1.0}], avro_schema=schema), locked]
+    dbname = "/tmp/test_fingerprint_values.db"
+    if os.path.exists(dbname):
+        os.remove(dbname)
+    ctx = LightningCtx(dbname, "/tmp/")
+    with pytest.raises(TypeError):
+        run_pipeline(ctx, "test_fingerprint_values", pipeline, fuse=False)
+    run_pipeline(
+        ctx, "test_fingerprint_values", pipeline, fuse=False, incremental=False
+    )
+    assert ctx.get_files("test_fingerprint_values@1", 0)
+
+
+def test_pipeline_stats():
+    schema = {
+        "type": "record",
+        "name": "User",
+        "fields": [
+            {"name": "a", "type": "int"},
+            {"name": "b", "type": ["null", "string"]},
+        ],
+    }
+    items = [{"a": i, "b": None if i % 3 == 0 else str(i)} for i in range(30)]
+    pipeline = [
+        Const(items=items, avro_schema=schema, column_stats=True),
+        Shuffle(nparts=3, key="a", avro_schema=schema, column_stats=True),
+        Shuffle(nparts=2, key="a", avro_schema=schema),
+    ]
+    dbname = "/tmp/test_stats.db"
+    if os.path.exists(dbname):
+        os.remove(dbname)
+    ctx = LightningCtx(dbname, "/tmp/")
+    run_pipeline(ctx, "test_stats", pipeline)
+
+    (const_stats,) = ctx.get_stats("test_stats@0", 0).values()
+    assert const_stats.rows == 30
+    assert const_stats.bytes == os.path.getsize(
+        os.path.join("/tmp/test_stats@0", const_stats.file)
+    )
+    assert const_stats.raw_bytes > 0
+    assert const_stats.columns["a"].min == 0
+    assert const_stats.columns["a"].max == 29
+    assert const_stats.columns["b"].nulls == 10
+
+    part_stats = ctx.get_part_stats("test_stats@1")
+    assert sum(s.rows for s in part_stats.values()) == 30
+    assert sum(s.columns["b"].nulls for s in part_stats.values()) == 10
+
+    # By default, only the key gets column statistics
+    part_stats = ctx.get_part_stats("test_stats@2")
+    assert sum(s.rows for s in part_stats.values()) == 30
+    assert all(list(s.columns) == ["a"] for s in part_stats.values())
+    assert min(s.columns["a"].min for s in part_stats.values()) == 0
+
+
+def test_pipeline_metrics():
+    schema = {
+        "type": "record",
+        "name": "User",
+        "fields": [{"name": "a", "type": "int"}],
+    }
+    pipeline = [
+        Const(items=[{"a": i} for i in range(100)], avro_schema=schema),
+        Shuffle(nparts=2, key="a", avro_schema=schema, max_workers=1),
+        FlatMap(fn=lambda row: [row, row], avro_schema=schema),
+    ]
+    dbname = "/tmp/test_metrics.db"
+    if os.path.exists(dbname):
+        os.remove(dbname)
+    ctx = LightningCtx(dbname, "/tmp/")
+    run_pipeline(ctx, "test_metrics", pipeline, profile=True)
+
+    (shuffle,) = ctx.get_metrics("test_metrics@1").values()
+    assert shuffle.rows_in == 100
+    assert shuffle.rows_out == 100
+    assert shuffle.bytes_out > 0
+
+    metrics = ctx.get_metrics("test_metrics@2")
+    assert sorted(metrics) == [0, 1]
+    assert sum(m.rows_in for m in metrics.values()) == 100
+    assert sum(m.rows_out for m in metrics.values()) == 200
+    for m in metrics.values():
+        assert m.bytes_in > 0 and m.bytes_out > 0
+        assert m.seconds >= m.read_seconds + m.decode_seconds + m.encode_seconds
+        assert "function calls" in m.profile
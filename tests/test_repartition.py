@@ -0,0 +1,80 @@
+import os
+
+from lightningdb.rw.read_df import iterrows
+from lightningdb.stages.const import Const
+from lightningdb.stages.repartition import Repartition
+
+schema = {
+    "type": "record",
+    "name": "Event",
+    "fields": [
+        {"name": "user", "type": ["null", "long"]},
+        {"name": "payload", "type": "string"},
+    ],
+}
+
+# Half of the rows belong to user 0
+rows = [
+    {"user": 0 if i % 2 == 0 else i % 500, "payload": "x" * 20} for i in range(8000)
+]
+rows += [{"user": None, "payload": "null"}]
+
+
+def write_input(dir: str) -> list[list[str]]:
+    input_pfiles = []
+    for part, chunk in enumerate([rows[:6000], rows[6000:]]):
+        part_dir = os.path.join(dir, str(part))
+        files = Const(items=chunk, avro_schema=schema).run([], part_dir)
+        input_pfiles.append([os.path.join(part_dir, f) for f in files])
+    return input_pfiles
+
+
+def read_parts(dir: str, output_pfiles: list[list[str]]) -> list[list[dict]]:
+    return [
+        list(iterrows([os.path.join(dir, f) for f in files])) for files in output_pfiles
+    ]
+
+
+def test_repartition_hash_spreads_heavy_keys():
+    input_pfiles = write_input("/tmp/test_repartition_in")
+    stage = Repartition(keys=["user"], avro_schema=schema, nparts=4, max_workers=1)
+    dir = "/tmp/test_repartition_hash"
+    parts = read_parts(dir, stage.runall(input_pfiles, dir))
+
+    assert sorted(map(str, (r for p in parts for r in p))) == sorted(map(str, rows))
+    # A plain hash partitioning would put more than half of the rows in one part
+    assert max(len(p) for p in parts) < 0.35 * len(rows)
+    # Light keys stay in a single part
+    for user in [1, 3, 499]:
+        assert sum(any(r["user"] == user for r in p) for p in parts) == 1
+
+
+def test_repartition_range_and_nparts():
+    input_pfiles = write_input("/tmp/test_repartition_in")
+    stage = Repartition(
+        keys=["user"],
+        avro_schema=schema,
+        mode="range",
+        target_part_bytes=sum(os.path.getsize(f) for f in sum(input_pfiles, [])) // 5,
+        max_workers=1,
+    )
+    dir = "/tmp/test_repartition_range"
+    parts = read_parts(dir, stage.runall(input_pfiles, dir))
+
+    assert len(parts) in (5, 6)
+    assert sum(len(p) for p in parts) == len(rows)
+    assert max(len(p) for p in parts) < 0.35 * len(rows)
+    # Ranges are ordered, with nulls last
+    key = lambda r: (r["user"] is None, r["user"])  # noqa: E731
+    for prev, next in zip(parts, parts[1:]):
+        if prev and next:
+            assert max(map(key, prev)) <= min(map(key, next))
+    assert parts[-1][-1]["user"] is None
+
+
+def test_repartition_seeds_map_tasks():
+    stage = Repartition(keys=["user"], avro_schema=schema)
+    router = stage.plan([(((False, 0),), 3.0), (((False, 1),), 1.0)], nparts=4)
+    # Every map task starts the round-robin of a heavy key on a different part
+    first = [router.seeded(part).partition({"user": 0}) for part in range(3)]
+    assert len(set(first)) == 3
@@ -0,0 +1,190 @@
+import os
+
+import boto3
+import pytest
+
+from lightningdb.rw import read_wrapper, s3cache, s3utils, sample, write_wrapper
+from lightningdb.rw.metrics import measuring
+from lightningdb.rw.read_df import iterrows, split_file
+from lightningdb.rw.read_wrapper import ReadWrapper
+from lightningdb.rw.s3cache import configure_cache
+from lightningdb.rw.sample import count_records
+from lightningdb.rw.write_avro import WriteAvro, WriteOptions
+from lightningdb.rw.write_df import WriteDF
+from lightningdb.rw.write_wrapper import WriteWrapper
+
+moto = pytest.importorskip("moto")
+
+schema = {
+    "type": "record",
+    "name": "User",
+    "fields": [{"name": "name", "type": "string"}, {"name": "age", "type": "int"}],
+}
+
+
+@pytest.fixture
+def bucket(monkeypatch):
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "testing")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "testing")
+    monkeypatch.setenv("AWS_DEFAULT_REGION", "us-east-1")
+    monkeypatch.setattr(s3utils, "_client", None)
+    with moto.mock_aws():
+        boto3.client("s3").create_bucket(Bucket="test")
+        yield "test"
+
+
+def test_streaming_read(bucket, monkeypatch):
+    # Small chunks so that every file is fetched with several ranged GETs
+    monkeypatch.setattr(read_wrapper, "CHUNK_SIZE", 256)
+    monkeypatch.setattr(read_wrapper, "READ_AHEAD", 2)
+
+    expected = []
+    files = []
+    for i in range(3):
+        path = f"/tmp/test_s3_{i}.avro"
+        writer = WriteAvro(path, schema)
+        for j in range(1000):
+            row = {"name": f"user{i}-{j}", "age": j}
+            writer.append(row)
+            expected.append(row)
+        writer.close()
+        with open(path, "rb") as f:
+            boto3.client("s3").put_object(Bucket=bucket, Key=f"df/{i}.avro", Body=f)
+        os.remove(path)
+        files.append(f"s3://{bucket}/df/{i}.avro")
+
+    assert list(iterrows(files, prefetch=1)) == expected
+
+
+def test_multipart_upload(bucket, monkeypatch):
+    monkeypatch.setattr(write_wrapper, "PART_SIZE", 5 * 1024 * 1024)
+    monkeypatch.setattr(write_wrapper, "MAX_IN_FLIGHT", 2)
+
+    data = os.urandom(12 * 1024 * 1024)
+    uri = f"s3://{bucket}/big.bin"
+    with WriteWrapper(uri) as f:
+        for i in range(0, len(data), 1024 * 1024):
+            f.write(data[i : i + 1024 * 1024])
+    assert f.size == len(data)
+
+    parts = boto3.client("s3").head_object(Bucket=bucket, Key="big.bin", PartNumber=1)
+    assert parts["PartsCount"] == 3
+
+    reader = ReadWrapper(uri)
+    assert reader.read() == data
+    reader.close()
+
+
+def test_write_and_read_avro_s3(bucket):
+    uri = f"s3://{bucket}/small.avro"
+    rows = [{"name": "Alice", "age": 30}, {"name": "Bob", "age": 25}]
+    writer = WriteAvro(uri, schema)
+    for row in rows:
+        writer.append(row)
+    writer.close()
+    assert list(iterrows([uri])) == rows
+
+
+def test_failed_write_is_not_published(bucket):
+    uri = f"s3://{bucket}/failed.bin"
+    with pytest.raises(RuntimeError):
+        with WriteWrapper(uri) as f:
+            f.write(b"partial")
+            raise RuntimeError()
+    objects = boto3.client("s3").list_objects_v2(Bucket=bucket, Prefix="failed")
+    assert objects["KeyCount"] == 0
+
+
+def test_failed_write_aborts_multipart_upload(bucket, monkeypatch):
+    monkeypatch.setattr(write_wrapper, "PART_SIZE", 1024)
+    s3 = boto3.client("s3")
+    with pytest.raises(TypeError):
+        with WriteDF(f"s3://{bucket}/df", schema) as writer:
+            writer.extend(
+                [{"name": os.urandom(8).hex(), "age": i} for i in range(5000)]
+            )
+            writer.append({"name": "bad", "age": "not an int"})
+    assert writer.files == []
+    assert "Uploads" not in s3.list_multipart_uploads(Bucket=bucket)
+    assert s3.list_objects_v2(Bucket=bucket, Prefix="df")["KeyCount"] == 0
+
+
+def test_s3_cache(bucket, tmp_path, monkeypatch):
+    cache_dir = str(tmp_path / "cache")
+    configure_cache(cache_dir, max_bytes=1000)
+    try:
+        # Written files are copied to the cache as they are uploaded
+        uri = f"s3://{bucket}/cached.bin"
+        with WriteWrapper(uri) as f:
+            f.write(b"a" * 400)
+        cache = s3cache.get_cache()
+        assert cache.size() == 400
+
+        with measuring() as metrics:
+            reader = ReadWrapper(uri)
+            assert reader.read() == b"a" * 400
+            reader.close()
+        assert (cache.hits, cache.misses) == (1, 0)
+        assert (metrics.cache_hits, metrics.cache_misses) == (1, 0)
+
+        # A new version of the object has a new ETag and is read from S3, then cached
+        boto3.client("s3").put_object(Bucket=bucket, Key="cached.bin", Body=b"b" * 400)
+        for _ in range(2):
+            reader = ReadWrapper(uri)
+            assert reader.read() == b"b" * 400
+            reader.close()
+        assert (cache.hits, cache.misses) == (2, 1)
+
+        # The least recently used version is evicted above the size limit
+        assert cache.size() == 800
+        with WriteWrapper(f"s3://{bucket}/other.bin") as f:
+            f.write(b"c" * 400)
+        assert cache.size() == 800
+        reader = ReadWrapper(uri)
+        assert reader.read() == b"b" * 400
+        reader.close()
+        assert cache.hits == 3
+    finally:
+        configure_cache(None)
+
+
+def test_block_range_read(bucket, monkeypatch):
+    monkeypatch.setattr(read_wrapper, "HEADER_SIZE", 16)
+    rows = [{"name": f"user{i}", "age": i} for i in range(3000)]
+    writer = WriteDF(
+        f"s3://{bucket}/blocks", schema, options=WriteOptions(block_size=1000)
+    )
+    writer.extend(rows)
+    writer.close()
+    (stats,) = writer.stats
+
+    uri = f"s3://{bucket}/blocks/{stats.file}"
+    splits = split_file(uri, stats, stats.bytes // 3)
+    assert len(splits) >= 3
+    assert sum((list(iterrows([split])) for split in splits), []) == rows
+
+
+def test_count_s3_records(bucket, monkeypatch):
+    uri = f"s3://{bucket}/count.avro"
+    writer = WriteAvro(uri, schema, WriteOptions(block_size=2000))
+    for i in range(3000):
+        writer.append({"name": f"user{i}", "age": i})
+    writer.close()
+    size = s3utils.get_size(uri)
+
+    read_bytes = []
+    read_range = sample.read_range
+
+    def counting_read_range(s3, bucket, key, start, end, etag=None):
+        data = read_range(s3, bucket, key, start, end, etag)
+        read_bytes.append(len(data))
+        return data
+
+    monkeypatch.setattr(sample, "read_range", counting_read_range)
+    # GETs shorter than a block, cutting block headers, and holding several blocks
+    for read_size in [24, 100, 5000]:
+        monkeypatch.setattr(sample, "COUNT_READ_SIZE", read_size)
+        read_bytes.clear()
+        assert count_records(uri) == 3000
+        if read_size < 1000:
+            assert sum(read_bytes) < size / 2
@@ -0,0 +1,83 @@
+import os
+
+import pytest
+
+from lightningdb.df import LightningCtx
+from lightningdb.pipeline import run_pipeline
+from lightningdb.rw.sample import count_records, head_uris
+from lightningdb.rw.write_avro import WriteOptions
+from lightningdb.stages.const import Const
+from lightningdb.stages.shuffle import Shuffle
+
+schema = {
+    "type": "record",
+    "name": "Row",
+    "fields": [{"name": "x", "type": "long"}, {"name": "s", "type": "string"}],
+}
+
+
+@pytest.fixture
+def ctx():
+    dbname = "/tmp/test_sample.db"
+    if os.path.exists(dbname):
+        os.remove(dbname)
+    ctx = LightningCtx(dbname, "/tmp/")
+    items = [{"x": i, "s": f"row {i}"} for i in range(2000)]
+    pipeline = [
+        Const(
+            items=items,
+            avro_schema=schema,
+            write_options=WriteOptions(block_size=1000),
+        ),
+        Shuffle(nparts=3, key="x", avro_schema=schema),
+    ]
+    run_pipeline(ctx, "test_sample", pipeline)
+    return ctx
+
+
+def test_head(ctx):
+    rows = ctx.head("test_sample@0", 5)
+    assert [row["x"] for row in rows] == [0, 1, 2, 3, 4]
+    assert ctx.head("test_sample@0", 5, columns=["x"])[0] == {"x": 0}
+    assert len(ctx.head("test_sample@1", 1500)) == 1500
+    assert len(ctx.head("test_sample@1", 5000)) == 2000
+    assert ctx.head("test_sample@1", 0) == []
+
+    # Only the leading blocks are read
+    (file,) = ctx.get_files("test_sample@0", 0)
+    stats = ctx.get_stats("test_sample@0", 0)
+    assert len(stats[file].blocks) > 2
+    (uri,) = head_uris([file], stats, 5)
+    blocks = stats[file].blocks
+    assert uri == f"{file}#{blocks[0][0]}-{blocks[1][0]}"
+
+
+def test_count(ctx):
+    assert ctx.count("test_sample@0") == 2000
+    assert ctx.count("test_sample@1") == 2000
+
+    # Files without statistics are counted from their block headers
+    (file,) = ctx.get_files("test_sample@0", 0)
+    assert count_records(os.path.join("/tmp/test_sample@0", file)) == 2000
+
+
+def test_sample(ctx):
+    rows = ctx.sample("test_sample@1", n=100, seed=1)
+    xs = [row["x"] for row in rows]
+    assert len(set(xs)) == 100
+    assert [row["x"] for row in ctx.sample("test_sample@1", n=100, seed=1)] == xs
+    assert [row["x"] for row in ctx.sample("test_sample@1", n=100, seed=2)] != xs
+    assert len(ctx.sample("test_sample@1", n=5000)) == 2000
+
+    rows = ctx.sample("test_sample@1", fraction=0.25, seed=1)
+    assert 350 < len(rows) < 650
+    assert len({row["x"] for row in rows}) == len(rows)
+
+    rows = ctx.sample("test_sample@0", fraction=0.5, seed=1, by_block=True)
+    assert 0 < len(rows) < 2000
+    assert len({row["x"] for row in rows}) == len(rows)
+
+    with pytest.raises(ValueError):
+        ctx.sample("test_sample@1")
+    with pytest.raises(ValueError):
+        ctx.sample("test_sample@1", n=10, fraction=0.5)
@@ -0,0 +1,58 @@
+import os
+
+from lightningdb.rw.read_df import iterrows
+from lightningdb.rw.write_df import WriteDF
+from lightningdb.stages.shuffle import Shuffle, to_part
+
+schema = {
+    "type": "record",
+    "name": "User",
+    "fields": [{"name": "a", "type": "int"}, {"name": "b", "type": "string"}],
+}
+
+
+def write_parts(dir: str, nparts: int, rows_per_part: int) -> list[list[str]]:
+    input_pfiles = []
+    for part in range(nparts):
+        writer = WriteDF(dir, schema)
+        for i in range(rows_per_part):
+            a = part * rows_per_part + i
+            writer.append({"a": a, "b": str(a)})
+        writer.close()
+        input_pfiles.append([os.path.join(dir, file) for file in writer.files])
+    return input_pfiles
+
+
+def test_to_part_is_stable():
+    # Must not depend on the interpreter's hash seed
+    assert [to_part({"k": k}, "k", 7) for k in ["a", "b", 3]] == [4, 4, 6]
+
+
+def test_parallel_shuffle():
+    input_pfiles = write_parts("/tmp/test_shuffle_in", 3, 100)
+    output_dir = "/tmp/test_shuffle_out"
+    stage = Shuffle(nparts=4, key="a", avro_schema=schema, max_workers=3)
+    output_pfiles = stage.runall(input_pfiles, output_dir)
+
+    assert len(output_pfiles) == 4
+    seen = []
+    for part, files in enumerate(output_pfiles):
+        rows = list(iterrows([os.path.join(output_dir, file) for file in files]))
+        assert all(to_part(row, "a", 4) == part for row in rows)
+        seen.extend(row["a"] for row in rows)
+    assert sorted(seen) == list(range(300))
+
+
+def test_memory_bounded_shuffle():
+    input_pfiles = write_parts("/tmp/test_shuffle_spill_in", 2, 1000)
+    output_dir = "/tmp/test_shuffle_spill_out"
+    # A tiny budget forces many spills
+    stage = Shuffle(nparts=50, key="a", avro_schema=schema, memory_budget=1000)
+    output_pfiles = stage.runall(input_pfiles, output_dir)
+
+    seen = []
+    for part, files in enumerate(output_pfiles):
+        rows = list(iterrows([os.path.join(output_dir, file) for file in files]))
+        assert all(to_part(row, "a", 50) == part for row in rows)
+        seen.extend(row["a"] for row in rows)
+    assert sorted(seen) == list(range(2000))
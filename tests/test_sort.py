@@ -0,0 +1,74 @@
+import os
+
+from lightningdb.df import LightningCtx
+from lightningdb.pipeline import run_pipeline
+from lightningdb.rw.read_df import iterrows
+from lightningdb.stages import sort as sort_module
+from lightningdb.stages.const import Const
+from lightningdb.stages.sort import GlobalSort, Sort, sort_key, sort_rows
+
+schema = {
+    "type": "record",
+    "name": "Row",
+    "fields": [
+        {"name": "a", "type": ["null", "long"]},
+        {"name": "b", "type": "string"},
+    ],
+}
+
+
+def test_external_sort(monkeypatch):
+    monkeypatch.setattr(sort_module, "MERGE_FANIN", 3)
+    rows = [{"a": (i * 7919) % 1000, "b": str(i)} for i in range(5000)]
+    rows += [{"a": None, "b": "null"}]
+
+    # A tiny budget forces many runs and intermediate merges
+    result = list(sort_rows(iter(rows), sort_key(["a"]), False, schema, 2000))
+    assert result == sorted(rows, key=sort_key(["a"]))
+    assert result[-1]["a"] is None
+
+    result = list(sort_rows(iter(rows), sort_key(["b", "a"]), True, schema, 2000))
+    assert result == sorted(rows, key=sort_key(["b", "a"]), reverse=True)
+
+
+def test_sort_stages():
+    rows = [{"a": (i * 7919) % 1000, "b": str(i)} for i in range(3000)]
+    dbname = "/tmp/test_sort.db"
+    if os.path.exists(dbname):
+        os.remove(dbname)
+    ctx = LightningCtx(dbname, "/tmp/")
+
+    run_pipeline(
+        ctx,
+        "test_sort",
+        [
+            Const(items=rows, avro_schema=schema),
+            Sort(keys=["a", "b"], avro_schema=schema, memory_budget=10_000),
+        ],
+    )
+    files = [
+        os.path.join("/tmp/test_sort@1", f) for f in ctx.get_files("test_sort@1", 0)
+    ]
+    assert list(iterrows(files)) == sorted(rows, key=sort_key(["a", "b"]))
+
+    run_pipeline(
+        ctx,
+        "test_global_sort",
+        [
+            Const(items=rows, avro_schema=schema),
+            GlobalSort(
+                nparts=4,
+                keys=["a"],
+                avro_schema=schema,
+                descending=True,
+                sample_size=100,
+                max_workers=1,
+            ),
+        ],
+    )
+    result = []
+    for part in range(ctx.get_nparts("test_global_sort@1")):
+        files = ctx.get_files("test_global_sort@1", part)
+        assert files
+        result += iterrows([os.path.join("/tmp/test_global_sort@1", f) for f in files])
+    assert result == sorted(rows, key=sort_key(["a"]), reverse=True)
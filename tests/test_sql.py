@@ -0,0 +1,174 @@
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+
+import pytest
+
+from lightningdb.df import LightningCtx
+from lightningdb.pipeline import run_pipeline
+from lightningdb.rw.metrics import measuring
+from lightningdb.slots import node_slot
+from lightningdb.stages import sql
+from lightningdb.stages.const import Const
+from lightningdb.stages.shuffle import Shuffle
+from lightningdb.stages.sql import Sql, format_s3_uri, input_view_query, outfile_query
+
+# Stands in for the clickhouse binary: logs its arguments, fails on inputs named
+# fail.avro, writes the INTO OUTFILE files of its queries, or else writes its result
+# to stdout
+STUB = """#!{python}
+import json, re, sys
+with open({log!r}, "a") as log:
+    log.write(json.dumps(sys.argv[1:]) + "\\n")
+if any("fail.avro" in arg for arg in sys.argv):
+    sys.exit(1)
+outfiles = re.findall(r"into outfile '([^']+)'", " ".join(sys.argv[1:]))
+for path in outfiles:
+    with open(path, "wb") as f:
+        f.write(path.encode())
+if not outfiles:
+    sys.stdout.write("result")
+"""
+
+S3_FILES = ["s3://bucket/a.avro", "s3://bucket/b.avro"]
+S3_VIEW = (
+    "create view input as select * from s3('{https://bucket.s3.amazonaws.com/a.avro,"
+    "https://bucket.s3.amazonaws.com/b.avro}')"
+)
+
+
+@pytest.fixture
+def clickhouse(tmp_path, monkeypatch):
+    log = tmp_path / "calls.jsonl"
+    stub = tmp_path / "clickhouse"
+    stub.write_text(STUB.format(python=sys.executable, log=str(log)))
+    stub.chmod(0o755)
+    monkeypatch.setattr(sql, "CLICKHOUSE", str(stub))
+    monkeypatch.setattr(sql, "get_size", lambda uri: 100)
+
+    def calls() -> list[list[str]]:
+        return [json.loads(line) for line in log.read_text().splitlines()]
+
+    return calls
+
+
+def queries(argv: list[str]) -> list[str]:
+    return [argv[i + 1] for i, arg in enumerate(argv) if arg == "--query"]
+
+
+def test_format_s3_uri():
+    assert (
+        format_s3_uri("s3://bucket/a/b.avro")
+        == "https://bucket.s3.amazonaws.com/a/b.avro"
+    )
+    assert format_s3_uri("/tmp/a.avro") == "/tmp/a.avro"
+
+
+def test_outfile_query():
+    expected = "select * from (\nselect a from input\n) into outfile '/o' format Avro"
+    assert outfile_query("select a from input", "/o") == expected
+    assert outfile_query(" select a from input;\n", "/o") == expected
+    assert outfile_query("select a from input FORMAT JSONEachRow;", "/o") == expected
+    assert outfile_query("select a from input settings max_threads = 1", "/o") == (
+        "select * from (\nselect a from input settings max_threads = 1\n)"
+        " into outfile '/o' format Avro"
+    )
+    with pytest.raises(ValueError):
+        input_view_query([])
+
+
+def test_group_small_parts():
+    stage = Sql(sql="select 1", small_part_bytes=100)
+    assert stage._group_parts([40, 50, None, 30, 200, 10]) == [[0, 1], [3], [4], [5]]
+    assert Sql(sql="select 1")._group_parts([1, 2, None]) == [[0], [1]]
+
+
+def test_node_slot_limit():
+    active = []
+    peak = []
+    lock = threading.Lock()
+
+    def work():
+        with node_slot("test_node_slot_limit", 2):
+            with lock:
+                active.append(1)
+                peak.append(len(active))
+            time.sleep(0.05)
+            with lock:
+                active.pop()
+
+    threads = [threading.Thread(target=work) for _ in range(6)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert max(peak) == 2
+
+
+def test_run_s3_part(clickhouse, tmp_path):
+    stage = Sql(sql="select * from input")
+    output_dir = str(tmp_path / "run")
+    with measuring() as metrics:
+        (output,) = stage.run(S3_FILES, output_dir)
+    assert metrics.bytes_in == 200
+    assert metrics.bytes_out == len("result")
+    with open(os.path.join(output_dir, output), "rb") as f:
+        assert f.read() == b"result"
+    (argv,) = clickhouse()
+    assert queries(argv) == [S3_VIEW, "select * from input"]
+
+
+def test_runall_s3_parts(clickhouse, tmp_path):
+    output_dir = str(tmp_path / "runall")
+    local = [str(tmp_path / "c.avro")]
+
+    # One process per part, then both parts packed in one process
+    for small_part_bytes, processes in [(None, 2), (1000, 1)]:
+        stage = Sql(sql="select * from input;", small_part_bytes=small_part_bytes)
+        output_pfiles = stage.runall([S3_FILES, local], output_dir)
+        assert all(len(files) == 1 for files in output_pfiles)
+        calls = clickhouse()[-processes:]
+        views = [q for argv in calls for q in queries(argv) if "view input as" in q]
+        assert sorted(views) == [
+            f"create view input as select * from file('{local[0]}')",
+            S3_VIEW,
+        ]
+
+
+def test_iterall_keeps_finished_parts(clickhouse, tmp_path):
+    stage = Sql(sql="select * from input")
+    input_pfiles = [[str(tmp_path / "a.avro")], [str(tmp_path / "fail.avro")], []]
+    results = []
+    with pytest.raises(subprocess.CalledProcessError):
+        for part, files, metrics in stage.iterall(input_pfiles, str(tmp_path)):
+            results.append((part, len(files), metrics.bytes_in, metrics.bytes_out))
+    assert sorted(results) == [(0, 1, 100, len("result")), (2, 0, 0, 0)]
+
+
+def test_pipeline_sql_metrics(clickhouse, tmp_path):
+    schema = {
+        "type": "record",
+        "name": "User",
+        "fields": [{"name": "a", "type": "int"}],
+    }
+    pipeline = [
+        Const(items=[{"a": i} for i in range(10)], avro_schema=schema),
+        Shuffle(nparts=3, key="a", avro_schema=schema),
+        Sql(sql="select * from input", small_part_bytes=200),
+    ]
+    ctx = LightningCtx(str(tmp_path / "test.db"), str(tmp_path / "repo"))
+    run_pipeline(ctx, "test_sql", pipeline)
+
+    # The Sql parts are committed and measured one by one
+    assert all(ctx.get_files("test_sql@2", part) for part in range(3))
+    metrics = ctx.get_metrics("test_sql@2")
+    assert sorted(metrics) == [0, 1, 2]
+    assert all(m.bytes_in == 100 and m.bytes_out > 0 for m in metrics.values())
+
+    # Re-runs skip the parts already computed
+    ncalls = len(clickhouse())
+    run_pipeline(ctx, "test_sql", pipeline)
+    assert len(clickhouse()) == ncalls